@@ -1,39 +1,322 @@
 import dash_bootstrap_components as dbc
-from dash import dcc, html, Input, Output
+from dash import dcc, html, Input, Output, Patch, State
 import dash
-from flask import Flask
+from flask import Flask, Response, request
 import numpy as np
 import plotly.graph_objs as go
 import pandas as pd
 import plotly.express as px
 import geopandas as gpd
 import shapely
+import copy
+import functools
+import itertools
+import io
 import json
+import logging
 import os
+import sys
+import time
+
+# Los módulos compartidos con el procesado de datos viven en scripts/
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+import clustering  # noqa: E402
+import columnar_store  # noqa: E402
+import figure_snapshots  # noqa: E402
+import metrics  # noqa: E402
+from columnar_store import CATEGORY, GEOMETRY, NUMERIC  # noqa: E402
+from compact_dtypes import (  # noqa: E402
+    SALE_DTYPES,
+    compact_frame,
+    default_memory_mb,
+    memory_mb,
+)
+from box_stats import (
+    box_summaries,
+    neighborhood_price_summary,
+    sort_order,
+)  # noqa: E402
+from compression import enable_compression  # noqa: E402
+from figure_cache import figure_cache  # noqa: E402
+from figure_encoding import compact_figure, round_geojson  # noqa: E402
+from figure_patch import patch_figure  # noqa: E402
+from filter_index import FilterIndex  # noqa: E402
+from comparables import N_COMPARABLES, ComparablesIndex  # noqa: E402
+from correlation import CorrelationStats, numeric_columns  # noqa: E402
+from correlation_index import PriceCorrelationIndex  # noqa: E402
+from cube import Cube  # noqa: E402
+from listing_scoring import ClusterScorer  # noqa: E402
+from lod import LevelOfDetail  # noqa: E402
+from neighborhoods import NeighborhoodStats  # noqa: E402
+from pipeline import read_timings  # noqa: E402
+from shared_data import (  # noqa: E402
+    SHARED_DATA_DIR,
+    freeze_loaded_objects,
+    load_shared_csv,
+    share_columns,
+)
+
+logger = logging.getLogger(__name__)
+
+# Para medir el tiempo de arranque (ver metrics.py)
+startup_start = time.perf_counter()
 
 # Importar los datos
-data_dir = os.path.join(os.path.dirname(__file__), "..", "data")
+data_dir = os.environ.get("DATA_DIR") or os.path.join(
+    os.path.dirname(__file__), "..", "data"
+)
+store_dir = os.path.join(data_dir, "store")
+snapshot_dir = os.path.join(data_dir, "snapshots")
+
+# Columnas que la app necesita de cada tabla
+VALENCIA_SALE_SCHEMA = {
+    "LATITUDE": NUMERIC,
+    "LONGITUDE": NUMERIC,
+    "CONSTRUCTEDAREA": NUMERIC,
+    "PRICE": NUMERIC,
+    "ROOMNUMBER": NUMERIC,
+    "AGE": NUMERIC,
+    "CADASTRALQUALITYID": NUMERIC,
+    "BUILTTYPEID_1": NUMERIC,
+    "BUILDTYPE": CATEGORY,
+    "NEIGHBORHOOD": CATEGORY,
+    "TRIMESTER": CATEGORY,
+}
+VALENCIA_SALE_CLUSTERED_SCHEMA = {"CLUSTER": NUMERIC}
+VALENCIA_POLYGONS_SCHEMA = {
+    "NEIGHBORHOOD": CATEGORY,
+    "GEO_SHAPE": GEOMETRY,
+    "REAL_ESTATE_TOTAL": NUMERIC,
+    "PRICE_MEAN": NUMERIC,
+    "AGE_MEAN": NUMERIC,
+    "QUALITY_MEAN": NUMERIC,
+}
+VALENCIA_METRO_SCHEMA = {"LATITUDE": NUMERIC, "LONGITUDE": NUMERIC}
+VALENCIA_PRICE_SUMMARY_SCHEMA = {
+    "NEIGHBORHOOD": CATEGORY,
+    "COUNT": NUMERIC,
+    "MEAN": NUMERIC,
+    "Q1": NUMERIC,
+    "MEDIAN": NUMERIC,
+    "Q3": NUMERIC,
+    "LOWER_FENCE": NUMERIC,
+    "UPPER_FENCE": NUMERIC,
+}
+VALENCIA_PRICE_OUTLIERS_SCHEMA = {"NEIGHBORHOOD": CATEGORY, "PRICE": NUMERIC}
+VALENCIA_SALE_CUBE_SCHEMA = {
+    "NEIGHBORHOOD": CATEGORY,
+    "TRIMESTER": CATEGORY,
+    "ROOMNUMBER": NUMERIC,
+    "BUILDTYPE": CATEGORY,
+    "PRICE_BUCKET": NUMERIC,
+    "AREA_BUCKET": NUMERIC,
+    "COUNT": NUMERIC,
+    "PRICE_N": NUMERIC,
+    "PRICE_SUM": NUMERIC,
+    "PRICE_SUMSQ": NUMERIC,
+    "CONSTRUCTEDAREA_N": NUMERIC,
+    "CONSTRUCTEDAREA_SUM": NUMERIC,
+    "CONSTRUCTEDAREA_SUMSQ": NUMERIC,
+}
+
+
+# Origen de cada tabla cargada, para calcular la huella de los datos
+data_sources = {}
+
+
+def read_table(name, schema, geometry=None, dtypes=None):
+    # Primero intentamos el almacén columnar y, si no está o no es válido, el CSV
+    try:
+        df = columnar_store.read_table(store_dir, name, required=schema)
+        data_sources[name] = ("store", columnar_store.table_hash(store_dir, name))
+        return df
+    except (OSError, columnar_store.StoreSchemaError) as error:
+        logger.warning("No se puede usar el almacén columnar de %s (%s)", name, error)
+
+    csv_path = os.path.join(data_dir, f"{name}.csv")
+    if SHARED_DATA_DIR is not None:
+        # Una sola copia por máquina, que todos los workers mapean
+        df = load_shared_csv(name, csv_path, schema, geometry=geometry, dtypes=dtypes)
+        data_sources[name] = ("csv", csv_path)
+        return df
+    df = pd.read_csv(csv_path)
+    data_sources[name] = ("csv", csv_path)
+    if geometry is not None:
+        df[geometry] = shapely.from_wkt(df[geometry])
+    columnar_store.validate_columns(
+        name, columnar_store.frame_kinds(df, geometry=geometry), schema
+    )
+    return df
+
+
+def load_table(name, schema, geometry=None, dtypes=None):
+    # Con ``dtypes`` las columnas pasan a los tipos compactos declarados; las
+    # del almacén ya los tienen y siguen siendo vistas sin copia
+    with metrics.startup_timer("valencia_table_load_seconds", table=name):
+        df = read_table(name, schema, geometry=geometry, dtypes=dtypes)
+        if dtypes is not None:
+            df = compact_frame(df, dtypes)
+    logger.info(
+        "%s: %d filas, %.1f MB en memoria (%.1f MB con los tipos por defecto)",
+        name,
+        len(df),
+        memory_mb(df),
+        default_memory_mb(df),
+    )
+    return df
 
-valencia_sale_path = os.path.join(data_dir, "valencia_sale.csv")
-valencia_barrios_path = os.path.join(data_dir, "valencia_polygons.csv")
-valencia_metro_path = os.path.join(data_dir, "valencia_metro.csv")
-valencia_sale_clustered_path = os.path.join(data_dir, "valencia_sale_clustered.csv")
 
-valencia_sale = pd.read_csv(valencia_sale_path)
-valencia_metro = pd.read_csv(valencia_metro_path)
-valencia_barrios = pd.read_csv(valencia_barrios_path)
-valencia_sale_clustered = pd.read_csv(valencia_sale_clustered_path)
+valencia_sale = load_table("valencia_sale", VALENCIA_SALE_SCHEMA, dtypes=SALE_DTYPES)
+valencia_metro = load_table("valencia_metro", VALENCIA_METRO_SCHEMA)
+valencia_barrios = load_table(
+    "valencia_polygons", VALENCIA_POLYGONS_SCHEMA, geometry="GEO_SHAPE"
+)
+# Los clústeres se guardan como una columna más de valencia_sale en lugar de
+# en una segunda copia de la tabla; -1 en los inmuebles que no se agrupan
+try:
+    valencia_sale["CLUSTER"] = clustering.sale_labels(
+        valencia_sale,
+        load_table("valencia_sale_clustered", VALENCIA_SALE_CLUSTERED_SCHEMA)[
+            "CLUSTER"
+        ],
+    )
+except (OSError, ValueError) as error:
+    # Por ejemplo, tras una ingesta que no ha llegado a recalcular los
+    # clústeres; el reclustering los calcula sobre los inmuebles sin clúster
+    logger.warning("Los inmuebles se cargan sin clúster (%s)", error)
+    valencia_sale["CLUSTER"] = np.full(len(valencia_sale), -1, dtype=np.int8)
+
+# Cuartiles de los precios por barrio que calcula data_processing.py; con datos
+# anteriores a ese paso se calculan al arrancar
+try:
+    valencia_price_summary = load_table(
+        "valencia_price_summary", VALENCIA_PRICE_SUMMARY_SCHEMA
+    )
+    valencia_price_outliers = load_table(
+        "valencia_price_outliers", VALENCIA_PRICE_OUTLIERS_SCHEMA
+    )
+except OSError:
+    logger.warning("No hay resumen de precios por barrio; se calcula al arrancar")
+    valencia_price_summary, valencia_price_outliers = neighborhood_price_summary(
+        valencia_sale, valencia_barrios["NEIGHBORHOOD"]
+    )
+
+# Cubo de cuentas y sumas para los KPIs y los gráficos de barras; con datos
+# anteriores a ese paso se construye al arrancar
+try:
+    valencia_sale_cube = Cube(
+        load_table("valencia_sale_cube", VALENCIA_SALE_CUBE_SCHEMA)
+    )
+except OSError:
+    logger.warning("No hay cubo de inmuebles; se construye al arrancar")
+    valencia_sale_cube = Cube.build(valencia_sale)
+
+# Módulos de los que dependen las figuras y KPIs, además de este fichero
+SNAPSHOT_CODE_MODULES = [
+    "box_stats",
+    "clustering",
+    "compact_dtypes",
+    "correlation",
+    "correlation_index",
+    "cube",
+    "figure_encoding",
+    "lod",
+    "neighborhoods",
+]
+
+# Figuras y KPIs precalculados con scripts/bake_figures.py para estos datos y
+# este código
+data_hash = figure_snapshots.dataset_hash(data_sources)
+snapshot_code_hash = figure_snapshots.code_hash(
+    [__file__, *(sys.modules[name].__file__ for name in SNAPSHOT_CODE_MODULES)]
+)
+snapshot = figure_snapshots.load_snapshot(snapshot_dir, data_hash, snapshot_code_hash)
+# Las figuras guardadas en disco solo valen para estos datos y este código
+figure_cache.use_disk_version(f"{data_hash}-{snapshot_code_hash}")
+if snapshot is None:
+    logger.info(
+        "No hay instantánea para los datos %s y este código; se calculan las "
+        "figuras",
+        data_hash,
+    )
+
+# Índice para resolver los filtros del mapa sin recorrer toda la tabla
+sale_filter_index = FilterIndex(
+    valencia_sale,
+    range_columns=["CONSTRUCTEDAREA", "PRICE"],
+    equality_columns=["ROOMNUMBER"],
+)
+
+
+def cluster_label_column(labels):
+    # Clúster como texto para el gráfico; como categoría, para no crear un
+    # objeto de texto por inmueble en cada worker
+    values = np.unique(labels[labels >= 0])
+    codes = np.where(labels >= 0, np.searchsorted(values, labels), -1)
+    return pd.Categorical.from_codes(codes, categories=[str(v) for v in values])
+
+
+clustered_rows = np.flatnonzero(clustering.clustered_mask(valencia_sale))
+valencia_sale["Cluster"] = cluster_label_column(valencia_sale["CLUSTER"].to_numpy())
+if SHARED_DATA_DIR is not None:
+    # Los clústeres se calculan en cada worker; todos mapean la misma copia
+    cluster_columns = ["CLUSTER", "Cluster"]
+    valencia_sale[cluster_columns] = share_columns(
+        "valencia_sale_clusters", valencia_sale[cluster_columns]
+    )
+
+# Vecinos más cercanos de cada inmueble para buscar comparables
+comparables_index = ComparablesIndex(valencia_sale)
+
+# Nivel de detalle de los mapas de puntos según la vista
+sale_lod = LevelOfDetail(valencia_sale["LONGITUDE"], valencia_sale["LATITUDE"])
+# El mapa de clústeres dibuja las mismas coordenadas, así que comparte las celdas
+clustered_lod = sale_lod
+
+
+def lod_scatter_map(
+    map_function,
+    lod,
+    frame,
+    rows,
+    relayout_data,
+    zoom,
+    columns=(),
+    group=None,
+    row_ids=False,
+    **kwargs,
+):
+    # Con muchos puntos visibles se dibuja una marca por celda, con tamaño
+    # proporcional al número de inmuebles y las medias en el texto flotante
+    data, aggregated = lod.select(
+        frame, rows, relayout_data, zoom, columns=columns, color=group, row_ids=row_ids
+    )
+    if aggregated:
+        kwargs.update(
+            size="COUNT",
+            size_max=25,
+            hover_data={column: ":,.0f" for column in ["COUNT", *columns]},
+            labels={"COUNT": "Inmuebles"},
+        )
+    elif row_ids:
+        # La posición de cada inmueble llega en el clickData
+        kwargs.update(custom_data=["ROW"])
+    figure = map_function(
+        data_frame=data, lat="LATITUDE", lon="LONGITUDE", zoom=zoom, **kwargs
+    )
+    if not aggregated:
+        figure.update_traces(marker=dict(size=5))
+    return figure
 
-# Convertir Cluster a string para el gráfico
-valencia_sale_clustered["Cluster"] = valencia_sale_clustered["CLUSTER"].astype(str)
 
-valencia_barrios["GEO_SHAPE"] = valencia_barrios["GEO_SHAPE"].apply(shapely.wkt.loads)
 valencia_polygons = gpd.GeoDataFrame(
     valencia_barrios, geometry="GEO_SHAPE", crs="EPSG:4326"
 )
 
 geojson_data = valencia_polygons.geometry.to_json()
-geojson_obj = json.loads(geojson_data)
+# Las coordenadas de los polígonos van como texto; con 6 decimales basta
+geojson_obj = round_geojson(json.loads(geojson_data))
 
 for idx, feature in enumerate(geojson_obj["features"]):
     neighborhood_name = valencia_polygons.loc[idx, "NEIGHBORHOOD"]
@@ -42,6 +325,43 @@ for idx, feature in enumerate(geojson_obj["features"]):
 # Inicializar la app
 server = Flask(__name__)
 app = dash.Dash(__name__, server=server, external_stylesheets=[dbc.themes.FLATLY])
+enable_compression(server)
+
+
+def pipeline_metrics():
+    # Las etapas las mide data_processing.py al calcularlas, en su caché
+    entries = []
+    for stage, timing in read_timings(os.path.join(data_dir, "cache")).items():
+        entries.append(
+            ["valencia_pipeline_stage_seconds", {"stage": stage}, timing["seconds"]]
+        )
+        entries.append(
+            [
+                "valencia_pipeline_stage_finished_timestamp_seconds",
+                {"stage": stage},
+                timing["finished"],
+            ]
+        )
+    return entries
+
+
+def figure_cache_metrics():
+    # Cada worker tiene su propia caché en memoria
+    stats = figure_cache.stats()
+    lookups = "valencia_figure_cache_lookups_total"
+    return [
+        [lookups, {"result": "hit"}, stats["hits"]],
+        [lookups, {"result": "disk_hit"}, stats["disk_hits"]],
+        [lookups, {"result": "miss"}, stats["misses"]],
+        ["valencia_figure_cache_bytes", {}, stats["bytes"]],
+        ["valencia_figure_cache_entries", {}, stats["entries"]],
+    ]
+
+
+# Después de la compresión, para medir las respuestas antes de comprimirlas
+metrics.enable_metrics(
+    server, collectors=[pipeline_metrics], process_collectors=[figure_cache_metrics]
+)
 
 # Construcción de los componentes
 
@@ -49,21 +369,41 @@ titulo = html.H1("Análisis del Sector Inmobiliario en Valencia")
 
 # Componentes de la segunda fila
 
+
+def summary_kpis():
+    # Todo sale del cubo: unas miles de celdas en lugar de la tabla completa
+    per_neighborhood = valencia_sale_cube.rollup(by=["NEIGHBORHOOD"]).dropna(
+        subset=["NEIGHBORHOOD"]
+    )
+    return {
+        "total_inmuebles": valencia_sale_cube.count(),
+        "barrio_mas_ventas": str(
+            per_neighborhood.loc[per_neighborhood["COUNT"].idxmax(), "NEIGHBORHOOD"]
+        ),
+        "barrio_mas_caro": str(
+            per_neighborhood.loc[
+                per_neighborhood["PRICE_MEAN"].idxmax(), "NEIGHBORHOOD"
+            ]
+        ),
+        "nueva_obra_total": valencia_sale_cube.slice(
+            BUILDTYPE="Nueva construcción"
+        ).count(),
+    }
+
+
+kpis = snapshot["kpis"] if snapshot is not None else summary_kpis()
+
 total_inmuebles_titulo = html.H3("Inmuebles totales")
-total_inmuebles = html.H4(valencia_sale.shape[0])
+total_inmuebles = html.H4(kpis["total_inmuebles"])
 
 barrio_mas_ventas_titulo = html.H3("Barrio con más inmuebles en venta")
-barrio_mas_ventas = html.H4(
-    valencia_barrios.loc[valencia_barrios["REAL_ESTATE_TOTAL"].idxmax(), "NEIGHBORHOOD"]
-)
+barrio_mas_ventas = html.H4(kpis["barrio_mas_ventas"])
 
 barrio_mas_caro_titulo = html.H3("Barrio con los precios más caros")
-barrio_mas_caro = html.H4(
-    valencia_barrios.loc[valencia_barrios["PRICE_MEAN"].idxmax(), "NEIGHBORHOOD"]
-)
+barrio_mas_caro = html.H4(kpis["barrio_mas_caro"])
 
 nueva_obra_titulo = html.H3("Inmuebles de nueva obra")
-nueva_obra_total = html.H4(valencia_sale[valencia_sale["BUILTTYPEID_1"] == 1].shape[0])
+nueva_obra_total = html.H4(kpis["nueva_obra_total"])
 
 anyo_titulo = html.H3("Año")
 anyo_valor = html.H4(str(2018))
@@ -72,18 +412,27 @@ anyo_valor = html.H4(str(2018))
 
 ## Mapa con filtros
 
-scatter_map_wfilters = px.scatter_map(
-    data_frame=valencia_sale,
-    lat="LATITUDE",
-    lon="LONGITUDE",
-    zoom=11.5,
-)
+# Pasos de los sliders de área y precio
+AREA_STEP = 15
+PRICE_STEP = 1000
 
-scatter_map_wfilters.update_layout(
-    margin=dict(l=10, r=10, t=10, b=10),  # Eliminar márgenes
-)
 
-scatter_map_wfilters.update_traces(marker=dict(size=5, color="orange"))
+def build_scatter_map_wfilters():
+    scatter_map_wfilters = px.scatter_map(
+        data_frame=valencia_sale,
+        lat="LATITUDE",
+        lon="LONGITUDE",
+        zoom=11.5,
+    )
+
+    scatter_map_wfilters.update_layout(
+        margin=dict(l=10, r=10, t=10, b=10),  # Eliminar márgenes
+    )
+
+    scatter_map_wfilters.update_traces(marker=dict(size=5, color="orange"))
+
+    return scatter_map_wfilters
+
 
 # Gráficos de la cuarta fila
 
@@ -92,118 +441,156 @@ scatter_map_wfilters.update_traces(marker=dict(size=5, color="orange"))
 titulo_mapas_adicionales = html.H3("Mapas adicionales")
 
 ### Mapa de los tipos de construcción
-scatter_map_buildtype = px.scatter_map(
-    data_frame=valencia_sale,
-    lat="LATITUDE",
-    lon="LONGITUDE",
-    zoom=11.5,
-    color="BUILDTYPE",
-    title="Distribución de los inmuebles por tipo de construcción",
-)
+buildtype_categories = sorted(valencia_sale["BUILDTYPE"].dropna().unique())
 
-scatter_map_buildtype.update_layout(
-    margin=dict(l=0, r=0, t=40, b=0),  # Eliminar márgenes
-    title_font=dict(color="white"),
-    title_x=0.5,  # Centrar el título
-    title_y=0.965,  # Ajustar la posición vertical del título
-    legend=dict(
-        title=None,  # Quitar título de la leyenda
-        orientation="v",  # Configurar la leyenda verticalmente
-        yanchor="top",  # Fija la leyenda en la parte superior
-        y=1,  # Coloca la leyenda en el extremo superior
-        xanchor="left",  # Alinea la leyenda a la izquierda
-        x=0,  # Posiciona la leyenda en el lado izquierdo
-    ),
-)
 
+def build_scatter_map_buildtype(relayout_data=None):
+    scatter_map_buildtype = lod_scatter_map(
+        px.scatter_map,
+        sale_lod,
+        valencia_sale,
+        np.arange(len(valencia_sale)),
+        relayout_data,
+        zoom=11.5,
+        group="BUILDTYPE",
+        color="BUILDTYPE",
+        category_orders={"BUILDTYPE": buildtype_categories},
+        title="Distribución de los inmuebles por tipo de construcción",
+    )
+
+    scatter_map_buildtype.update_layout(
+        margin=dict(l=0, r=0, t=40, b=0),  # Eliminar márgenes
+        title_font=dict(color="white"),
+        title_x=0.5,  # Centrar el título
+        title_y=0.965,  # Ajustar la posición vertical del título
+        legend=dict(
+            title=None,  # Quitar título de la leyenda
+            orientation="v",  # Configurar la leyenda verticalmente
+            yanchor="top",  # Fija la leyenda en la parte superior
+            y=1,  # Coloca la leyenda en el extremo superior
+            xanchor="left",  # Alinea la leyenda a la izquierda
+            x=0,  # Posiciona la leyenda en el lado izquierdo
+        ),
+        uirevision="buildtype-map",  # Conservar la vista del usuario
+    )
+
+    return scatter_map_buildtype
 
-scatter_map_buildtype.update_traces(marker=dict(size=5))
 
 ## Gráficos - Columna 2
 
+
 ### Inmuebles por barrios
-ordered_neig_total = valencia_barrios.sort_values(
-    by="REAL_ESTATE_TOTAL", ascending=True
-)
+def build_houses_per_neighborhood():
+    ordered_neig_total = valencia_barrios.sort_values(
+        by="REAL_ESTATE_TOTAL", ascending=True
+    )
 
-top5 = ordered_neig_total.nlargest(10, "REAL_ESTATE_TOTAL").sort_values(
-    by="REAL_ESTATE_TOTAL", ascending=True
-)
+    top5 = ordered_neig_total.nlargest(10, "REAL_ESTATE_TOTAL").sort_values(
+        by="REAL_ESTATE_TOTAL", ascending=True
+    )
 
-houses_per_neighborhood = px.bar(
-    top5,
-    x="REAL_ESTATE_TOTAL",
-    y="NEIGHBORHOOD",
-    orientation="h",
-    title="Número de inmuebles por barrio",
-    color_discrete_sequence=["#F5A64D"],
-)
+    houses_per_neighborhood = px.bar(
+        top5,
+        x="REAL_ESTATE_TOTAL",
+        y="NEIGHBORHOOD",
+        orientation="h",
+        title="Número de inmuebles por barrio",
+        color_discrete_sequence=["#F5A64D"],
+    )
 
-houses_per_neighborhood.update_layout(
-    title=dict(text="Número de inmuebles por barrio", x=0.5, xanchor="center"),
-    xaxis=dict(
-        title=dict(
-            text="Número de inmuebles",
-            font=dict(size=14),
-            standoff=120,
+    houses_per_neighborhood.update_layout(
+        title=dict(text="Número de inmuebles por barrio", x=0.5, xanchor="center"),
+        xaxis=dict(
+            title=dict(
+                text="Número de inmuebles",
+                font=dict(size=14),
+                standoff=120,
+            ),
         ),
-    ),
-    yaxis=dict(
-        title=None,
-    ),
-    margin=dict(l=60, r=20, t=50, b=80),
-)
+        yaxis=dict(
+            title=None,
+        ),
+        margin=dict(l=60, r=20, t=50, b=80),
+    )
+
+    return houses_per_neighborhood
 
 
 ## Gráficos - Columna 3
 
 ### Inmuebles según el número de habitaciones
 
-counts_bedrooms = valencia_sale.groupby(["ROOMNUMBER"]).size().reset_index(name="count")
 
-houses_per_roomnumber = px.bar(
-    counts_bedrooms,
-    x="count",
-    y="ROOMNUMBER",
-    orientation="h",
-    title="Número de inmuebles por número de habitaciones",
-    color_discrete_sequence=["#F5A64D"],  # Color amarillo
-)
+def build_houses_per_roomnumber():
+    counts_bedrooms = (
+        valencia_sale_cube.rollup(by=["ROOMNUMBER"])
+        .dropna(subset=["ROOMNUMBER"])
+        .rename(columns={"COUNT": "count"})[["ROOMNUMBER", "count"]]
+    )
 
-houses_per_roomnumber.update_layout(
-    title_x=0.5,
-    title_y=0.965,
-    yaxis=dict(
-        range=[0, 9],
-        title="Número de habitaciones",
-        showgrid=True,
-    ),
-    xaxis=dict(
-        range=[0, 17000],
-        title=dict(
-            text="Número de inmuebles",
-            font=dict(size=14),
-            standoff=120,
+    houses_per_roomnumber = px.bar(
+        counts_bedrooms,
+        x="count",
+        y="ROOMNUMBER",
+        orientation="h",
+        title="Número de inmuebles por número de habitaciones",
+        color_discrete_sequence=["#F5A64D"],  # Color amarillo
+    )
+
+    houses_per_roomnumber.update_layout(
+        title_x=0.5,
+        title_y=0.965,
+        yaxis=dict(
+            range=[0, 9],
+            title="Número de habitaciones",
+            showgrid=True,
         ),
-    ),
-)
+        xaxis=dict(
+            range=[0, 17000],
+            title=dict(
+                text="Número de inmuebles",
+                font=dict(size=14),
+                standoff=120,
+            ),
+        ),
+    )
+
+    return houses_per_roomnumber
+
 
 ## Grafico 4 -  Matriz Corr
 
-# Crear la matriz de correlación
-corr = valencia_sale.select_dtypes(np.number).corr()
-price_corr = corr["PRICE"].drop("PRICE")
 
-sorted_price_corr = price_corr.sort_values(ascending=True)
-filtered_price_corr = sorted_price_corr[
-    (sorted_price_corr > 0.2) | (sorted_price_corr < -0.2)
-]
+# Correlaciones con PRICE para cualquier selección de los filtros; las etiquetas
+# de los clústeres no son una variable del inmueble
+price_correlation_index = PriceCorrelationIndex(
+    valencia_sale,
+    AREA_STEP,
+    PRICE_STEP,
+    columns=numeric_columns(valencia_sale.drop(columns=["CLUSTER"])),
+)
 
-colors = ["green" if value > 0 else "red" for value in filtered_price_corr.values]
-text_labels = [f"{value:.2f}" for value in filtered_price_corr.values]
 
-price_corr_bar = go.Figure(
-    go.Bar(
+def unfiltered_price_correlations():
+    # Las sumas por barrio de data_processing.py; sin ellas, las del índice
+    try:
+        state = pd.read_csv(os.path.join(data_dir, "price_correlation_stats.csv"))
+    except OSError:
+        return price_correlation_index.stats.correlations()
+    return CorrelationStats.from_state(state).correlations()
+
+
+def price_corr_trace(price_corr):
+    sorted_price_corr = price_corr.dropna().sort_values(ascending=True)
+    filtered_price_corr = sorted_price_corr[
+        (sorted_price_corr > 0.2) | (sorted_price_corr < -0.2)
+    ]
+
+    colors = ["green" if value > 0 else "red" for value in filtered_price_corr.values]
+    text_labels = [f"{value:.2f}" for value in filtered_price_corr.values]
+
+    return go.Bar(
         x=filtered_price_corr.values,
         y=filtered_price_corr.index,
         orientation="h",  # Barras horizontales
@@ -211,125 +598,286 @@ price_corr_bar = go.Figure(
         text=text_labels,
         textposition="none",
     )
-)
 
-# Configurar diseño del gráfico
-price_corr_bar.update_layout(
-    title="Correlación de PRICE con las demás variables",
-    xaxis=dict(
-        title=dict(
-            text="Correlación",
-            font=dict(size=14),
-            standoff=150,
+
+def build_price_corr_bar():
+    price_corr_bar = go.Figure(price_corr_trace(unfiltered_price_correlations()))
+
+    # Configurar diseño del gráfico
+    price_corr_bar.update_layout(
+        title="Correlación de PRICE con las demás variables",
+        xaxis=dict(
+            title=dict(
+                text="Correlación",
+                font=dict(size=14),
+                standoff=150,
+            ),
         ),
-    ),
-    yaxis=dict(title="Variables"),
-    height=600,
-    width=800,
-)
+        yaxis=dict(title="Variables"),
+        height=600,
+        width=800,
+    )
+
+    return price_corr_bar
+
 
 ## Grafico 5 y 6 - Choropleth
 
-quality_mean_neighborhood = px.choropleth_mapbox(
-    valencia_polygons,
-    geojson=geojson_obj,
-    locations="NEIGHBORHOOD",
-    color="QUALITY_MEAN",
-    mapbox_style="carto-positron",
-    opacity=0.6,
-    zoom=11,
-    center={"lat": 39.46, "lon": -0.37},
-    hover_data=["NEIGHBORHOOD"],
-    title="Calidad media del inmueble por Barrio",
-    height=1000,
-    labels={"NEIGHBORHOOD": "Barrio", "QUALITY_MEAN": "Calidad media"},
-)
 
-quality_mean_neighborhood.update_coloraxes(
-    colorscale="plasma",
-    colorbar=dict(
-        title=dict(text="", side="right", font=dict(size=16, weight=600)),
-    ),
-)
+def build_quality_mean_neighborhood():
+    quality_mean_neighborhood = px.choropleth_mapbox(
+        valencia_polygons,
+        geojson=geojson_obj,
+        locations="NEIGHBORHOOD",
+        color="QUALITY_MEAN",
+        mapbox_style="carto-positron",
+        opacity=0.6,
+        zoom=11,
+        center={"lat": 39.46, "lon": -0.37},
+        hover_data=["NEIGHBORHOOD"],
+        title="Calidad media del inmueble por Barrio",
+        height=1000,
+        labels={"NEIGHBORHOOD": "Barrio", "QUALITY_MEAN": "Calidad media"},
+    )
 
-mean_age_per_neighborhood = px.choropleth_mapbox(
-    valencia_polygons,
-    geojson=geojson_obj,
-    locations="NEIGHBORHOOD",
-    color="AGE_MEAN",
-    mapbox_style="carto-positron",
-    opacity=0.6,
-    zoom=11,
-    height=1000,
-    center={"lat": 39.46, "lon": -0.37},
-    hover_data=["NEIGHBORHOOD"],
-    title="Antigüedad media de los inmuebles por barrio",
-    labels={"AGE_MEAN": "Antigüedad media", "NEIGHBORHOOD": "Barrio"},
-)
+    quality_mean_neighborhood.update_coloraxes(
+        colorscale="plasma",
+        colorbar=dict(
+            title=dict(text="", side="right", font=dict(size=16, weight=600)),
+        ),
+    )
 
-## Grafiocs 7 y 8 - Box Plot
-avg_price_by_neighborhood = valencia_sale.groupby("NEIGHBORHOOD")["PRICE"].mean()
+    return quality_mean_neighborhood
 
-top_3_expensive = avg_price_by_neighborhood.nlargest(3).index
-top_3_cheap = avg_price_by_neighborhood.nsmallest(3).index
-selected_neighborhoods = top_3_expensive.union(top_3_cheap)
 
-filtered_data = valencia_sale[
-    valencia_sale["NEIGHBORHOOD"].isin(selected_neighborhoods)
-]
+def build_mean_age_per_neighborhood():
+    mean_age_per_neighborhood = px.choropleth_mapbox(
+        valencia_polygons,
+        geojson=geojson_obj,
+        locations="NEIGHBORHOOD",
+        color="AGE_MEAN",
+        mapbox_style="carto-positron",
+        opacity=0.6,
+        zoom=11,
+        height=1000,
+        center={"lat": 39.46, "lon": -0.37},
+        hover_data=["NEIGHBORHOOD"],
+        title="Antigüedad media de los inmuebles por barrio",
+        labels={"AGE_MEAN": "Antigüedad media", "NEIGHBORHOOD": "Barrio"},
+    )
 
-sorted_neighborhoods = (
-    filtered_data.groupby("NEIGHBORHOOD")["PRICE"]
-    .mean()
-    .sort_values(ascending=False)
-    .index
-)
+    return mean_age_per_neighborhood
 
-price_boxplot = go.Figure()
 
-for neighborhood in sorted_neighborhoods:
-    neighborhood_data = filtered_data[filtered_data["NEIGHBORHOOD"] == neighborhood][
-        "PRICE"
-    ]
-    price_boxplot.add_trace(
-        go.Box(y=neighborhood_data, name=neighborhood, boxmean=True)
-    )
-
-# Configurar diseño del gráfico
-price_boxplot.update_layout(
-    title="Distribución de Precios por Barrio (Top 3 más caros y baratos)",
-    xaxis=dict(
-        title=dict(
-            text="Barrios",
-            font=dict(size=14),
-            standoff=160,
+## Grafiocs 7 y 8 - Box Plot
+
+
+def price_box_traces(summary, outliers):
+    # Los 3 barrios más caros y los 3 más baratos por precio medio, dibujados
+    # a partir de los cuartiles ya calculados y una muestra de los atípicos
+    summary = summary[summary["COUNT"] > 0]
+    selected = pd.concat(
+        [summary.nlargest(3, "MEAN"), summary.nsmallest(3, "MEAN")]
+    ).drop_duplicates(subset="NEIGHBORHOOD")
+    selected = selected.sort_values(by="MEAN", ascending=False)
+    outlier_prices = outliers.groupby("NEIGHBORHOOD", observed=True)["PRICE"]
+
+    traces = []
+    for color, row in zip(
+        itertools.cycle(px.colors.qualitative.Plotly), selected.itertuples()
+    ):
+        name = str(row.NEIGHBORHOOD)
+        traces.append(
+            go.Box(
+                x=[name],
+                q1=[row.Q1],
+                median=[row.MEDIAN],
+                q3=[row.Q3],
+                lowerfence=[row.LOWER_FENCE],
+                upperfence=[row.UPPER_FENCE],
+                mean=[row.MEAN],
+                name=name,
+                boxmean=True,
+                boxpoints=False,
+                marker=dict(color=color),
+            )
+        )
+        if row.NEIGHBORHOOD in outlier_prices.groups:
+            prices = outlier_prices.get_group(row.NEIGHBORHOOD).to_numpy()
+            traces.append(
+                go.Scatter(
+                    x=[name] * len(prices),
+                    y=prices,
+                    mode="markers",
+                    name=name,
+                    legendgroup=name,
+                    showlegend=False,
+                    marker=dict(color=color, size=4),
+                )
+            )
+    return traces
+
+
+def build_price_boxplot():
+    price_boxplot = go.Figure(
+        price_box_traces(valencia_price_summary, valencia_price_outliers)
+    )
+
+    # Configurar diseño del gráfico
+    price_boxplot.update_layout(
+        title="Distribución de Precios por Barrio (Top 3 más caros y baratos)",
+        xaxis=dict(
+            title=dict(
+                text="Barrios",
+                font=dict(size=14),
+                standoff=160,
+            ),
         ),
-    ),
-    yaxis=dict(title="Precio de las viviendas"),
-    height=600,
-    width=800,
-)
+        yaxis=dict(title="Precio de las viviendas"),
+        height=600,
+        width=800,
+    )
+
+    return price_boxplot
+
 
 ## Gráfico de Clustering - Distribución Geográfica de Inmuebles por Clúster
-clustering_map = px.scatter_mapbox(
-    valencia_sale_clustered,
-    lat="LATITUDE",
-    lon="LONGITUDE",
-    color="Cluster",
-    zoom=12,
-    height=700,
-    mapbox_style="carto-positron",
-    title="Distribución Geográfica de Inmuebles por Clúster",
-)
+cluster_categories = list(valencia_sale["Cluster"].cat.categories)
+
+
+def build_clustering_map(relayout_data=None, labels=None):
+    # Con ``labels`` (uno por fila de ``clustered_rows``) se dibuja un
+    # reclustering en lugar de la columna CLUSTER
+    frame, categories = valencia_sale, cluster_categories
+    if labels is None and not saved_n_clusters:
+        labels = recluster_labels(default_n_clusters, tuple(cluster_variables))
+    if labels is not None:
+        sale_labels = np.full(len(valencia_sale), -1)
+        sale_labels[clustered_rows] = labels
+        frame = valencia_sale.assign(Cluster=cluster_label_column(sale_labels))
+        categories = [str(label) for label in np.unique(labels)]
+
+    clustering_map = lod_scatter_map(
+        px.scatter_mapbox,
+        clustered_lod,
+        frame,
+        clustered_rows,
+        relayout_data,
+        zoom=12,
+        center=clustered_lod.center,
+        group="Cluster",
+        color="Cluster",
+        category_orders={"Cluster": categories},
+        height=700,
+        mapbox_style="carto-positron",
+        title="Distribución Geográfica de Inmuebles por Clúster",
+    )
+
+    clustering_map.update_layout(
+        margin=dict(l=10, r=10, t=40, b=10),
+        title_font=dict(color="white"),
+        title_x=0.5,
+        title_y=0.965,
+        uirevision="clustering-map",
+    )
+
+    return clustering_map
+
+
+### Reclustering interactivo con otro número de clústeres o de variables
+cluster_variables = [
+    variable for variable in clustering.VARIABLES if variable in valencia_sale.columns
+]
+# Sin clústeres guardados, el mapa parte de un reclustering con los de por defecto
+saved_n_clusters = len(cluster_categories)
+default_n_clusters = saved_n_clusters or clustering.N_CLUSTERS
+CLUSTER_OPTIONS = range(2, 9)
 
-clustering_map.update_layout(
-    margin=dict(l=10, r=10, t=40, b=10),
-    title_font=dict(color="white"),
-    title_x=0.5,
-    title_y=0.965,
-)
 
-clustering_map.update_traces(marker=dict(size=5))
+@functools.cache
+def cluster_feature_matrix():
+    # Variables estandarizadas en float32, una sola vez por worker
+    values = valencia_sale[cluster_variables].to_numpy(dtype=float)[clustered_rows]
+    return np.nan_to_num(clustering.Scaler.fit(values).transform(values))
+
+
+# Etiquetas del modelo guardado; con su mismo número de clústeres el cálculo
+# parte de sus centroides, y así las etiquetas se mantienen. No se parte de
+# cálculos anteriores para que el resultado no dependa del orden de las peticiones
+saved_cluster_labels = valencia_sale["CLUSTER"].to_numpy(dtype=np.intp)[clustered_rows]
+
+
+@functools.lru_cache(maxsize=32)
+def recluster_labels(n_clusters, features):
+    start = time.perf_counter()
+    X = cluster_feature_matrix()[
+        :, [cluster_variables.index(feature) for feature in features]
+    ]
+    init = None
+    if n_clusters == saved_n_clusters:
+        init = clustering.cluster_centroids(X, saved_cluster_labels, n_clusters)
+        if np.isnan(init).any():
+            init = None
+
+    with metrics.phase("cluster"):
+        model = clustering.MiniBatchKMeans(n_clusters=n_clusters)
+        labels = model.fit(X, init=init).labels
+    logger.info(
+        "Reclustering con k=%d y %d variables en %.2f s",
+        n_clusters,
+        len(features),
+        time.perf_counter() - start,
+    )
+    return labels
+
+
+# Construcción diferida de las figuras estáticas: cada sección pide su figura
+# cuando entra en pantalla (ver assets/lazy_sections.js) en lugar de
+# construirlas todas al importar la app y enviarlas en la primera respuesta
+LAZY_FIGURES = os.environ.get("LAZY_FIGURES", "1") != "0"
+
+static_figure_builders = {
+    "buildtype-map": build_scatter_map_buildtype,
+    "houses-per-neighborhood": build_houses_per_neighborhood,
+    "houses-per-roomnumber": build_houses_per_roomnumber,
+    "quality-mean-map": build_quality_mean_neighborhood,
+    "age-mean-map": build_mean_age_per_neighborhood,
+    "price-corr-bar": build_price_corr_bar,
+    "price-boxplot": build_price_boxplot,
+    "clustering-map": build_clustering_map,
+}
+
+
+@functools.cache
+def static_figure(graph_id):
+    # Se toma de la instantánea si la hay o se construye la primera vez que se
+    # pide, y se reutiliza después con los datos en arrays tipados compactos
+    if snapshot is not None and graph_id in snapshot["figures"]:
+        with metrics.startup_timer(
+            "valencia_figure_build_seconds", figure=graph_id, source="snapshot"
+        ):
+            return compact_figure(snapshot["figures"][graph_id])
+    with metrics.startup_timer(
+        "valencia_figure_build_seconds", figure=graph_id, source="build"
+    ):
+        return compact_figure(static_figure_builders[graph_id]())
+
+
+def lazy_graph(graph_id, style=None):
+    # El Store lo marca el navegador cuando la sección se hace visible
+    return html.Div(
+        [
+            dcc.Store(id=f"{graph_id}-visible"),
+            dcc.Graph(
+                id=graph_id,
+                figure={} if LAZY_FIGURES else static_figure(graph_id),
+            ),
+        ],
+        className="lazy-section" if LAZY_FIGURES else None,
+        style=style,
+        **{"data-store": f"{graph_id}-visible"},
+    )
+
 
 # Diseño de la disposición de la app
 app.layout = dbc.Container(
@@ -427,7 +975,7 @@ app.layout = dbc.Container(
                                     id="constructed-area-range-slider",
                                     min=valencia_sale["CONSTRUCTEDAREA"].min(),
                                     max=valencia_sale["CONSTRUCTEDAREA"].max(),
-                                    step=15,
+                                    step=AREA_STEP,
                                     marks={
                                         int(
                                             valencia_sale["CONSTRUCTEDAREA"].min()
@@ -455,7 +1003,7 @@ app.layout = dbc.Container(
                                     id="price-range-slider",
                                     min=valencia_sale["PRICE"].min(),
                                     max=valencia_sale["PRICE"].max(),
-                                    step=1000,
+                                    step=PRICE_STEP,
                                     marks={
                                         int(
                                             valencia_sale["PRICE"].min()
@@ -503,12 +1051,40 @@ app.layout = dbc.Container(
                 dbc.Row(  # Fila con el mapa
                     [
                         dbc.Col(
-                            dcc.Graph(id="scatter-map", figure=scatter_map_wfilters),
+                            [
+                                dcc.Graph(
+                                    id="scatter-map",
+                                    # update_map dibuja el mapa al cargar la página
+                                    figure=(
+                                        {}
+                                        if LAZY_FIGURES
+                                        else build_scatter_map_wfilters()
+                                    ),
+                                ),
+                                # Huella de la figura que tiene el navegador
+                                dcc.Store(id="scatter-map-signature"),
+                            ],
                             width=12,
                         ),
                     ],
                     style={"margin-top": "4rem"},
                 ),
+                dbc.Row(  # Comparables del inmueble seleccionado en el mapa
+                    [
+                        dbc.Col(
+                            html.Div(
+                                id="comparables-table",
+                                children=html.P(
+                                    "Haz clic en un inmueble del mapa para ver "
+                                    "los más parecidos",
+                                    style={"text-align": "center"},
+                                ),
+                            ),
+                            width=12,
+                        ),
+                    ],
+                    style={"margin-top": "2rem"},
+                ),
                 dbc.Row(  # Cuarta fila con los gráficos adicionales
                     [
                         html.H2(
@@ -516,21 +1092,15 @@ app.layout = dbc.Container(
                             style={"text-align": "center"},
                         ),
                         dbc.Col(
-                            dcc.Graph(
-                                figure=scatter_map_buildtype,
-                            ),
+                            lazy_graph("buildtype-map"),
                             width=4,
                         ),
                         dbc.Col(
-                            dcc.Graph(
-                                figure=houses_per_neighborhood,
-                            ),
+                            lazy_graph("houses-per-neighborhood"),
                             width=4,
                         ),
                         dbc.Col(
-                            dcc.Graph(
-                                figure=houses_per_roomnumber,
-                            ),
+                            lazy_graph("houses-per-roomnumber"),
                             width=4,
                         ),
                     ],
@@ -542,14 +1112,12 @@ app.layout = dbc.Container(
                             "Calidad media y antigüedad media de los inmuebles por barrio",
                             style={"text-align": "center"},
                         ),
-                        dcc.Graph(
-                            id="quality-mean-map",
-                            figure=quality_mean_neighborhood,
+                        lazy_graph(
+                            "quality-mean-map",
                             style={"width": "48%", "display": "inline-block"},
                         ),
-                        dcc.Graph(
-                            id="age-mean-map",
-                            figure=mean_age_per_neighborhood,
+                        lazy_graph(
+                            "age-mean-map",
                             style={
                                 "width": "48%",
                                 "display": "inline-block",
@@ -569,14 +1137,12 @@ app.layout = dbc.Container(
                             "Análisis de los precios de las viviendas",
                             style={"text-align": "center"},
                         ),
-                        dcc.Graph(
-                            id="price-corr-bar",
-                            figure=price_corr_bar,
+                        lazy_graph(
+                            "price-corr-bar",
                             style={"width": "48%", "display": "inline-block"},
                         ),
-                        dcc.Graph(
-                            id="price-boxplot",
-                            figure=price_boxplot,
+                        lazy_graph(
+                            "price-boxplot",
                             style={
                                 "width": "48%",
                                 "display": "inline-block",
@@ -596,11 +1162,46 @@ app.layout = dbc.Container(
                             "Distribución Geográfica de Inmuebles por Clúster",
                             style={"text-align": "center"},
                         ),
-                        dcc.Graph(
-                            id="clustering-map",
-                            figure=clustering_map,
+                        dbc.Col(
+                            [
+                                html.H3(
+                                    "Selecciona el número de clústeres",
+                                    style={"text-align": "center"},
+                                ),
+                                dcc.Dropdown(
+                                    id="cluster-number-dropdown",
+                                    options=[
+                                        {"label": f"{k} clústeres", "value": k}
+                                        for k in CLUSTER_OPTIONS
+                                    ],
+                                    value=default_n_clusters,
+                                    clearable=False,
+                                    style={"width": "80%", "margin": "0 auto"},
+                                ),
+                            ],
+                            width=4,
+                        ),
+                        dbc.Col(
+                            [
+                                html.H3(
+                                    "Selecciona las variables del clustering",
+                                    style={"text-align": "center"},
+                                ),
+                                dcc.Dropdown(
+                                    id="cluster-variables-dropdown",
+                                    options=cluster_variables,
+                                    value=cluster_variables,
+                                    multi=True,
+                                    style={"width": "90%", "margin": "0 auto"},
+                                ),
+                            ],
+                            width=8,
+                        ),
+                        lazy_graph(
+                            "clustering-map",
                             style={"width": "100%", "display": "inline-block"},
                         ),
+                        dcc.Store(id="clustering-map-signature"),
                     ],
                     style={
                         "display": "flex",
@@ -618,44 +1219,493 @@ app.layout = dbc.Container(
 
 @app.callback(
     Output("scatter-map", "figure"),
+    Output("scatter-map-signature", "data"),
     [
         Input("constructed-area-range-slider", "value"),
         Input("price-range-slider", "value"),
         Input("room-number-dropdown", "value"),
+        Input("scatter-map", "relayoutData"),
+        Input("scatter-map", "clickData"),
     ],
+    State("scatter-map-signature", "data"),
 )
-def update_map(selected_area, selected_price, selected_room):
-    min_area, max_area = selected_area
-    min_price, max_price = selected_price
-
-    filtered_data = valencia_sale[
-        (valencia_sale["CONSTRUCTEDAREA"] >= min_area)
-        & (valencia_sale["CONSTRUCTEDAREA"] <= max_area)
-        & (valencia_sale["PRICE"] >= min_price)
-        & (valencia_sale["PRICE"] <= max_price)
-    ]
+@metrics.timed_callback("scatter-map")
+def update_map(
+    selected_area,
+    selected_price,
+    selected_room,
+    relayout_data=None,
+    click_data=None,
+    signature=None,
+):
+    # Los sliders solo producen un conjunto finito de estados, así que las
+    # figuras se reutilizan entre peticiones con la misma selección
+    selected_area, selected_price, selected_room = normalize_selection(
+        selected_area, selected_price, selected_room
+    )
+    selected_row = clicked_row(click_data)
+    key = (
+        "scatter-map",
+        selected_area,
+        selected_price,
+        selected_room,
+        sale_lod.viewport_key(relayout_data, 11.5),
+        selected_row,
+    )
+    figure = figure_cache.get_or_build(
+        key,
+        lambda: build_filtered_map(
+            selected_area, selected_price, selected_room, relayout_data, selected_row
+        ),
+    )
+    # Si solo cambian los datos de las trazas se envía únicamente eso
+    return patch_figure(figure, signature)
+
+
+def clicked_row(click_data):
+    # Solo los puntos individuales llevan la posición del inmueble; las celdas
+    # agregadas y los comparables resaltados no seleccionan nada
+    if not click_data or not click_data.get("points"):
+        return None
+    row = click_data["points"][0].get("customdata")
+    if isinstance(row, list):
+        row = row[0] if row else None
+    return None if row is None else int(row)
+
+
+def normalize_range(selected, column, step):
+    # Ajusta los valores a la rejilla del slider (los extremos se mantienen)
+    low, high = column.min().item(), column.max().item()
+    return tuple(
+        (
+            high
+            if value >= high
+            else low if value <= low else low + round((value - low) / step) * step
+        )
+        for value in selected
+    )
 
-    if selected_room != -1:
-        filtered_data = filtered_data[filtered_data["ROOMNUMBER"] == selected_room]
 
-    scatter_map_wfilters = px.scatter_mapbox(
-        data_frame=filtered_data,
-        lat="LATITUDE",
-        lon="LONGITUDE",
+def normalize_selection(selected_area, selected_price, selected_room):
+    return (
+        normalize_range(selected_area, valencia_sale["CONSTRUCTEDAREA"], AREA_STEP),
+        normalize_range(selected_price, valencia_sale["PRICE"], PRICE_STEP),
+        selected_room,
+    )
+
+
+def filtered_rows(selected_area, selected_price, selected_room):
+    with metrics.phase("filter"):
+        rows = sale_filter_index.query(
+            ranges={"CONSTRUCTEDAREA": selected_area, "PRICE": selected_price},
+            equals={"ROOMNUMBER": selected_room} if selected_room != -1 else None,
+        )
+    metrics.record_rows(len(rows))
+    return rows
+
+
+def build_filtered_map(
+    selected_area, selected_price, selected_room, relayout_data, selected_row=None
+):
+    rows = filtered_rows(selected_area, selected_price, selected_room)
+
+    scatter_map_wfilters = lod_scatter_map(
+        px.scatter_mapbox,
+        sale_lod,
+        valencia_sale,
+        rows,
+        relayout_data,
         zoom=11.5,
+        columns=["PRICE"],
+        row_ids=True,
+        # Centro fijo para que el layout no cambie con los filtros
+        center=sale_lod.center,
         mapbox_style="carto-positron",
         color="PRICE",
     )
 
     scatter_map_wfilters.update_layout(
         margin=dict(l=10, r=10, t=10, b=10),
+        uirevision="scatter-map",
     )
 
-    scatter_map_wfilters.update_traces(marker=dict(size=5, color="orange"))
+    scatter_map_wfilters.update_traces(marker=dict(color="orange"))
+
+    if selected_row is not None:
+        # Resaltamos el inmueble seleccionado y sus comparables
+        rows, _ = comparables_index.query(row=selected_row)
+        for name, positions, color, size in [
+            ("Comparables", rows, "red", 11),
+            ("Seleccionado", [selected_row], "black", 14),
+        ]:
+            scatter_map_wfilters.add_trace(
+                go.Scattermapbox(
+                    lat=valencia_sale["LATITUDE"].to_numpy()[positions],
+                    lon=valencia_sale["LONGITUDE"].to_numpy()[positions],
+                    mode="markers",
+                    marker=dict(color=color, size=size),
+                    name=name,
+                )
+            )
 
     return scatter_map_wfilters
 
 
+@app.callback(
+    Output("comparables-table", "children"),
+    Input("scatter-map", "clickData"),
+    prevent_initial_call=True,
+)
+@metrics.timed_callback("comparables-table")
+def update_comparables_table(click_data):
+    selected_row = clicked_row(click_data)
+    if selected_row is None:
+        return dash.no_update
+    comparables = comparables_index.table(*comparables_index.query(row=selected_row))
+    comparables = comparables.drop(columns=["ROW", "LONGITUDE", "LATITUDE"])
+    return [
+        html.H3(
+            f"Inmuebles más parecidos al seleccionado ({selected_row})",
+            style={"text-align": "center"},
+        ),
+        dbc.Table.from_dataframe(
+            comparables.round(2), striped=True, hover=True, size="sm"
+        ),
+    ]
+
+
+## Figuras que siguen a los filtros
+
+# Posición en valencia_polygons del barrio de cada inmueble, calculada una vez
+sale_neighborhood_codes = pd.Categorical(
+    np.asarray(valencia_sale["NEIGHBORHOOD"], dtype=object),
+    categories=valencia_polygons["NEIGHBORHOOD"].to_numpy(dtype=object),
+).codes
+
+default_selection = normalize_selection(
+    [valencia_sale["CONSTRUCTEDAREA"].min(), valencia_sale["CONSTRUCTEDAREA"].max()],
+    [valencia_sale["PRICE"].min(), valencia_sale["PRICE"].max()],
+    -1,
+)
+
+
+@functools.lru_cache(maxsize=256)
+def filtered_neighborhood_stats(selected_area, selected_price, selected_room):
+    # Las mismas sumas y cuentas con np.bincount que en data_processing.py,
+    # pero solo sobre las filas que cumplen los filtros
+    rows = filtered_rows(selected_area, selected_price, selected_room)
+    stats = NeighborhoodStats(valencia_polygons["NEIGHBORHOOD"])
+    stats.update(
+        sale_neighborhood_codes[rows],
+        pd.DataFrame(
+            {
+                source: (
+                    valencia_sale[source].to_numpy(dtype=float)[rows]
+                    if source in valencia_sale.columns
+                    else np.full(len(rows), np.nan)
+                )
+                for source in stats.sums
+            }
+        ),
+    )
+    return stats.to_frame()
+
+
+# Filas ordenadas por barrio y precio, para los cuartiles de cualquier filtro
+sale_price_order = sort_order(
+    sale_neighborhood_codes, valencia_sale["PRICE"].to_numpy(dtype=float)
+)
+
+
+@functools.lru_cache(maxsize=256)
+def filtered_price_summary(selected_area, selected_price, selected_room):
+    rows = filtered_rows(selected_area, selected_price, selected_room)
+    selected = np.zeros(len(valencia_sale), dtype=bool)
+    selected[rows] = True
+    names = valencia_polygons["NEIGHBORHOOD"].to_numpy(dtype=object)
+    summary, outliers = box_summaries(
+        sale_neighborhood_codes,
+        valencia_sale["PRICE"].to_numpy(dtype=float),
+        len(names),
+        order=sale_price_order[selected[sale_price_order]],
+    )
+    summary.insert(0, "NEIGHBORHOOD", names)
+    outliers = pd.DataFrame(
+        {
+            "NEIGHBORHOOD": names[outliers["GROUP"].to_numpy(dtype=np.int64)],
+            "PRICE": outliers["VALUE"],
+        }
+    )
+    return summary, outliers
+
+
+@functools.lru_cache(maxsize=256)
+def filtered_price_correlations(selected_area, selected_price, selected_room):
+    return price_correlation_index.query(selected_area, selected_price, selected_room)
+
+
+def set_choropleth_values(column):
+    def apply(figure, aggregates):
+        # Las filas de los agregados siguen el orden de valencia_polygons
+        figure["data"][0]["z"] = aggregates[column].to_numpy(dtype=float)
+
+    return apply
+
+
+def set_houses_per_neighborhood(figure, aggregates):
+    top = aggregates.dropna(subset=["REAL_ESTATE_TOTAL"])
+    top = top.nlargest(10, "REAL_ESTATE_TOTAL").sort_values(
+        by="REAL_ESTATE_TOTAL", ascending=True
+    )
+    figure["data"][0]["x"] = top["REAL_ESTATE_TOTAL"].to_numpy(dtype=np.int64)
+    figure["data"][0]["y"] = top["NEIGHBORHOOD"].astype(str).tolist()
+
+
+def set_price_boxes(figure, price_summary):
+    # El número de barrios con datos puede cambiar, así que se sustituyen
+    # todas las trazas; el layout se queda como está
+    figure["data"] = [
+        trace.to_plotly_json() for trace in price_box_traces(*price_summary)
+    ]
+
+
+def set_price_corr_bar(figure, price_corr):
+    # Las variables por encima del umbral cambian con los filtros
+    figure["data"] = [price_corr_trace(price_corr).to_plotly_json()]
+
+
+filtered_figure_updates = {
+    "quality-mean-map": (
+        set_choropleth_values("QUALITY_MEAN"),
+        filtered_neighborhood_stats,
+    ),
+    "age-mean-map": (set_choropleth_values("AGE_MEAN"), filtered_neighborhood_stats),
+    "houses-per-neighborhood": (
+        set_houses_per_neighborhood,
+        filtered_neighborhood_stats,
+    ),
+    "price-boxplot": (set_price_boxes, filtered_price_summary),
+    "price-corr-bar": (set_price_corr_bar, filtered_price_correlations),
+}
+
+
+def register_filtered_figure(graph_id, apply, aggregate):
+    @app.callback(
+        Output(graph_id, "figure"),
+        Input(f"{graph_id}-visible", "data"),
+        Input("constructed-area-range-slider", "value"),
+        Input("price-range-slider", "value"),
+        Input("room-number-dropdown", "value"),
+        prevent_initial_call=True,
+    )
+    @metrics.timed_callback(graph_id)
+    def update_filtered_figure(visible, selected_area, selected_price, selected_room):
+        if LAZY_FIGURES and not visible:
+            return dash.no_update
+        selection = normalize_selection(selected_area, selected_price, selected_room)
+
+        if dash.ctx.triggered_id == f"{graph_id}-visible":
+            # Primera carga: la figura completa, con los valores filtrados si
+            # el usuario ya ha tocado los filtros
+            if selection == default_selection:
+                return static_figure(graph_id)
+            figure = static_figure(graph_id)
+            if hasattr(figure, "to_plotly_json"):
+                figure = figure.to_plotly_json()
+            figure = copy.deepcopy(figure)
+        else:
+            # Después solo se envían los valores que cambian
+            figure = Patch()
+
+        apply(figure, aggregate(*selection))
+        return figure
+
+
+for graph_id, (apply, aggregate) in filtered_figure_updates.items():
+    register_filtered_figure(graph_id, apply, aggregate)
+
+
+def register_lazy_figure(graph_id):
+    @app.callback(
+        Output(graph_id, "figure"),
+        Input(f"{graph_id}-visible", "data"),
+        prevent_initial_call=True,
+    )
+    @metrics.timed_callback(graph_id)
+    def load_figure(visible):
+        return static_figure(graph_id)
+
+
+for graph_id in ["houses-per-roomnumber"]:
+    register_lazy_figure(graph_id)
+
+
+# Los mapas sin filtros se dibujan al hacerse visibles y se recalculan
+# cuando el usuario mueve la vista
+@app.callback(
+    Output("buildtype-map", "figure"),
+    Input("buildtype-map-visible", "data"),
+    Input("buildtype-map", "relayoutData"),
+    prevent_initial_call=True,
+)
+@metrics.timed_callback("buildtype-map")
+def update_buildtype_map(visible, relayout_data):
+    key = ("buildtype-map", sale_lod.viewport_key(relayout_data, 11.5))
+    if key == ("buildtype-map", sale_lod.viewport_key(None, 11.5)):
+        return static_figure("buildtype-map")
+    return figure_cache.get_or_build(
+        key, lambda: build_scatter_map_buildtype(relayout_data)
+    )
+
+
+@app.callback(
+    Output("clustering-map", "figure"),
+    Output("clustering-map-signature", "data"),
+    Input("clustering-map-visible", "data"),
+    Input("clustering-map", "relayoutData"),
+    Input("cluster-number-dropdown", "value"),
+    Input("cluster-variables-dropdown", "value"),
+    State("clustering-map-signature", "data"),
+    prevent_initial_call=True,
+)
+@metrics.timed_callback("clustering-map")
+def update_clustering_map(visible, relayout_data, n_clusters, features, signature):
+    return patch_figure(
+        clustering_map_figure(relayout_data, n_clusters, features), signature
+    )
+
+
+def clustering_map_figure(relayout_data, n_clusters, features):
+    # Sin variables seleccionadas se usan todas; el orden no importa
+    features = tuple(
+        variable
+        for variable in cluster_variables
+        if not features or variable in features
+    )
+    viewport = clustered_lod.viewport_key(relayout_data, 12)
+    if (n_clusters, features) == (saved_n_clusters, tuple(cluster_variables)):
+        if viewport == clustered_lod.viewport_key(None, 12):
+            return static_figure("clustering-map")
+        return figure_cache.get_or_build(
+            ("clustering-map", viewport),
+            lambda: build_clustering_map(relayout_data),
+        )
+    return figure_cache.get_or_build(
+        ("clustering-map", n_clusters, features, viewport),
+        lambda: build_clustering_map(
+            relayout_data, recluster_labels(n_clusters, features)
+        ),
+    )
+
+
+# API para asignar un clúster a inmuebles nuevos sin esperar a un reclustering.
+# Acepta una lista de inmuebles en JSON (o {"listings": [...]}) o un CSV con las
+# columnas de los volcados originales y devuelve los resultados por bloques,
+# en NDJSON o CSV según la entrada
+cluster_scorer = ClusterScorer(
+    os.path.join(data_dir, "clustering_model.json"), valencia_polygons, valencia_metro
+)
+
+
+@server.route("/api/clusters", methods=["POST"])
+def score_listings():
+    as_csv = request.mimetype == "text/csv"
+    try:
+        if as_csv:
+            listings = pd.read_csv(io.BytesIO(request.get_data()))
+        else:
+            # Un cuerpo que no es JSON se trata como los demás errores de la API
+            payload = request.get_json(silent=True)
+            if payload is None:
+                raise ValueError("El cuerpo no es un JSON válido ni un CSV")
+            if isinstance(payload, dict):
+                payload = payload.get("listings")
+            if not isinstance(payload, list):
+                raise ValueError("Se esperaba una lista de inmuebles")
+            listings = pd.DataFrame.from_records(payload)
+        listings = cluster_scorer.validate(listings)
+    except (ValueError, pd.errors.ParserError) as error:
+        return {"error": str(error)}, 400
+
+    model = cluster_scorer.model()
+    if model is None:
+        return {"error": "No hay ningún modelo de clustering guardado"}, 503
+
+    chunks = cluster_scorer.iter_scores(listings, model)
+    if as_csv:
+
+        def generate():
+            for i, chunk in enumerate(chunks):
+                yield chunk.to_csv(index=False, header=i == 0)
+
+        return Response(generate(), mimetype="text/csv")
+
+    def generate():
+        for chunk in chunks:
+            yield chunk.to_json(orient="records", lines=True, force_ascii=False)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+# API de comparables: por la posición de un inmueble de la tabla o, con POST,
+# para un inmueble nuevo con sus características y coordenadas
+def comparables_response(rows, distances):
+    return Response(
+        comparables_index.table(rows, distances).to_json(
+            orient="records", force_ascii=False
+        ),
+        mimetype="application/json",
+    )
+
+
+def comparables_options(source):
+    k = int(source.get("k", N_COMPARABLES))
+    if k <= 0:
+        raise ValueError("k debe ser un entero positivo")
+    radius_km = source.get("radius_km")
+    if radius_km is None:
+        return k, None
+    radius_km = float(radius_km)
+    # La comparación también descarta NaN
+    if not radius_km >= 0:
+        raise ValueError("radius_km debe ser un número no negativo")
+    return k, radius_km
+
+
+@server.route("/api/comparables/<int:row>")
+def row_comparables(row):
+    if not 0 <= row < len(valencia_sale):
+        return {"error": f"No existe el inmueble {row}"}, 404
+    try:
+        k, radius_km = comparables_options(request.args)
+    except ValueError as error:
+        return {"error": str(error)}, 400
+    return comparables_response(
+        *comparables_index.query(row=row, k=k, radius_km=radius_km)
+    )
+
+
+@server.route("/api/comparables", methods=["POST"])
+def listing_comparables():
+    listing = request.get_json(silent=True)
+    if not isinstance(listing, dict):
+        return {"error": "Se esperaba un inmueble"}, 400
+    try:
+        k, radius_km = comparables_options(listing)
+        rows, distances = comparables_index.query(
+            listing=listing, k=k, radius_km=radius_km
+        )
+    except (TypeError, ValueError) as error:
+        return {"error": str(error)}, 400
+    return comparables_response(rows, distances)
+
+
+metrics.registry.set("valencia_startup_seconds", time.perf_counter() - startup_start)
+
+# Con gunicorn --preload, los workers heredan todo lo cargado hasta aquí
+if SHARED_DATA_DIR is not None:
+    freeze_loaded_objects()
+
 if __name__ == "__main__":
     app.run(debug=True, port=8082)
 
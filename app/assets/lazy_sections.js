@@ -0,0 +1,49 @@
+// Carga diferida de los gráficos: cuando una sección ".lazy-section" entra en
+// pantalla se marca su dcc.Store (atributo data-store) y el callback de la app
+// construye y envía la figura.
+(function () {
+    var pending = [];
+
+    function markVisible(section) {
+        window.dash_clientside.set_props(section.dataset.store, { data: true });
+    }
+
+    var observer =
+        "IntersectionObserver" in window
+            ? new IntersectionObserver(
+                  function (entries) {
+                      entries.forEach(function (entry) {
+                          if (entry.isIntersecting) {
+                              observer.unobserve(entry.target);
+                              markVisible(entry.target);
+                          }
+                      });
+                  },
+                  { rootMargin: "300px" }
+              )
+            : null;
+
+    function watchSections() {
+        if (!window.dash_clientside || !window.dash_clientside.set_props) {
+            return;
+        }
+        document
+            .querySelectorAll(".lazy-section:not([data-watched])")
+            .forEach(function (section) {
+                section.setAttribute("data-watched", "true");
+                if (observer) {
+                    observer.observe(section);
+                } else {
+                    // Sin IntersectionObserver se cargan todas las secciones
+                    pending.push(section);
+                }
+            });
+        pending.splice(0).forEach(markVisible);
+    }
+
+    // Dash renderiza el layout después de cargar los assets
+    new MutationObserver(watchSections).observe(document.documentElement, {
+        childList: true,
+        subtree: true,
+    });
+})();
@@ -0,0 +1,140 @@
+"""Inmuebles comparables (k vecinos más cercanos) para la valoración.
+
+Al arrancar se construye una matriz float32 con las características del
+inmueble estandarizadas y la ubicación en kilómetros, escalada por igual en
+ambos ejes para que la distancia geográfica sea isótropa. Cada consulta es un
+producto matriz-vector sobre los candidatos y un ``argpartition``; con radio,
+los candidatos se limitan antes con un ``FilterIndex`` sobre las coordenadas.
+"""
+
+import numpy as np
+import pandas as pd
+
+from filter_index import FilterIndex
+
+COMPARABLE_FEATURES = [
+    "PRICE",
+    "CONSTRUCTEDAREA",
+    "ROOMNUMBER",
+    "BATHNUMBER",
+    "AGE",
+    "CADASTRALQUALITYID",
+]
+N_COMPARABLES = 10
+KM_PER_DEGREE = 111.32
+
+
+class ComparablesIndex:
+    def __init__(self, frame, features=COMPARABLE_FEATURES):
+        self.frame = frame
+        self.features = [feature for feature in features if feature in frame.columns]
+        values = frame[self.features].to_numpy(dtype=float)
+        self.mean = np.nanmean(values, axis=0)
+        self.scale = np.nanstd(values, axis=0)
+        self.scale[~(self.scale > 0)] = 1
+
+        # Coordenadas en km sobre una proyección equirectangular local
+        lon = frame["LONGITUDE"].to_numpy(dtype=float)
+        lat = frame["LATITUDE"].to_numpy(dtype=float)
+        self.lon_km = KM_PER_DEGREE * np.cos(np.radians(np.nanmean(lat)))
+        self.x_km = lon * self.lon_km
+        self.y_km = lat * KM_PER_DEGREE
+        self.location_mean = np.array([np.nanmean(self.x_km), np.nanmean(self.y_km)])
+        self.location_scale = np.sqrt((np.nanvar(self.x_km) + np.nanvar(self.y_km)) / 2)
+
+        # Los valores que faltan cuentan como la media
+        self.matrix = np.nan_to_num(
+            np.column_stack(
+                [
+                    (values - self.mean) / self.scale,
+                    (np.column_stack([self.x_km, self.y_km]) - self.location_mean)
+                    / self.location_scale,
+                ]
+            )
+        ).astype(np.float32)
+        self.norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        self.location_index = FilterIndex(
+            pd.DataFrame({"X_KM": self.x_km, "Y_KM": self.y_km}),
+            range_columns=["X_KM", "Y_KM"],
+        )
+
+    def vector(self, listing):
+        """Vector de consulta para un inmueble dado como diccionario."""
+        values = np.array(
+            [listing.get(feature, np.nan) for feature in self.features], dtype=float
+        )
+        location = np.array(
+            [
+                float(listing.get("LONGITUDE", np.nan)) * self.lon_km,
+                float(listing.get("LATITUDE", np.nan)) * KM_PER_DEGREE,
+            ]
+        )
+        return np.nan_to_num(
+            np.concatenate(
+                [
+                    (values - self.mean) / self.scale,
+                    (location - self.location_mean) / self.location_scale,
+                ]
+            )
+        ).astype(np.float32)
+
+    def _candidates(self, x_km, y_km, radius_km):
+        rows = self.location_index.query(
+            ranges={
+                "X_KM": (x_km - radius_km, x_km + radius_km),
+                "Y_KM": (y_km - radius_km, y_km + radius_km),
+            }
+        )
+        inside = (self.x_km[rows] - x_km) ** 2 + (
+            self.y_km[rows] - y_km
+        ) ** 2 <= radius_km**2
+        return rows[inside]
+
+    def query(self, row=None, listing=None, k=N_COMPARABLES, radius_km=None):
+        """Posiciones de los ``k`` inmuebles más parecidos y su distancia.
+
+        Se consulta por la posición ``row`` de un inmueble de la tabla (que no
+        se incluye en el resultado) o por un ``listing`` nuevo. Con
+        ``radius_km`` solo se buscan inmuebles a esa distancia o menos.
+        """
+        if row is not None:
+            vector = self.matrix[row]
+            x_km, y_km = self.x_km[row], self.y_km[row]
+        else:
+            vector = self.vector(listing)
+            x_km = float(listing.get("LONGITUDE", np.nan)) * self.lon_km
+            y_km = float(listing.get("LATITUDE", np.nan)) * KM_PER_DEGREE
+
+        if radius_km is not None and not np.isnan(x_km + y_km):
+            rows = self._candidates(x_km, y_km, radius_km)
+            distances = self.norms[rows] - 2 * (self.matrix[rows] @ vector)
+        else:
+            rows = None
+            distances = self.norms - 2 * (self.matrix @ vector)
+        distances += vector @ vector
+
+        if row is not None and rows is None:
+            distances[row] = np.inf
+        elif row is not None:
+            distances[rows == row] = np.inf
+        k = min(k, int(np.isfinite(distances).sum()))
+        if k <= 0:
+            return np.array([], dtype=np.intp), np.array([])
+        nearest = np.argpartition(distances, k - 1)[:k]
+        nearest = nearest[np.argsort(distances[nearest])]
+        found = nearest if rows is None else rows[nearest]
+        return found, np.sqrt(np.maximum(distances[nearest], 0))
+
+    def table(self, rows, distances):
+        """Datos de los comparables para la API y la tabla del dashboard."""
+        columns = [
+            column
+            for column in ["NEIGHBORHOOD", *self.features, "LONGITUDE", "LATITUDE"]
+            if column in self.frame.columns
+        ]
+        comparables = pd.DataFrame(
+            {column: self.frame[column].to_numpy()[rows] for column in columns}
+        )
+        comparables.insert(0, "ROW", rows)
+        comparables["SIMILARITY_DISTANCE"] = distances
+        return comparables
@@ -0,0 +1,125 @@
+"""Correlaciones con PRICE para cualquier combinación de filtros del mapa.
+
+Los inmuebles se reparten en celdas por número de habitaciones, celda de la
+rejilla del slider de área y tramo de precio, y para cada celda se guardan
+las sumas de ``CorrelationStats``. Las celdas de área siguen los pasos del
+slider y los valores que caen justo en un punto de la rejilla tienen su
+propia celda, así que cualquier selección de área y habitaciones está formada
+por celdas completas. Los tramos de precio son más anchos que el paso del
+slider: los que quedan dentro de la selección se suman directamente y solo se
+recorren las filas de los dos tramos de los extremos.
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from correlation import CorrelationStats, numeric_columns
+
+N_PRICE_BUCKETS = 64
+
+
+def grid_cells(values, low, step):
+    """Celda 2k para los valores en el punto k de la rejilla y 2k+1 entre k y k+1."""
+    values = np.asarray(values, dtype=float)
+    with np.errstate(invalid="ignore"):
+        nearest = np.round((values - low) / step)
+        on_grid = low + nearest * step == values
+        below = np.floor((values - low) / step)
+        # Corrige los redondeos de la división junto a los puntos de la rejilla
+        below = np.where(low + below * step > values, below - 1, below)
+        below = np.where(low + (below + 1) * step <= values, below + 1, below)
+    cells = np.where(on_grid, 2 * nearest, 2 * below + 1)
+    return np.where(np.isnan(values), -1, cells).astype(np.int64)
+
+
+class PriceCorrelationIndex:
+    def __init__(
+        self,
+        frame,
+        area_step,
+        price_step,
+        n_price_buckets=N_PRICE_BUCKETS,
+        columns=None,
+    ):
+        self.frame = frame
+        self.columns = numeric_columns(frame) if columns is None else list(columns)
+        self.area = frame["CONSTRUCTEDAREA"].to_numpy(dtype=float)
+        self.price = frame["PRICE"].to_numpy(dtype=float)
+        self.area_low, self.area_step = np.nanmin(self.area), area_step
+        self.price_low = np.nanmin(self.price)
+
+        # Tramos de precio de un número entero de pasos del slider
+        steps = (np.nanmax(self.price) - self.price_low) / price_step
+        self.bucket_width = price_step * max(1, math.ceil(steps / n_price_buckets))
+        self.n_buckets = int(steps * price_step // self.bucket_width) + 1
+
+        # Las habitaciones sin valor solo cuentan cuando no se filtra por ellas
+        rooms = frame["ROOMNUMBER"].to_numpy(dtype=float)
+        self.room_values, room_codes = np.unique(rooms, return_inverse=True)
+        area_cells = grid_cells(self.area, self.area_low, self.area_step)
+        self.n_area_cells = int(area_cells.max()) + 1
+        groups = room_codes * self.n_area_cells + area_cells
+
+        with np.errstate(invalid="ignore"):
+            buckets = np.floor((self.price - self.price_low) / self.bucket_width)
+        valid = (area_cells >= 0) & ~np.isnan(self.price)
+        cells = np.where(valid, groups * self.n_buckets + buckets, -1).astype(np.int64)
+
+        # Solo se guardan las celdas con inmuebles, ordenadas por clave
+        self.keys, codes = np.unique(cells[valid], return_inverse=True)
+        row_cells = np.full(len(frame), -1, dtype=np.int64)
+        row_cells[valid] = codes
+        self.stats = CorrelationStats(len(self.keys), self.columns).update(
+            row_cells, frame
+        )
+        self.cell_room = self.room_values[
+            self.keys // self.n_buckets // self.n_area_cells
+        ]
+        self.cell_area = self.keys // self.n_buckets % self.n_area_cells
+        self.cell_bucket = self.keys % self.n_buckets
+
+        # Filas de cada celda, para recorrer las de los tramos de los extremos
+        self.cell_rows = np.argsort(row_cells, kind="stable")[(~valid).sum() :]
+        self.cell_starts = np.searchsorted(
+            row_cells[self.cell_rows], np.arange(len(self.keys) + 1)
+        )
+
+    def query(self, selected_area, selected_price, selected_room):
+        """Correlación de cada columna con PRICE en los inmuebles filtrados."""
+        area_low, area_high = grid_cells(selected_area, self.area_low, self.area_step)
+        price_low, price_high = (float(value) for value in selected_price)
+        in_groups = (self.cell_area >= area_low) & (self.cell_area <= area_high)
+        if selected_room != -1:
+            in_groups &= self.cell_room == selected_room
+
+        # Tramos completamente dentro del rango de precios y tramos de los extremos
+        first = math.floor((price_low - self.price_low) / self.bucket_width)
+        last = math.floor((price_high - self.price_low) / self.bucket_width)
+        if self.price_low + first * self.bucket_width < price_low:
+            inside = (self.cell_bucket > first) & (self.cell_bucket < last)
+            edges = (self.cell_bucket == first) | (self.cell_bucket == last)
+        else:
+            inside = (self.cell_bucket >= first) & (self.cell_bucket < last)
+            edges = self.cell_bucket == last
+        sums = self.stats.sums[in_groups & inside].sum(axis=0)
+
+        edge_cells = np.flatnonzero(in_groups & edges)
+        if len(edge_cells):
+            rows = np.concatenate(
+                [
+                    self.cell_rows[self.cell_starts[cell] : self.cell_starts[cell + 1]]
+                    for cell in edge_cells
+                ]
+            )
+            rows = rows[
+                (self.price[rows] >= price_low) & (self.price[rows] <= price_high)
+            ]
+            edge = CorrelationStats(1, self.columns, shift=self.stats.shift)
+            edge.update(np.zeros(len(rows), dtype=np.int64), self.frame.iloc[rows])
+            sums = sums + edge.sums[0]
+
+        stats = CorrelationStats(1, self.columns, shift=self.stats.shift)
+        stats.sums[0] = sums
+        return stats.correlations()
@@ -0,0 +1,172 @@
+"""Caché LRU de figuras para los callbacks.
+
+Las figuras se guardan ya convertidas a diccionario, con los datos en arrays
+tipados compactos, y se desalojan las menos usadas cuando se supera el límite
+de memoria. Opcionalmente se guardan también como JSON en una carpeta
+compartida, de modo que todos los workers de gunicorn aprovechan las figuras
+que ya ha calculado cualquiera de ellos. En la carpeta, las figuras van en una
+subcarpeta por versión de los datos y del código; al cambiar de versión se
+borran las anteriores, y se conservan como mucho ``FIGURE_CACHE_FILES``
+ficheros, los usados más recientemente.
+"""
+
+import hashlib
+import json
+import contextlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import plotly.io as pio
+
+from figure_encoding import compact_figure
+
+FIGURE_CACHE_MB = float(os.environ.get("FIGURE_CACHE_MB", "64"))
+FIGURE_CACHE_DIR = os.environ.get("FIGURE_CACHE_DIR") or None
+FIGURE_CACHE_FILES = int(os.environ.get("FIGURE_CACHE_FILES", "2000"))
+
+
+def _estimate_size(value):
+    # Aproximación del tamaño en memoria; lo que pesa son los arrays
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return 64 + sum(_estimate_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(_estimate_size(item) for item in value)
+    if isinstance(value, (str, bytes)):
+        return 48 + len(value)
+    return 32
+
+
+class FigureCache:
+    def __init__(self, max_bytes, disk_dir=None, max_files=FIGURE_CACHE_FILES):
+        self.max_bytes = max_bytes
+        self.disk_root = disk_dir
+        # La carpeta de la versión actual; sin versión no se usa el disco
+        self.disk_dir = None
+        self.max_files = max_files
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def use_disk_version(self, version):
+        """Usa la subcarpeta ``version`` del disco y borra las de otras versiones.
+
+        Las figuras de otros datos o de otro código no deben servirse nunca.
+        """
+        if self.disk_root is None:
+            return
+        self.disk_dir = os.path.join(self.disk_root, version)
+        os.makedirs(self.disk_dir, exist_ok=True)
+        for entry in os.scandir(self.disk_root):
+            if entry.is_dir() and entry.name != version:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _prune_disk(self):
+        # Se borran los ficheros usados hace más tiempo por encima del límite
+        try:
+            entries = [
+                entry
+                for entry in os.scandir(self.disk_dir)
+                if entry.name.endswith(".json")
+            ]
+            if len(entries) <= self.max_files:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime)
+        except OSError:
+            return
+        for entry in entries[: len(entries) - self.max_files]:
+            with contextlib.suppress(OSError):
+                os.remove(entry.path)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.json")
+
+    def _remember(self, key, figure):
+        size = _estimate_size(figure)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (figure, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+
+        if self.disk_dir is not None:
+            path = self._disk_path(key)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    figure = json.load(f)
+                # La fecha de modificación marca el último uso al recortar
+                os.utime(path)
+            except (OSError, ValueError):
+                pass
+            else:
+                self._remember(key, figure)
+                with self._lock:
+                    self.disk_hits += 1
+                return figure
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, figure):
+        # Los arrays compactos ocupan menos en la caché y al enviarlos
+        figure = compact_figure(figure)
+        self._remember(key, figure)
+
+        if self.disk_dir is not None:
+            # Escritura atómica para que otro worker nunca lea un fichero a medias
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(pio.to_json(figure, validate=False))
+                os.replace(tmp_path, self._disk_path(key))
+            except OSError:
+                # Por ejemplo, si otro worker ya ha borrado esta versión
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            else:
+                self._prune_disk()
+        return figure
+
+    def get_or_build(self, key, build):
+        figure = self.get(key)
+        if figure is None:
+            figure = self.put(key, build())
+        return figure
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+figure_cache = FigureCache(int(FIGURE_CACHE_MB * 2**20), disk_dir=FIGURE_CACHE_DIR)
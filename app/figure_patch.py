@@ -0,0 +1,89 @@
+"""Actualizaciones parciales de figuras para los callbacks de filtros.
+
+Cuando cambia un filtro casi siempre cambian solo los arrays de datos de las
+trazas (coordenadas, colores, tamaños...) y no el layout, el estilo del mapa
+ni los metadatos de las trazas. Cada figura se separa en su esqueleto y sus
+datos; si el esqueleto coincide con el que ya tiene el navegador (se guarda su
+huella en un ``dcc.Store``), el callback devuelve un ``Patch`` que solo
+reemplaza los datos de cada traza en lugar de la figura completa.
+"""
+
+import hashlib
+import json
+
+from dash import Patch
+
+# Propiedades de las trazas que se consideran datos (con "." para anidadas)
+DATA_KEYS = (
+    "x",
+    "y",
+    "z",
+    "lat",
+    "lon",
+    "locations",
+    "customdata",
+    "ids",
+    "text",
+    "hovertext",
+    "marker.color",
+    "marker.size",
+    "marker.sizeref",
+)
+
+
+def _as_dict(figure):
+    if hasattr(figure, "to_plotly_json"):
+        figure = figure.to_plotly_json()
+    return figure
+
+
+def _split_trace(trace):
+    skeleton = dict(trace)
+    data = {}
+    for key in DATA_KEYS:
+        parent, _, child = key.rpartition(".")
+        container = skeleton
+        if parent:
+            if not isinstance(container.get(parent), dict):
+                continue
+            container = skeleton[parent] = dict(container[parent])
+        if child in container:
+            data[key] = container.pop(child)
+    return skeleton, data
+
+
+def figure_signature(figure):
+    """Huella de todo lo que no son datos, incluidas las claves de datos usadas."""
+    figure = _as_dict(figure)
+    skeleton = {key: value for key, value in figure.items() if key != "data"}
+    skeleton["data"] = []
+    for trace in figure.get("data", []):
+        trace_skeleton, data = _split_trace(trace)
+        skeleton["data"].append([trace_skeleton, sorted(data)])
+    text = json.dumps(skeleton, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def patch_figure(figure, signature=None):
+    """Devuelve lo que se envía al navegador y la huella de la figura.
+
+    ``signature`` es la huella de la figura que tiene el navegador. Si
+    coincide con la nueva se devuelve un ``Patch`` con los datos de las
+    trazas; si no (primera carga, otro número de trazas, otro layout), la
+    figura completa.
+    """
+    figure = _as_dict(figure)
+    new_signature = figure_signature(figure)
+    if signature != new_signature:
+        return figure, new_signature
+
+    patch = Patch()
+    for index, trace in enumerate(figure.get("data", [])):
+        _, data = _split_trace(trace)
+        for key, value in data.items():
+            *parents, last = key.split(".")
+            target = patch["data"][index]
+            for part in parents:
+                target = target[part]
+            target[last] = value
+    return patch, new_signature
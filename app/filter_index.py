@@ -0,0 +1,74 @@
+"""Índice de filtros para responder a los filtros del mapa sin recorrer la tabla.
+
+Se construye una sola vez al arrancar: para cada columna de rango guarda sus
+valores ordenados junto a la posición de la fila original, de modo que un
+filtro ``low <= x <= high`` se resuelve con dos ``searchsorted``; para cada
+columna de igualdad guarda un bitmap de filas por valor. Las consultas
+devuelven posiciones de fila, sin copiar el DataFrame.
+"""
+
+import numpy as np
+
+
+class FilterIndex:
+    def __init__(self, df, range_columns=(), equality_columns=()):
+        self.n_rows = len(df)
+        self._all_rows = np.arange(self.n_rows)
+
+        # Valores ordenados y posición original de cada uno
+        self._sorted = {}
+        for column in range_columns:
+            values = df[column].to_numpy()
+            order = np.argsort(values, kind="stable")
+            self._sorted[column] = (values[order], order)
+
+        # Bitmap de filas por cada valor distinto
+        self._bitmaps = {}
+        for column in equality_columns:
+            values = df[column].to_numpy()
+            self._bitmaps[column] = {
+                value.item(): values == value
+                for value in np.unique(values[~np.isnan(values)])
+            }
+
+    def values(self, column):
+        return list(self._bitmaps[column])
+
+    def range_rows(self, column, low, high):
+        sorted_values, order = self._sorted[column]
+        start = np.searchsorted(sorted_values, low, side="left")
+        stop = np.searchsorted(sorted_values, high, side="right")
+        return order[start:stop]
+
+    def query(self, ranges=None, equals=None):
+        """Posiciones (ordenadas) de las filas que cumplen todos los filtros.
+
+        ``ranges`` es ``{columna: (low, high)}`` con ambos extremos incluidos y
+        ``equals`` es ``{columna: valor}``.
+        """
+        candidates = [
+            self.range_rows(column, low, high)
+            for column, (low, high) in (ranges or {}).items()
+        ]
+        # Los rangos que cubren toda la tabla no filtran nada
+        candidates = [rows for rows in candidates if len(rows) < self.n_rows]
+        candidates.sort(key=len)
+
+        if not candidates:
+            rows = self._all_rows
+        else:
+            # Empezamos por el conjunto más pequeño y lo intersecamos con el resto
+            rows = candidates[0]
+            for other in candidates[1:]:
+                member = np.zeros(self.n_rows, dtype=bool)
+                member[other] = True
+                rows = rows[member[rows]]
+            rows = np.sort(rows)
+
+        for column, value in (equals or {}).items():
+            bitmap = self._bitmaps[column].get(value)
+            if bitmap is None:
+                return self._all_rows[:0]
+            rows = rows[bitmap[rows]]
+
+        return rows
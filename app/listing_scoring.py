@@ -0,0 +1,105 @@
+"""Clasificación de inmuebles nuevos con los centroides guardados.
+
+Calcula las mismas variables que ``scripts/data_processing.py`` (antigüedad,
+tipo de construcción, distancias y barrio) y asigna cada inmueble al centroide
+más cercano del modelo que guarda ``scripts/clustering.py``, en una sola
+pasada vectorizada por bloque. Solo lee los polígonos y las estaciones que ya
+ha cargado la app, sin modificar nada del estado del dashboard.
+"""
+
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import clustering
+from distances import add_distance_features
+from features import RAW_COLUMNS, prepare_sale
+from neighborhoods import NeighborhoodIndex
+
+SCORING_CHUNK_SIZE = 5000
+
+OUTPUT_COLUMNS = [
+    "CLUSTER",
+    "NEIGHBORHOOD",
+    "BUILDTYPE",
+    "TRIMESTER",
+    "AGE",
+    "DISTANCE_TO_CITY_CENTER",
+    "DISTANCE_TO_METRO",
+    "DISTANCE_TO_BLASCO",
+    "NEAREST_METRO",
+]
+
+
+class ClusterScorer:
+    def __init__(self, model_path, polygons, metro):
+        self.model_path = model_path
+        self.names = polygons["NEIGHBORHOOD"].to_numpy(dtype=object)
+        self.neighborhoods = NeighborhoodIndex(polygons.geometry)
+        self.metro = pd.DataFrame(
+            {"LONGITUDE": metro["LONGITUDE"], "LATITUDE": metro["LATITUDE"]}
+        )
+        self._model = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        """Escalado y centroides del modelo (None si no hay ninguno guardado).
+
+        Se vuelve a leer cuando cambia el fichero, así que un reclustering se
+        aplica sin reiniciar la app.
+        """
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                model = clustering.load_model(self.model_path)
+                self._model = model and (
+                    clustering.Scaler(model["mean"], model["scale"]),
+                    np.asarray(model["centroids"], dtype=float),
+                )
+                self._mtime = mtime
+            return self._model
+
+    def validate(self, listings):
+        """Comprueba las columnas de entrada y las convierte a números."""
+        missing = [column for column in RAW_COLUMNS if column not in listings.columns]
+        if missing:
+            raise ValueError(f"Faltan las columnas {missing}")
+        listings = listings.copy()
+        for column in RAW_COLUMNS:
+            listings[column] = pd.to_numeric(listings[column], errors="coerce")
+        if listings["PERIOD"].isna().any():
+            raise ValueError("PERIOD vacío o no numérico")
+        return listings
+
+    def score(self, listings, model):
+        scaler, centroids = model
+        frame = add_distance_features(prepare_sale(listings.copy()), self.metro)
+        codes = self.neighborhoods.assign(frame["LONGITUDE"], frame["LATITUDE"])
+        frame["NEIGHBORHOOD"] = np.where(codes >= 0, self.names[codes], None)
+
+        # Los inmuebles a los que les falta alguna variable quedan con -1
+        values = frame[clustering.VARIABLES].to_numpy(dtype=float)
+        complete = ~np.isnan(values).any(axis=1)
+        labels = np.full(len(frame), -1)
+        if complete.any():
+            labels[complete] = clustering.assign(
+                scaler.transform(values[complete]), centroids
+            )[0]
+        frame["CLUSTER"] = labels
+
+        columns = OUTPUT_COLUMNS
+        if "ASSETID" in listings.columns:
+            frame["ASSETID"] = listings["ASSETID"].to_numpy()
+            columns = ["ASSETID", *columns]
+        return frame[columns]
+
+    def iter_scores(self, listings, model, chunk_size=SCORING_CHUNK_SIZE):
+        # Por bloques, para empezar a devolver resultados cuanto antes
+        for start in range(0, len(listings), chunk_size):
+            yield self.score(listings.iloc[start : start + chunk_size], model)
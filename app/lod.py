@@ -0,0 +1,170 @@
+"""Nivel de detalle (LOD) de los mapas de puntos según la vista del usuario.
+
+A partir del ``relayoutData`` del mapa (centro, zoom y esquinas visibles) se
+seleccionan las filas dentro de la vista. Si son pocas se envían los puntos
+tal cual; si no, se agrupan en celdas de una rejilla cuyo tamaño depende del
+zoom y se envía una marca por celda con el número de inmuebles y las medias.
+"""
+
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+LOD_ENABLED = os.environ.get("LOD_MODE", "1") != "0"
+LOD_MAX_POINTS = int(os.environ.get("LOD_MAX_POINTS", "5000"))
+# Lado de cada celda de la rejilla en píxeles de pantalla
+LOD_CELL_PX = int(os.environ.get("LOD_CELL_PX", "24"))
+
+# Tamaño de vista supuesto cuando el navegador aún no ha enviado las esquinas
+DEFAULT_VIEW_PX = (1400, 700)
+# Margen alrededor de la vista para que al desplazarse no aparezcan huecos
+VIEW_PADDING = 0.5
+
+
+def _degrees_per_pixel(zoom):
+    return 360.0 / (256.0 * 2.0**zoom)
+
+
+class LevelOfDetail:
+    def __init__(
+        self, lon, lat, max_points=LOD_MAX_POINTS, cell_px=LOD_CELL_PX, enabled=True
+    ):
+        self.lon = np.asarray(lon)
+        self.lat = np.asarray(lat)
+        self.max_points = max_points
+        self.cell_px = cell_px
+        self.enabled = enabled and LOD_ENABLED
+        self.center = {
+            "lat": float(np.nanmean(self.lat)),
+            "lon": float(np.nanmean(self.lon)),
+        }
+        self._cells = {}
+
+    def viewport(self, relayout_data, zoom):
+        """Zoom y límites (lon_min, lat_min, lon_max, lat_max) de la vista."""
+        relayout_data = relayout_data or {}
+        center = self.center
+        corners = None
+
+        # Los mapas de MapLibre usan "map.*" y los de Mapbox "mapbox.*"
+        for prefix in ("map", "mapbox"):
+            if f"{prefix}.zoom" in relayout_data:
+                zoom = relayout_data[f"{prefix}.zoom"]
+                center = relayout_data.get(f"{prefix}.center", center)
+                corners = relayout_data.get(f"{prefix}._derived", {}).get("coordinates")
+                break
+
+        if corners:
+            lons = [corner[0] for corner in corners]
+            lats = [corner[1] for corner in corners]
+            bounds = [min(lons), min(lats), max(lons), max(lats)]
+        else:
+            half_lon = DEFAULT_VIEW_PX[0] / 2 * _degrees_per_pixel(zoom)
+            half_lat = (
+                DEFAULT_VIEW_PX[1]
+                / 2
+                * _degrees_per_pixel(zoom)
+                * math.cos(math.radians(center["lat"]))
+            )
+            bounds = [
+                center["lon"] - half_lon,
+                center["lat"] - half_lat,
+                center["lon"] + half_lon,
+                center["lat"] + half_lat,
+            ]
+
+        pad_lon = (bounds[2] - bounds[0]) * VIEW_PADDING
+        pad_lat = (bounds[3] - bounds[1]) * VIEW_PADDING
+        bounds = (
+            bounds[0] - pad_lon,
+            bounds[1] - pad_lat,
+            bounds[2] + pad_lon,
+            bounds[3] + pad_lat,
+        )
+        return zoom, bounds
+
+    def viewport_key(self, relayout_data, zoom):
+        """Vista cuantizada para usar como clave de caché.
+
+        Los desplazamientos menores que el margen añadido a la vista dan la
+        misma clave, ya que la figura calculada sigue cubriendo la vista.
+        """
+        if not self.enabled:
+            return None
+        zoom, bounds = self.viewport(relayout_data, zoom)
+        step = (bounds[2] - bounds[0]) / 16
+        return (
+            round(zoom * 4) / 4,
+            round((bounds[0] + bounds[2]) / 2 / step),
+            round((bounds[1] + bounds[3]) / 2 / step),
+        )
+
+    def visible(self, rows, bounds):
+        lon = self.lon[rows]
+        lat = self.lat[rows]
+        inside = (
+            (lon >= bounds[0])
+            & (lon <= bounds[2])
+            & (lat >= bounds[1])
+            & (lat <= bounds[3])
+        )
+        return rows[inside]
+
+    def cell_ids(self, level):
+        # Identificador de celda de cada fila para un nivel de zoom entero
+        if level not in self._cells:
+            cell = _degrees_per_pixel(level) * self.cell_px
+            ix = np.floor((self.lon + 180.0) / cell).astype(np.int64)
+            iy = np.floor((self.lat + 90.0) / cell).astype(np.int64)
+            self._cells[level] = (ix << 32) | iy
+        return self._cells[level]
+
+    def aggregate(self, frame, rows, level, columns=(), color=None):
+        """Agrupa las filas por celda (y por ``color`` si se indica)."""
+        keys = self.cell_ids(level)[rows]
+        if color is not None:
+            codes, labels = pd.factorize(frame[color].to_numpy()[rows], sort=True)
+            rows, keys, codes = rows[codes >= 0], keys[codes >= 0], codes[codes >= 0]
+            keys = np.unique(keys, return_inverse=True)[1] * len(labels) + codes
+
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse)
+
+        cells = {
+            "LATITUDE": np.bincount(inverse, weights=self.lat[rows]) / counts,
+            "LONGITUDE": np.bincount(inverse, weights=self.lon[rows]) / counts,
+            "COUNT": counts,
+        }
+        for column in columns:
+            values = frame[column].to_numpy()[rows]
+            cells[column] = np.bincount(inverse, weights=values) / counts
+        if color is not None:
+            cells[color] = np.asarray(labels)[unique_keys % len(labels)]
+        return cells
+
+    def select(
+        self, frame, rows, relayout_data, zoom, columns=(), color=None, row_ids=False
+    ):
+        """Datos a enviar al mapa para las filas ``rows`` y la vista actual.
+
+        Devuelve ``(datos, agregado)``: columnas de los puntos visibles o, si
+        superan ``max_points``, columnas de las celdas con la cuenta ``COUNT``.
+        Con ``row_ids`` los puntos incluyen su posición en la columna ``ROW``.
+        """
+        needed = ["LATITUDE", "LONGITUDE", *columns]
+        if color is not None:
+            needed.append(color)
+
+        if self.enabled:
+            zoom, bounds = self.viewport(relayout_data, zoom)
+            rows = self.visible(rows, bounds)
+            if len(rows) > self.max_points:
+                level = max(0, min(22, int(math.floor(zoom))))
+                return self.aggregate(frame, rows, level, columns, color), True
+
+        data = {column: frame[column].to_numpy()[rows] for column in needed}
+        if row_ids:
+            data["ROW"] = rows
+        return data, False
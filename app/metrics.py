@@ -0,0 +1,511 @@
+"""Métricas de rendimiento del dashboard en formato Prometheus.
+
+Se mide cada callback de Dash, separando el filtrado de los inmuebles, la
+construcción de la figura y la serialización de la respuesta, junto con el
+tamaño de la respuesta (antes de comprimir) y el número de filas filtradas.
+También se guardan la duración de cada petición HTTP, la carga de cada tabla
+y la construcción de cada figura al arrancar, y la última duración de cada
+etapa de ``data_processing.py`` y el uso de la caché de figuras. Todo se
+publica en ``/metrics``.
+
+Cada worker de gunicorn tiene sus propios contadores. Con ``METRICS_DIR``
+cada uno vuelca los suyos en esa carpeta, en un fichero con su hora de
+arranque y su pid, y ``/metrics`` devuelve la suma de todos, responda el
+worker que responda. Los ficheros de los workers que ya no existen se
+borran, así que al reiniciarse uno las sumas bajan como en cualquier
+reinicio de un contador.
+
+Con ``PROFILE_REQUESTS=1`` las peticiones con la cabecera ``X-Profile: 1`` (o
+``?profile=1``) se ejecutan con ``cProfile``. El perfil se guarda en
+``PROFILE_DIR`` si está definida y, si no, se escriben en el log las
+funciones con más tiempo acumulado.
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import functools
+import glob
+import io
+import itertools
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+
+METRICS_ENABLED = os.environ.get("METRICS", "1") != "0"
+METRICS_DIR = os.environ.get("METRICS_DIR") or None
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "0") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or None
+PROFILE_TOP_FUNCTIONS = 25
+
+SECONDS_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+BYTES_BUCKETS = tuple(2**power for power in range(10, 26, 2))
+ROWS_BUCKETS = tuple(10**power for power in range(0, 8))
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# Nombre: (tipo, descripción, límites de los buckets)
+METRICS = {
+    "valencia_callback_seconds": (
+        HISTOGRAM,
+        "Duración de los callbacks por fase (filter, cluster, figure, serialize)",
+        SECONDS_BUCKETS,
+    ),
+    "valencia_callback_response_bytes": (
+        HISTOGRAM,
+        "Tamaño de las respuestas de los callbacks antes de comprimir",
+        BYTES_BUCKETS,
+    ),
+    "valencia_callback_rows": (
+        HISTOGRAM,
+        "Inmuebles que cumplen los filtros en cada callback",
+        ROWS_BUCKETS,
+    ),
+    "valencia_http_request_seconds": (
+        HISTOGRAM,
+        "Duración de las peticiones HTTP, compresión incluida",
+        SECONDS_BUCKETS,
+    ),
+    "valencia_http_requests_total": (COUNTER, "Peticiones HTTP atendidas", None),
+    "valencia_table_load_seconds": (
+        GAUGE,
+        "Tiempo de carga de cada tabla al arrancar",
+        None,
+    ),
+    "valencia_figure_build_seconds": (
+        GAUGE,
+        "Tiempo de construcción de cada figura sin filtros",
+        None,
+    ),
+    "valencia_figure_cache_lookups_total": (
+        COUNTER,
+        "Búsquedas en la caché de figuras por resultado (hit, disk_hit, miss)",
+        None,
+    ),
+    "valencia_figure_cache_bytes": (
+        GAUGE,
+        "Memoria estimada de la caché de figuras del worker que más ocupa",
+        None,
+    ),
+    "valencia_figure_cache_entries": (
+        GAUGE,
+        "Figuras en la caché en memoria del worker que más tiene",
+        None,
+    ),
+    "valencia_startup_seconds": (
+        GAUGE,
+        "Tiempo de arranque de la app: carga de datos, índices y figuras",
+        None,
+    ),
+    "valencia_pipeline_stage_seconds": (
+        GAUGE,
+        "Duración de la última vez que se calculó cada etapa del procesado",
+        None,
+    ),
+    "valencia_pipeline_stage_finished_timestamp_seconds": (
+        GAUGE,
+        "Fecha de la última vez que se calculó cada etapa del procesado",
+        None,
+    ),
+}
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry:
+    """Valores de las métricas de este proceso, por nombre y etiquetas."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def _key(self, name, labels):
+        if name not in METRICS:
+            raise KeyError(f"Métrica desconocida: {name}")
+        return name, tuple(sorted(labels.items()))
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = self._key(name, labels)
+        with self.lock:
+            # Un contador por bucket (sin acumular), la suma y el total
+            counts = self.values.setdefault(key, [0] * (len(buckets) + 2))
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.values[key] = value
+
+    def snapshot(self):
+        with self.lock:
+            return [
+                [name, dict(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self.values.items()
+            ]
+
+
+registry = MetricsRegistry()
+
+# Fases del callback en curso; fuera de un callback no se anotan
+_current_callback = contextvars.ContextVar("current_callback", default=None)
+_last_flush = 0.0
+# (pid, nombre del volcado); se renueva en cada worker tras el fork
+_snapshot_owner = None
+# Funciones que devuelven entradas del estado de este proceso
+_process_collectors = []
+_profile_lock = threading.Lock()
+_profile_numbers = itertools.count()
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Suma la duración del bloque a la fase ``name`` del callback en curso."""
+    current = _current_callback.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if current is not None:
+            phases = current["phases"]
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_rows(rows):
+    current = _current_callback.get()
+    if current is not None:
+        current["rows"] = rows
+
+
+def timed_callback(name):
+    """Decorador para medir un callback de Dash con la etiqueta ``name``.
+
+    El tiempo que no se anota en otra fase con ``phase`` cuenta como
+    construcción de la figura. Dentro de una petición, la serialización y el
+    tamaño se miden cuando Dash ya ha convertido la respuesta en JSON.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS_ENABLED:
+                return func(*args, **kwargs)
+            current = {"phases": {}, "rows": None}
+            token = _current_callback.set(current)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end = time.perf_counter()
+                _current_callback.reset(token)
+                phases = current["phases"]
+                phases["figure"] = max(end - start - sum(phases.values()), 0.0)
+                if has_request_context():
+                    g.metrics_callback = (name, current, end)
+                else:
+                    record_callback(name, current)
+
+        return wrapper
+
+    return decorator
+
+
+def record_callback(name, current, response_bytes=None):
+    for phase_name, seconds in current["phases"].items():
+        registry.observe(
+            "valencia_callback_seconds", seconds, callback=name, phase=phase_name
+        )
+    if current["rows"] is not None:
+        registry.observe("valencia_callback_rows", current["rows"], callback=name)
+    if response_bytes is not None:
+        registry.observe(
+            "valencia_callback_response_bytes", response_bytes, callback=name
+        )
+
+
+@contextlib.contextmanager
+def startup_timer(name, **labels):
+    """Guarda la duración del bloque en la métrica (de tipo gauge) ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.set(name, time.perf_counter() - start, **labels)
+
+
+def render(entries):
+    """Texto en el formato de exposición de Prometheus."""
+    by_name = {}
+    for name, labels, value in entries:
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        if name not in by_name:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(by_name[name], key=lambda item: str(item[0])):
+            if kind != HISTOGRAM:
+                lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value[:-2]):
+                cumulative += count
+                bucket_labels = format_labels({**labels, "le": str(bound)})
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            # El último bucket incluye también los valores mayores que todos
+            bucket_labels = format_labels({**labels, "le": "+Inf"})
+            lines.append(f"{name}_bucket{bucket_labels} {value[-1]}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-2])}")
+            lines.append(f"{name}_count{format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = {
+        key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for key, value in labels.items()
+    }
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
+
+
+def merge(snapshots):
+    """Suma los contadores e histogramas de varios workers.
+
+    De los gauges (medidas al arrancar) se toma el mayor valor.
+    """
+    merged = {}
+    for entries in snapshots:
+        for name, labels, value in entries:
+            key = (name, tuple(sorted(labels.items())))
+            if key not in merged:
+                merged[key] = value
+            elif METRICS[name][0] == HISTOGRAM:
+                merged[key] = [a + b for a, b in zip(merged[key], value)]
+            elif METRICS[name][0] == COUNTER:
+                merged[key] += value
+            else:
+                merged[key] = max(merged[key], value)
+    return [[name, dict(labels), value] for (name, labels), value in merged.items()]
+
+
+def process_snapshot():
+    """Valores de este proceso, con los de los colectores del proceso."""
+    entries = registry.snapshot()
+    for collector in _process_collectors:
+        entries.extend(collector())
+    return entries
+
+
+def _snapshot_name():
+    # La hora de arranque evita que un pid reutilizado sobrescriba los totales
+    # de un worker anterior con los de uno nuevo
+    global _snapshot_owner
+    pid = os.getpid()
+    if _snapshot_owner is None or _snapshot_owner[0] != pid:
+        _snapshot_owner = (pid, f"{time.time_ns()}-{pid}.json")
+    return _snapshot_owner[1]
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def live_snapshots(metrics_dir):
+    """Volcados de los workers vivos; borra los de los que han terminado.
+
+    Si hay varios volcados con el mismo pid, el pid se ha reutilizado y solo
+    el más reciente es de un proceso vivo.
+    """
+    newest = {}
+    stale = []
+    for path in glob.glob(os.path.join(metrics_dir, "*-*.json")):
+        started, _, pid = os.path.basename(path)[: -len(".json")].partition("-")
+        try:
+            started, pid = int(started), int(pid)
+        except ValueError:
+            continue
+        if not _process_alive(pid):
+            stale.append(path)
+        elif pid in newest and newest[pid][0] > started:
+            stale.append(path)
+        else:
+            if pid in newest:
+                stale.append(newest[pid][1])
+            newest[pid] = (started, path)
+    for path in stale:
+        with contextlib.suppress(OSError):
+            os.remove(path)
+    return [path for _, path in newest.values()]
+
+
+def flush_snapshot(metrics_dir=None):
+    """Escribe los valores de este proceso en ``METRICS_DIR``."""
+    global _last_flush
+    metrics_dir = metrics_dir or METRICS_DIR
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, _snapshot_name())
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(process_snapshot(), f)
+    os.replace(path + ".tmp", path)
+    _last_flush = time.monotonic()
+
+
+def collect(collectors=()):
+    """Valores de todos los workers (o de este proceso) y de ``collectors``."""
+    if METRICS_DIR is None:
+        entries = process_snapshot()
+    else:
+        flush_snapshot()
+        snapshots = []
+        for path in live_snapshots(METRICS_DIR):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Un volcado que otra petición acaba de borrar
+                continue
+        entries = merge(snapshots)
+    for collector in collectors:
+        entries.extend(collector())
+    return entries
+
+
+def _profiling_requested():
+    return PROFILE_REQUESTS and (
+        request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1"
+    )
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    # Solo puede haber un perfilador activo por proceso; si ya hay otra
+    # petición perfilándose, esta se atiende sin perfil
+    if _profiling_requested() and _profile_lock.acquire(blocking=False):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def _measure_response(response):
+    # Se ejecuta antes de comprimir: el tamaño es el del JSON de Dash
+    callback = g.pop("metrics_callback", None)
+    if callback is not None:
+        name, current, end = callback
+        current["phases"]["serialize"] = time.perf_counter() - end
+        size = None if response.direct_passthrough else len(response.get_data())
+        record_callback(name, current, response_bytes=size)
+    g.metrics_status = response.status_code
+    return response
+
+
+def _finish_request(error=None):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+        save_profile(profiler)
+
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    endpoint = request.url_rule.rule if request.url_rule else "other"
+    status = g.pop("metrics_status", 500 if error else 200)
+    registry.observe(
+        "valencia_http_request_seconds",
+        time.perf_counter() - start,
+        endpoint=endpoint,
+    )
+    registry.inc("valencia_http_requests_total", endpoint=endpoint, status=status)
+    if (
+        METRICS_DIR is not None
+        and time.monotonic() - _last_flush > METRICS_FLUSH_SECONDS
+    ):
+        flush_snapshot()
+
+
+def save_profile(profiler):
+    name = (
+        f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_profile_numbers)}"
+        f"-{request.path}"
+    )
+    name = name.replace("/", "_").strip("_")
+    if PROFILE_DIR is not None:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}.prof")
+        profiler.dump_stats(path)
+        logger.info("Perfil de %s guardado en %s", request.path, path)
+        return
+    output = io.StringIO()
+    stats = pstats.Stats(profiler, stream=output).sort_stats("cumulative")
+    stats.print_stats(PROFILE_TOP_FUNCTIONS)
+    logger.info("Perfil de %s:\n%s", request.path, output.getvalue())
+
+
+def enable_metrics(server, collectors=(), process_collectors=()):
+    """Mide las peticiones de ``server`` y publica ``/metrics``.
+
+    ``collectors`` son funciones que devuelven entradas ``[nombre, etiquetas,
+    valor]`` que no salen de este proceso (por ejemplo, la duración de las
+    etapas del procesado). ``process_collectors`` devuelven el estado de cada
+    worker (por ejemplo, el de su caché) y se suman con los demás valores.
+    Hay que llamarla después de ``enable_compression`` para medir las
+    respuestas antes de comprimirlas.
+    """
+    if not METRICS_ENABLED:
+        return
+    _process_collectors.extend(process_collectors)
+    server.before_request(_start_request)
+    server.after_request(_measure_response)
+    server.teardown_request(_finish_request)
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(
+            render(collect(collectors)),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
@@ -0,0 +1,121 @@
+"""Datos de solo lectura compartidos entre los workers de gunicorn.
+
+Las tablas del almacén columnar ya se cargan como vistas sobre ficheros
+mapeados en memoria (columnas numéricas y códigos de las categóricas, que
+``Categorical.from_codes`` no copia), así que todos los workers comparten las
+mismas páginas. Las que solo existen en CSV, en cambio, las parsea cada
+worker por su cuenta, y las columnas que se calculan al arrancar (los
+clústeres de cada inmueble) son arrays propios de cada worker. Con
+``SHARED_DATA_DIR`` (por ejemplo una carpeta en ``/dev/shm``) el primer
+proceso que arranca escribe unos y otros en esa carpeta con el formato del
+almacén y el resto se limita a mapear los ficheros: una sola copia de los
+datos por máquina, sin importar el número de workers.
+
+Con ``gunicorn --preload`` los datos se cargan una vez en el proceso maestro
+y los workers los heredan por copia en escritura. Los arrays de NumPy no se
+modifican, pero el recolector de basura sí escribe en la cabecera de cada
+objeto de Python al recorrerlos, lo que acaba copiando las páginas en cada
+worker; ``freeze_loaded_objects`` los aparta del recolector antes del fork.
+"""
+
+import fcntl
+import gc
+import glob
+import hashlib
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import shapely
+
+import columnar_store
+from compact_dtypes import compact_frame
+
+SHARED_DATA_DIR = os.environ.get("SHARED_DATA_DIR") or None
+
+
+def shared_table_name(name, csv_path):
+    # El tamaño y la fecha del CSV cambian al ingerir nuevos periodos
+    stat = os.stat(csv_path)
+    return f"{name}-{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def shared_copy(name, shared_name, build, schema=None, geometry=None, shared_dir=None):
+    """Vistas sobre la copia ``shared_name`` de la tabla ``name``.
+
+    El primer proceso escribe la copia que devuelve ``build`` mientras tiene
+    el cerrojo de la tabla; los demás esperan y la mapean directamente.
+    """
+    shared_dir = shared_dir or SHARED_DATA_DIR
+    os.makedirs(shared_dir, exist_ok=True)
+
+    with open(os.path.join(shared_dir, f"{name}.lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            return columnar_store.read_table(shared_dir, shared_name, required=schema)
+        except (OSError, columnar_store.StoreSchemaError):
+            pass
+
+        columnar_store.write_table(build(), shared_dir, shared_name, geometry=geometry)
+
+        # Las copias de versiones anteriores ya no se usan; los workers que aún
+        # las tengan mapeadas las conservan hasta que terminen
+        for old_dir in glob.glob(os.path.join(shared_dir, f"{name}-*")):
+            if os.path.basename(old_dir) != shared_name:
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+    return columnar_store.read_table(shared_dir, shared_name, required=schema)
+
+
+def load_shared_csv(
+    name, csv_path, schema, geometry=None, dtypes=None, shared_dir=None
+):
+    """Carga ``csv_path`` como vistas sobre su copia en la carpeta compartida,
+    con los tipos compactos ``dtypes`` si se indican."""
+
+    def build():
+        df = pd.read_csv(csv_path)
+        if geometry is not None:
+            df[geometry] = shapely.from_wkt(df[geometry])
+        columnar_store.validate_columns(
+            name, columnar_store.frame_kinds(df, geometry=geometry), schema
+        )
+        if dtypes is not None:
+            df = compact_frame(df, dtypes)
+        return df
+
+    return shared_copy(
+        name,
+        shared_table_name(name, csv_path),
+        build,
+        schema=schema,
+        geometry=geometry,
+        shared_dir=shared_dir,
+    )
+
+
+def share_columns(name, frame, shared_dir=None):
+    """``frame`` como vistas sobre su copia en la carpeta compartida.
+
+    Es para columnas que cada worker calcula al arrancar: la copia se nombra
+    con la huella de su contenido, así que todos los workers que calculan lo
+    mismo mapean los mismos ficheros.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for column in frame.columns:
+        values = frame[column].array
+        digest.update(f"{column}:{frame[column].dtype}:".encode("utf-8"))
+        if isinstance(frame[column].dtype, pd.CategoricalDtype):
+            digest.update(repr(list(values.categories)).encode("utf-8"))
+            values = values.codes
+        digest.update(memoryview(np.ascontiguousarray(values)))
+    return shared_copy(
+        name, f"{name}-{digest.hexdigest()}", lambda: frame, shared_dir=shared_dir
+    )
+
+
+def freeze_loaded_objects():
+    """Aparta del recolector los objetos creados hasta ahora (ver arriba)."""
+    gc.collect()
+    gc.freeze()
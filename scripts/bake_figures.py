@@ -0,0 +1,50 @@
+"""Precalcula las figuras sin filtros y los KPIs del dashboard.
+
+Se ejecuta después de ``data_processing.py`` desde la raíz del repositorio:
+
+    python scripts/bake_figures.py [--force]
+
+Solo vuelve a calcular la instantánea si han cambiado los datos o el código
+de las figuras.
+"""
+
+import argparse
+import os
+import sys
+
+# Cargamos la app sin construir las figuras al importarla
+os.environ.setdefault("LAZY_FIGURES", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import app as dashboard  # noqa: E402
+
+import figure_snapshots  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--force", action="store_true", help="recalcular aunque ya exista"
+    )
+    args = parser.parse_args()
+
+    if not args.force and dashboard.snapshot is not None:
+        print(f"La instantánea de {dashboard.data_hash} ya está al día")
+        return
+
+    figures = {
+        graph_id: build()
+        for graph_id, build in dashboard.static_figure_builders.items()
+    }
+    path = figure_snapshots.write_snapshot(
+        dashboard.snapshot_dir,
+        dashboard.data_hash,
+        dashboard.snapshot_code_hash,
+        dashboard.summary_kpis(),
+        figures,
+    )
+    print(f"Instantánea guardada en {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""Benchmarks del procesado y del dashboard con datos sintéticos.
+
+Para cada tamaño genera inmuebles sintéticos (``synthetic_sale.py``) en una
+carpeta de trabajo aparte, con su propio ``raw-data/`` y ``data/``, y mide:
+
+- el tiempo de cada etapa de ``data_processing.py`` con la caché vacía,
+- el tiempo de importar ``app/app.py``,
+- el tiempo de construir cada figura sin filtros,
+- la latencia de ``update_map`` para una secuencia fija de filtros, la
+  primera vez (sin caché) y al repetirla, y el tamaño de las respuestas.
+
+El procesado y la app se miden cada uno en un proceso nuevo. Los resultados
+se guardan en JSON junto con el commit, para comparar entre versiones.
+Desde la raíz del repositorio:
+
+    python scripts/benchmark.py --rows 10000 100000 1000000
+    python scripts/benchmark.py --compare antes.json despues.json
+
+El procesado lee los Excel de barrios y metro de ``raw-data/``.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+SCRIPTS_DIR = os.path.join(REPO_DIR, "scripts")
+APP_DIR = os.path.join(REPO_DIR, "app")
+RESULTS_DIR = os.path.join(REPO_DIR, "data", "benchmarks")
+
+DEFAULT_ROWS = [10_000, 100_000]
+# Nombre del volcado sintético dentro de la carpeta de trabajo
+SALE_CSV = "./raw-data/synthetic_sale.csv"
+UPDATE_MAP_CALLS = 50
+FIGURE_REPEATS = 3
+
+
+def max_rss_mb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def latency_summary(seconds):
+    ms = np.asarray(seconds) * 1000
+    return {
+        "calls": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def prepare_workspace(workdir, rows, seed):
+    """Carpeta con los Excel de barrios y metro y el volcado sintético."""
+    sys.path.insert(0, SCRIPTS_DIR)
+    import data_processing
+    from synthetic_sale import write_synthetic_sale
+
+    os.makedirs(os.path.join(workdir, "raw-data"), exist_ok=True)
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    # Los Excel se copian con el nombre que espera data_processing.py
+    for path in [data_processing.POLYGONS_XLSX, data_processing.METRO_XLSX]:
+        name = os.path.basename(path)
+        source = os.path.join(REPO_DIR, "raw-data", name)
+        if not os.path.exists(source):
+            source = os.path.join(REPO_DIR, "raw-data", name.lower())
+        shutil.copy(source, os.path.join(workdir, "raw-data", name))
+
+    start = time.perf_counter()
+    write_synthetic_sale(
+        rows,
+        os.path.join(workdir, SALE_CSV),
+        polygons_path=os.path.join(REPO_DIR, "data", "valencia_polygons.csv"),
+        metro_path=os.path.join(REPO_DIR, "data", "valencia_metro.csv"),
+        seed=seed,
+    )
+    return time.perf_counter() - start
+
+
+def measure_pipeline(workdir):
+    """Tiempo de cada etapa del procesado completo (en un proceso nuevo)."""
+    os.chdir(workdir)
+    os.environ["SALE_RAW_PATH"] = SALE_CSV
+    sys.path.insert(0, SCRIPTS_DIR)
+    import data_processing
+
+    start = time.perf_counter()
+    data_processing.pipeline.run()
+    return {
+        "total_s": time.perf_counter() - start,
+        "stages_s": dict(data_processing.pipeline.timings),
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def filter_sequence(dashboard, n_calls, seed):
+    """Selecciones de los filtros sobre la rejilla de los sliders."""
+    rng = np.random.default_rng(seed)
+    sale = dashboard.valencia_sale
+    rooms = [-1, *sorted(int(room) for room in sale["ROOMNUMBER"].dropna().unique())]
+
+    def grid_range(column, step):
+        low, high = float(sale[column].min()), float(sale[column].max())
+        points = low + step * np.arange(int((high - low) // step) + 1)
+        return sorted(float(value) for value in rng.choice(points, 2))
+
+    return [
+        (
+            grid_range("CONSTRUCTEDAREA", dashboard.AREA_STEP),
+            grid_range("PRICE", dashboard.PRICE_STEP),
+            int(rng.choice(rooms)),
+        )
+        for _ in range(n_calls)
+    ]
+
+
+def measure_app(workdir, n_calls, seed):
+    """Importación, figuras y ``update_map`` de la app (en un proceso nuevo)."""
+    os.environ["DATA_DIR"] = os.path.join(workdir, "data")
+    os.environ.setdefault("LAZY_FIGURES", "1")
+    sys.path.insert(0, APP_DIR)
+
+    start = time.perf_counter()
+    import app as dashboard
+
+    import_s = time.perf_counter() - start
+    import plotly.io.json as pio_json
+
+    figures = {}
+    for graph_id, build in dashboard.static_figure_builders.items():
+        seconds = []
+        for _ in range(FIGURE_REPEATS):
+            start = time.perf_counter()
+            build()
+            seconds.append(time.perf_counter() - start)
+        figures[graph_id] = float(np.median(seconds))
+
+    # Como en el navegador, cada llamada recibe la firma de la anterior
+    selections = filter_sequence(dashboard, n_calls, seed)
+    update_map = {}
+    for run in ["cold", "warm"]:
+        seconds, payload = [], []
+        signature = None
+        for selection in selections:
+            start = time.perf_counter()
+            figure, signature = dashboard.update_map(*selection, signature=signature)
+            body = pio_json.to_json_plotly(figure)
+            seconds.append(time.perf_counter() - start)
+            payload.append(len(body))
+        update_map[run] = {
+            **latency_summary(seconds),
+            "mean_bytes": float(np.mean(payload)),
+        }
+
+    return {
+        "import_s": import_s,
+        "rows": len(dashboard.valencia_sale),
+        "figures_s": figures,
+        "update_map": update_map,
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def run_child(kind, workdir, args):
+    # Cada medida en un intérprete nuevo, para que no se mezclen las cachés
+    result_path = os.path.join(workdir, f"{kind}.json")
+    command = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--measure",
+        kind,
+        "--workdir",
+        workdir,
+        "--calls",
+        str(args.calls),
+        "--seed",
+        str(args.seed),
+    ]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    with open(result_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(dirty)
+
+
+def run_benchmarks(args):
+    commit, dirty = git_commit()
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "sizes": {},
+    }
+    for rows in args.rows:
+        workdir = tempfile.mkdtemp(prefix=f"valencia-bench-{rows}-")
+        try:
+            print(f"{rows} inmuebles en {workdir}")
+            result = {"generate_s": prepare_workspace(workdir, rows, args.seed)}
+            result["pipeline"] = run_child("pipeline", workdir, args)
+            print(f"  procesado: {result['pipeline']['total_s']:.1f} s")
+            result["app"] = run_child("app", workdir, args)
+            print(
+                f"  importación de la app: {result['app']['import_s']:.1f} s, "
+                f"update_map p50: "
+                f"{result['app']['update_map']['cold']['p50_ms']:.0f} ms"
+            )
+            report["sizes"][str(rows)] = result
+        finally:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(args.output, exist_ok=True)
+    stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(args.output, f"{stamp}-{(commit or 'nogit')[:8]}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+    print(f"Resultados guardados en {path}")
+
+
+def flatten(values, prefix=""):
+    flat = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(base_path, new_path):
+    """Imprime cada medida de los dos ficheros y el cociente nuevo/base."""
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"base: {base.get('commit')}  nuevo: {new.get('commit')}")
+    base_values = flatten(base["sizes"])
+    new_values = flatten(new["sizes"])
+    for key in sorted(set(base_values) & set(new_values)):
+        old, current = base_values[key], new_values[key]
+        ratio = current / old if old else float("nan")
+        print(f"{key:60} {old:14.3f} {current:14.3f} {ratio:8.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ROWS,
+        help="número de inmuebles de cada prueba",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--calls",
+        type=int,
+        default=UPDATE_MAP_CALLS,
+        help="llamadas a update_map en cada pasada",
+    )
+    parser.add_argument(
+        "--output", default=RESULTS_DIR, help="carpeta de los resultados"
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="conservar las carpetas de trabajo"
+    )
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("BASE", "NUEVO"),
+        help="comparar dos ficheros de resultados",
+    )
+    parser.add_argument(
+        "--measure", choices=["pipeline", "app"], help=argparse.SUPPRESS
+    )
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    elif args.measure:
+        if args.measure == "pipeline":
+            result = measure_pipeline(args.workdir)
+        else:
+            result = measure_app(args.workdir, args.calls, args.seed)
+        with open(
+            os.path.join(args.workdir, f"{args.measure}.json"), "w", encoding="utf-8"
+        ) as f:
+            json.dump(result, f, indent=1)
+    else:
+        run_benchmarks(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Resúmenes de cuantiles por grupo para los diagramas de caja.
+
+En lugar de enviar al navegador todos los precios de cada barrio para que
+plotly calcule los cuartiles, se calculan aquí el número de inmuebles, la
+media, los cuartiles (interpolación lineal, como ``np.quantile``), los
+bigotes (el valor más extremo dentro de 1,5 veces el rango intercuartílico) y
+una muestra acotada de los valores atípicos. Los valores se ordenan una sola
+vez por grupo y valor; con ``presorted`` se puede reutilizar ese orden para
+calcular los resúmenes de cualquier subconjunto de filas sin volver a ordenar.
+"""
+
+import numpy as np
+import pandas as pd
+
+BOX_COLUMNS = ["COUNT", "MEAN", "Q1", "MEDIAN", "Q3", "LOWER_FENCE", "UPPER_FENCE"]
+MAX_OUTLIERS = 50
+WHISKER_IQR = 1.5
+
+
+def sort_order(codes, values):
+    """Orden de las filas por grupo y valor, sin las que no tienen ninguno."""
+    codes = np.asarray(codes)
+    values = np.asarray(values, dtype=float)
+    valid = np.flatnonzero((codes >= 0) & ~np.isnan(values))
+    return valid[np.lexsort((values[valid], codes[valid]))]
+
+
+def _quantile(sorted_values, starts, counts, q):
+    position = (counts - 1) * q
+    low = np.floor(position).astype(np.int64)
+    high = np.ceil(position).astype(np.int64)
+    low_values = sorted_values[starts + low]
+    return low_values + (sorted_values[starts + high] - low_values) * (position - low)
+
+
+def box_summaries(codes, values, n_groups, order=None, max_outliers=MAX_OUTLIERS):
+    """Resumen de cada grupo ``0..n_groups-1`` y muestra de valores atípicos.
+
+    ``order`` son las filas a resumir ya ordenadas por grupo y valor (por
+    ejemplo un subconjunto de ``sort_order``); si no se da, se calcula. Los
+    grupos sin filas quedan con COUNT 0 y el resto de columnas a NaN.
+    Devuelve dos DataFrames: el resumen, con una fila por grupo, y los
+    atípicos, con las columnas GROUP y VALUE.
+    """
+    codes = np.asarray(codes)
+    values = np.asarray(values, dtype=float)
+    if order is None:
+        order = sort_order(codes, values)
+    sorted_codes = codes[order]
+    sorted_values = values[order]
+
+    counts = np.bincount(sorted_codes, minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    summary = pd.DataFrame(np.nan, index=np.arange(n_groups), columns=BOX_COLUMNS)
+    summary["COUNT"] = counts
+    filled = np.flatnonzero(counts > 0)
+    if len(filled) == 0:
+        return summary, pd.DataFrame({"GROUP": [], "VALUE": []})
+
+    sums = np.bincount(sorted_codes, weights=sorted_values, minlength=n_groups)
+    summary.loc[filled, "MEAN"] = sums[filled] / counts[filled]
+    for column, q in [("Q1", 0.25), ("MEDIAN", 0.5), ("Q3", 0.75)]:
+        summary.loc[filled, column] = _quantile(
+            sorted_values, starts[filled], counts[filled], q
+        )
+
+    # Los bigotes llegan al valor más extremo dentro de 1,5 veces el rango
+    # intercuartílico; lo que queda fuera son los atípicos
+    q1 = summary["Q1"].to_numpy()
+    q3 = summary["Q3"].to_numpy()
+    lower_fence = np.full(n_groups, np.nan)
+    upper_fence = np.full(n_groups, np.nan)
+    outlier_groups, outlier_values = [], []
+    for group in filled:
+        group_values = sorted_values[starts[group] : starts[group] + counts[group]]
+        iqr = q3[group] - q1[group]
+        low = np.searchsorted(group_values, q1[group] - WHISKER_IQR * iqr, "left")
+        high = np.searchsorted(group_values, q3[group] + WHISKER_IQR * iqr, "right")
+        lower_fence[group] = group_values[low]
+        upper_fence[group] = group_values[high - 1]
+
+        outliers = np.concatenate([group_values[:low], group_values[high:]])
+        if len(outliers) > max_outliers:
+            # Muestra repartida a lo largo de los atípicos, con los extremos
+            outliers = outliers[
+                np.linspace(0, len(outliers) - 1, max_outliers).round().astype(int)
+            ]
+        outlier_groups.append(np.full(len(outliers), group))
+        outlier_values.append(outliers)
+    summary["LOWER_FENCE"] = lower_fence
+    summary["UPPER_FENCE"] = upper_fence
+
+    outliers = pd.DataFrame(
+        {
+            "GROUP": np.concatenate(outlier_groups),
+            "VALUE": np.concatenate(outlier_values),
+        }
+    )
+    return summary, outliers
+
+
+def neighborhood_price_summary(valencia_sale, names, max_outliers=MAX_OUTLIERS):
+    """Resumen de PRICE por barrio, en el orden de ``names``."""
+    names = np.asarray(names, dtype=object)
+    codes = pd.Categorical(
+        np.asarray(valencia_sale["NEIGHBORHOOD"], dtype=object), categories=names
+    ).codes
+    summary, outliers = box_summaries(
+        codes,
+        valencia_sale["PRICE"].to_numpy(dtype=float),
+        len(names),
+        max_outliers=max_outliers,
+    )
+    summary.insert(0, "NEIGHBORHOOD", names)
+    outliers = pd.DataFrame(
+        {
+            "NEIGHBORHOOD": names[outliers["GROUP"].to_numpy(dtype=np.int64)],
+            "PRICE": outliers["VALUE"],
+        }
+    )
+    return summary, outliers
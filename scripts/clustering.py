@@ -0,0 +1,351 @@
+"""Clustering K-means de los inmuebles.
+
+Sustituye al notebook ``clustering.ipynb`` para generar
+``valencia_sale_clustered.csv``: estandariza las nueve variables de la
+metodología y ajusta un K-means por mini-lotes en NumPy, con las asignaciones
+repartidas entre varios hilos, seguido de unas pasadas completas de Lloyd para
+afinar los centroides. El escalado y los centroides se guardan en
+``data/clustering_model.json`` y la siguiente ejecución parte de ellos, así
+que al añadir datos nuevos solo hacen falta unas pocas iteraciones y las
+etiquetas de los clústeres se mantienen.
+
+Se ejecuta desde la raíz del repositorio:
+
+    python scripts/clustering.py [--clusters K] [--fresh]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import columnar_store
+
+DATA_DIR = "./data"
+STORE_DIR = "./data/store"
+MODEL_PATH = "./data/clustering_model.json"
+MODEL_VERSION = 1
+
+VARIABLES = [
+    "PRICE",
+    "CONSTRUCTEDAREA",
+    "ROOMNUMBER",
+    "BATHNUMBER",
+    "AGE",
+    "DISTANCE_TO_CITY_CENTER",
+    "DISTANCE_TO_METRO",
+    "DISTANCE_TO_BLASCO",
+    "CADASTRALQUALITYID",
+]
+
+N_CLUSTERS = 3
+RANDOM_STATE = 42
+BATCH_SIZE = 4096
+CHUNK_SIZE = 65_536
+N_JOBS = os.cpu_count() or 1
+
+
+class Scaler:
+    """Estandarización por columna (media 0 y desviación típica 1)."""
+
+    def __init__(self, mean, scale):
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+
+    @classmethod
+    def fit(cls, X):
+        scale = X.std(axis=0)
+        scale[scale == 0] = 1
+        return cls(X.mean(axis=0), scale)
+
+    def transform(self, X):
+        return ((X - self.mean) / self.scale).astype(np.float32)
+
+    def inverse_transform(self, X):
+        return X * self.scale + self.mean
+
+
+def _chunks(n, chunk_size=CHUNK_SIZE):
+    return [slice(start, start + chunk_size) for start in range(0, n, chunk_size)]
+
+
+def _assign_chunk(X, centroids):
+    # |x - c|² = |x|² - 2 x·c + |c|², con el producto de matrices de NumPy
+    distances = (
+        np.einsum("ij,ij->i", X, X)[:, None]
+        - 2 * X @ centroids.T
+        + np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    )
+    labels = distances.argmin(axis=1)
+    return labels, np.maximum(distances[np.arange(len(X)), labels], 0)
+
+
+def assign(X, centroids, n_jobs=N_JOBS):
+    """Centroide más cercano a cada fila y su distancia al cuadrado."""
+    centroids = centroids.astype(X.dtype)
+    if n_jobs <= 1 or len(X) <= CHUNK_SIZE:
+        return _assign_chunk(X, centroids)
+    # NumPy libera el GIL en las operaciones con matrices
+    with ThreadPoolExecutor(n_jobs) as executor:
+        parts = list(
+            executor.map(
+                lambda rows: _assign_chunk(X[rows], centroids), _chunks(len(X))
+            )
+        )
+    return (
+        np.concatenate([labels for labels, _ in parts]),
+        np.concatenate([distances for _, distances in parts]),
+    )
+
+
+def _cluster_sums(X, labels, n_clusters):
+    sums = np.zeros((n_clusters, X.shape[1]))
+    for column in range(X.shape[1]):
+        sums[:, column] = np.bincount(
+            labels, weights=X[:, column], minlength=n_clusters
+        )
+    return sums, np.bincount(labels, minlength=n_clusters)
+
+
+def cluster_centroids(X, labels, n_clusters):
+    """Media de cada clúster (NaN en los que no tienen filas)."""
+    sums, counts = _cluster_sums(X, labels, n_clusters)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return sums / counts[:, None]
+
+
+def kmeans_plus_plus(X, n_clusters, rng, sample_size=100_000):
+    """Centroides iniciales con k-means++ sobre una muestra de las filas."""
+    if len(X) > sample_size:
+        X = X[rng.choice(len(X), sample_size, replace=False)]
+    centroids = [X[rng.integers(len(X))]]
+    closest = ((X - centroids[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_clusters):
+        total = closest.sum()
+        if total > 0:
+            index = rng.choice(len(X), p=closest / total)
+        else:
+            index = rng.integers(len(X))
+        centroids.append(X[index])
+        closest = np.minimum(closest, ((X - X[index]) ** 2).sum(axis=1))
+    return np.array(centroids, dtype=float)
+
+
+class MiniBatchKMeans:
+    def __init__(
+        self,
+        n_clusters=N_CLUSTERS,
+        batch_size=BATCH_SIZE,
+        max_iter=300,
+        tol=1e-4,
+        n_refine=10,
+        random_state=RANDOM_STATE,
+        n_jobs=N_JOBS,
+    ):
+        self.n_clusters = n_clusters
+        self.batch_size = batch_size
+        self.max_iter = max_iter
+        self.tol = tol
+        self.n_refine = n_refine
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.centroids = None
+        self.labels = None
+        self.inertia = None
+        self.n_iter = 0
+
+    def fit(self, X, init=None):
+        """Ajusta los centroides; ``init`` permite partir de unos anteriores."""
+        rng = np.random.default_rng(self.random_state)
+        if len(X) < self.n_clusters:
+            raise ValueError(f"Hacen falta al menos {self.n_clusters} filas")
+        if init is None:
+            centroids = kmeans_plus_plus(X, self.n_clusters, rng)
+        else:
+            centroids = np.array(init, dtype=float)
+
+        # Actualizaciones por mini-lotes: cada centroide se mueve hacia la media
+        # de sus puntos con un paso que decrece con los puntos que ha recibido
+        counts = np.zeros(self.n_clusters)
+        self.n_iter = 0
+        for _ in range(self.max_iter):
+            self.n_iter += 1
+            batch = X[rng.integers(len(X), size=min(self.batch_size, len(X)))]
+            labels, _ = _assign_chunk(batch, centroids.astype(X.dtype))
+            sums, batch_counts = _cluster_sums(batch, labels, self.n_clusters)
+            counts += batch_counts
+            updated = batch_counts > 0
+            previous = centroids.copy()
+            centroids[updated] += (
+                sums[updated] - batch_counts[updated, None] * centroids[updated]
+            ) / counts[updated, None]
+            if ((centroids - previous) ** 2).sum() < self.tol * self.n_clusters:
+                break
+
+        # Pasadas completas de Lloyd hasta que las etiquetas no cambian
+        labels = None
+        for _ in range(self.n_refine):
+            new_labels, _ = assign(X, centroids, self.n_jobs)
+            if labels is not None and np.array_equal(labels, new_labels):
+                break
+            labels = new_labels
+            sums, cluster_counts = _cluster_sums(X, labels, self.n_clusters)
+            filled = cluster_counts > 0
+            centroids[filled] = sums[filled] / cluster_counts[filled, None]
+
+        self.centroids = centroids
+        self.labels, distances = assign(X, centroids, self.n_jobs)
+        self.inertia = float(distances.sum())
+        return self
+
+    def predict(self, X):
+        return assign(X, self.centroids, self.n_jobs)[0]
+
+
+def load_model(path=MODEL_PATH):
+    try:
+        with open(path, encoding="utf-8") as f:
+            model = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if model.get("version") != MODEL_VERSION:
+        return None
+    return model
+
+
+def save_model(model, path=MODEL_PATH):
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(model, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def cluster_sale(valencia_sale, n_clusters=None, previous=None):
+    """Asigna un clúster a cada inmueble con las variables completas.
+
+    Si ``previous`` es un modelo guardado con las mismas variables y número
+    de clústeres, sus centroides (en las unidades originales) son el punto de
+    partida. Devuelve los inmuebles con las columnas CLUSTER y Cluster y el
+    modelo a guardar.
+    """
+    if n_clusters is None:
+        n_clusters = previous["n_clusters"] if previous else N_CLUSTERS
+    valencia_sale = valencia_sale.dropna(subset=VARIABLES + ["LATITUDE", "LONGITUDE"])
+    values = valencia_sale[VARIABLES].to_numpy(dtype=float)
+    scaler = Scaler.fit(values)
+    X = scaler.transform(values)
+
+    init = None
+    if (
+        previous
+        and previous["variables"] == VARIABLES
+        and previous["n_clusters"] == n_clusters
+    ):
+        # Los centroides anteriores se pasan al escalado de los datos actuales
+        old_scaler = Scaler(previous["mean"], previous["scale"])
+        init = scaler.transform(
+            old_scaler.inverse_transform(np.array(previous["centroids"]))
+        )
+
+    kmeans = MiniBatchKMeans(n_clusters=n_clusters).fit(X, init=init)
+
+    valencia_sale = valencia_sale.copy()
+    valencia_sale["CLUSTER"] = kmeans.labels
+    valencia_sale["Cluster"] = valencia_sale["CLUSTER"].astype(str)
+    model = {
+        "version": MODEL_VERSION,
+        "variables": VARIABLES,
+        "n_clusters": n_clusters,
+        "mean": scaler.mean.tolist(),
+        "scale": scaler.scale.tolist(),
+        "centroids": kmeans.centroids.tolist(),
+        "inertia": kmeans.inertia,
+        "rows": len(valencia_sale),
+        "warm_start": init is not None,
+        "iterations": kmeans.n_iter,
+    }
+    return valencia_sale, model
+
+
+def clustered_mask(valencia_sale):
+    """Inmuebles con todas las variables y coordenadas, los que se agrupan."""
+    return (
+        valencia_sale[VARIABLES + ["LATITUDE", "LONGITUDE"]]
+        .notna()
+        .all(axis=1)
+        .to_numpy()
+    )
+
+
+def sale_labels(valencia_sale, labels):
+    """Clúster de cada inmueble de ``valencia_sale``, o -1 si no se ha agrupado.
+
+    ``labels`` es la columna CLUSTER que devuelve ``cluster_sale``, que solo
+    tiene los inmuebles con todas las variables y en el mismo orden.
+    """
+    clustered = clustered_mask(valencia_sale)
+    labels = np.asarray(labels)
+    if clustered.sum() != len(labels):
+        raise ValueError(
+            f"Hay {len(labels)} inmuebles con clúster y {clustered.sum()} con "
+            "todas las variables; vuelva a calcular los clústeres"
+        )
+    assigned = np.full(len(valencia_sale), -1, dtype=np.int8)
+    assigned[clustered] = labels
+    return assigned
+
+
+def write_clustered(valencia_sale_clustered):
+    valencia_sale_clustered.to_csv(
+        os.path.join(DATA_DIR, "valencia_sale_clustered.csv"), index=False
+    )
+    columnar_store.write_table(
+        valencia_sale_clustered, STORE_DIR, "valencia_sale_clustered"
+    )
+
+
+def recluster(valencia_sale, n_clusters=None, fresh=False):
+    """Vuelve a calcular los clústeres y guarda los resultados y el modelo."""
+    previous = None if fresh else load_model()
+    valencia_sale_clustered, model = cluster_sale(valencia_sale, n_clusters, previous)
+    write_clustered(valencia_sale_clustered)
+    save_model(model)
+    return model
+
+
+def read_sale():
+    try:
+        return columnar_store.read_table(STORE_DIR, "valencia_sale", mmap=False)
+    except (OSError, columnar_store.StoreSchemaError):
+        return pd.read_csv(os.path.join(DATA_DIR, "valencia_sale.csv"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--clusters",
+        type=int,
+        help=f"número de clústeres (por defecto el del modelo guardado o {N_CLUSTERS})",
+    )
+    parser.add_argument(
+        "--fresh",
+        action="store_true",
+        help="no partir de los centroides guardados",
+    )
+    args = parser.parse_args()
+
+    model = recluster(read_sale(), args.clusters, args.fresh)
+    start = "centroides guardados" if model["warm_start"] else "k-means++"
+    print(
+        f"{model['rows']} inmuebles en {model['n_clusters']} clústeres "
+        f"(inicio: {start}, inercia {model['inertia']:.1f})"
+    )
+
+
+if __name__ == "__main__":
+    main()
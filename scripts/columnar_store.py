@@ -0,0 +1,333 @@
+"""Almacén columnar binario para los datos procesados.
+
+Cada tabla se guarda en una carpeta con un fichero ``.npy`` por columna y un
+``schema.json`` que describe el tipo de cada una. Las columnas numéricas se
+cargan con ``mmap_mode="r"`` (sin parsear texto y compartiendo la caché de
+páginas del sistema entre procesos), las columnas de texto se guardan como
+códigos enteros más su lista de categorías y las geometrías como WKB.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import shapely
+
+STORE_VERSION = 1
+
+# Tipos de columna admitidos en el esquema
+NUMERIC = "numeric"
+CATEGORY = "category"
+GEOMETRY = "geometry"
+
+
+class StoreSchemaError(ValueError):
+    """La tabla almacenada no coincide con el esquema esperado."""
+
+
+def _codes_dtype(n_categories):
+    # Reservamos el -1 para los valores nulos
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _column_kind(series):
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return CATEGORY
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return NUMERIC
+    return CATEGORY
+
+
+def write_table(df, store_dir, name, geometry=None):
+    """Escribe ``df`` en ``store_dir/name`` sustituyendo la versión anterior."""
+    table_dir = os.path.join(store_dir, name)
+    tmp_dir = table_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for i, column in enumerate(df.columns):
+        series = df[column]
+        entry = {"name": column, "file": f"c{i}.npy"}
+
+        if column == geometry:
+            wkb = shapely.to_wkb(np.asarray(series, dtype=object))
+            offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(geom) for geom in wkb])
+            buffer = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+            np.save(os.path.join(tmp_dir, entry["file"]), buffer)
+            entry["offsets"] = f"c{i}.offsets.npy"
+            np.save(os.path.join(tmp_dir, entry["offsets"]), offsets)
+            entry.update(kind=GEOMETRY, dtype="wkb")
+        elif _column_kind(series) == NUMERIC:
+            values = series.to_numpy()
+            np.save(os.path.join(tmp_dir, entry["file"]), values)
+            entry.update(kind=NUMERIC, dtype=values.dtype.str)
+        else:
+            codes, categories = pd.factorize(series, sort=True)
+            codes = codes.astype(_codes_dtype(len(categories)))
+            np.save(os.path.join(tmp_dir, entry["file"]), codes)
+            entry.update(
+                kind=CATEGORY,
+                dtype=codes.dtype.str,
+                categories=[str(value) for value in categories],
+            )
+
+        columns.append(entry)
+
+    # Huella del contenido para saber si los datos han cambiado sin releerlos
+    content_hash = hashlib.blake2b(digest_size=16)
+    for file_name in sorted(os.listdir(tmp_dir)):
+        content_hash.update(file_name.encode("utf-8"))
+        file_digest(os.path.join(tmp_dir, file_name), content_hash)
+
+    schema = {
+        "version": STORE_VERSION,
+        "rows": len(df),
+        "content_hash": content_hash.hexdigest(),
+        "columns": columns,
+    }
+    with open(os.path.join(tmp_dir, "schema.json"), "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False, indent=1)
+
+    # Sustituimos la tabla de golpe para que nadie lea una escritura a medias
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.replace(tmp_dir, table_dir)
+
+
+def _append_npy(path, values):
+    # Añade filas al final de un .npy reescribiendo solo su cabecera; numpy
+    # reserva espacio en la cabecera para que la dimensión pueda crecer
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version != (1, 0):
+            raise StoreSchemaError(f"{path}: versión de .npy no soportada")
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        data_offset = f.tell()
+        values = np.ascontiguousarray(values)
+        if values.dtype != dtype or len(shape) != 1 or fortran_order:
+            raise StoreSchemaError(f"{path}: el tipo de los datos nuevos no coincide")
+
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(
+            header,
+            {
+                "descr": np.lib.format.dtype_to_descr(dtype),
+                "fortran_order": False,
+                "shape": (shape[0] + len(values),),
+            },
+        )
+        if len(header.getvalue()) != data_offset:
+            raise StoreSchemaError(f"{path}: la cabecera no admite más filas")
+
+        f.seek(0, os.SEEK_END)
+        f.write(values.tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+    return values.tobytes()
+
+
+def _widen_npy(path, dtype):
+    # Reescribe la columna con un tipo más amplio; solo esta columna pasa por
+    # memoria
+    stored = np.load(path, mmap_mode="r")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, stored.astype(dtype))
+    del stored
+    os.replace(tmp_path, path)
+
+
+def append_table(df, store_dir, name, widen=False):
+    """Añade las filas de ``df`` al final de una tabla ya guardada.
+
+    El coste depende solo del número de filas nuevas. Si los datos nuevos no
+    encajan en el esquema guardado (columnas distintas, tipos incompatibles,
+    demasiadas categorías nuevas) se lanza ``StoreSchemaError`` y hay que
+    reescribir la tabla con ``write_table``. Con ``widen``, las columnas
+    numéricas guardadas en las que no caben los valores nuevos (por ejemplo,
+    una columna entera que ahora tiene nulos) se reescriben con un tipo más
+    amplio en lugar de rechazar los datos.
+    """
+    schema = read_schema(store_dir, name)
+    table_dir = os.path.join(store_dir, name)
+    columns = schema["columns"]
+    if sorted(c["name"] for c in columns) != sorted(df.columns):
+        raise StoreSchemaError(f"{name}: las columnas nuevas no coinciden")
+
+    # Preparamos todas las columnas antes de escribir nada
+    prepared = []
+    for entry in columns:
+        series = df[entry["name"]]
+        if entry["kind"] == GEOMETRY:
+            wkb = shapely.to_wkb(np.asarray(series, dtype=object))
+            offsets = np.load(os.path.join(table_dir, entry["offsets"]), mmap_mode="r")
+            new_offsets = offsets[-1] + np.cumsum([len(geom) for geom in wkb])
+            buffer = np.frombuffer(b"".join(wkb), dtype=np.uint8)
+            prepared.append((entry, buffer, new_offsets.astype(np.int64), None))
+        elif entry["kind"] == NUMERIC:
+            dtype = np.dtype(entry["dtype"])
+            values = series.to_numpy()
+            if not np.can_cast(values.dtype, dtype, casting="same_kind"):
+                error = f"{name}: tipo incompatible en {entry['name']}"
+            elif (
+                dtype.kind in "iu"
+                and len(values)
+                and not (
+                    np.iinfo(dtype).min <= values.min()
+                    and values.max() <= np.iinfo(dtype).max
+                )
+            ):
+                error = f"{name}: valores fuera de rango en {entry['name']}"
+            else:
+                error = None
+
+            widened = None
+            if error is not None:
+                if not widen or values.dtype.kind not in "biuf":
+                    raise StoreSchemaError(error)
+                dtype = widened = np.result_type(values.dtype, dtype)
+                entry = {**entry, "dtype": dtype.str}
+            prepared.append((entry, values.astype(dtype), None, widened))
+        else:
+            # Las categorías nuevas se añaden al final; los códigos ya
+            # guardados siguen siendo válidos
+            labels = series.astype(object)
+            present = labels.notna()
+            labels[present] = labels[present].astype(str)
+            categories = list(entry["categories"])
+            known = set(categories)
+            categories += [
+                label for label in pd.unique(labels[present]) if label not in known
+            ]
+            dtype = np.dtype(entry["dtype"])
+            if len(categories) >= np.iinfo(dtype).max:
+                raise StoreSchemaError(
+                    f"{name}: demasiadas categorías en {entry['name']}"
+                )
+            codes = pd.Categorical(labels, categories=categories).codes.astype(dtype)
+            prepared.append(({**entry, "categories": categories}, codes, None, None))
+
+    content_hash = hashlib.blake2b(
+        schema.get("content_hash", "").encode("utf-8"), digest_size=16
+    )
+    new_columns = []
+    for entry, values, offsets, widened in prepared:
+        path = os.path.join(table_dir, entry["file"])
+        if widened is not None:
+            _widen_npy(path, widened)
+            content_hash.update(f"widen:{entry['name']}:{widened.str}".encode("utf-8"))
+        content_hash.update(_append_npy(path, values))
+        if offsets is not None:
+            _append_npy(os.path.join(table_dir, entry["offsets"]), offsets)
+        new_columns.append(entry)
+
+    schema.update(
+        rows=schema["rows"] + len(df),
+        content_hash=content_hash.hexdigest(),
+        columns=new_columns,
+    )
+    # El esquema se escribe al final: si algo falla antes, las columnas no
+    # coinciden con él y read_table rechaza la tabla
+    tmp_path = os.path.join(table_dir, "schema.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(schema, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, os.path.join(table_dir, "schema.json"))
+
+
+def file_digest(path, digest):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest
+
+
+def read_schema(store_dir, name):
+    schema_path = os.path.join(store_dir, name, "schema.json")
+    with open(schema_path, encoding="utf-8") as f:
+        schema = json.load(f)
+    if schema.get("version") != STORE_VERSION:
+        raise StoreSchemaError(
+            f"{name}: versión del almacén {schema.get('version')} "
+            f"(se esperaba {STORE_VERSION})"
+        )
+    return schema
+
+
+def table_hash(store_dir, name):
+    """Huella del contenido de la tabla guardada al escribirla."""
+    schema = read_schema(store_dir, name)
+    if "content_hash" in schema:
+        return schema["content_hash"]
+    content_hash = hashlib.blake2b(digest_size=16)
+    table_dir = os.path.join(store_dir, name)
+    for file_name in sorted(os.listdir(table_dir)):
+        content_hash.update(file_name.encode("utf-8"))
+        file_digest(os.path.join(table_dir, file_name), content_hash)
+    return content_hash.hexdigest()
+
+
+def validate_columns(name, kinds, required):
+    """Comprueba que ``kinds`` ({columna: tipo}) cubre el esquema ``required``."""
+    missing = sorted(set(required) - set(kinds))
+    if missing:
+        raise StoreSchemaError(f"{name}: faltan las columnas {missing}")
+    wrong = sorted(column for column, kind in required.items() if kinds[column] != kind)
+    if wrong:
+        raise StoreSchemaError(f"{name}: tipo inesperado en las columnas {wrong}")
+
+
+def frame_kinds(df, geometry=None):
+    return {
+        column: GEOMETRY if column == geometry else _column_kind(df[column])
+        for column in df.columns
+    }
+
+
+def read_table(store_dir, name, required=None, mmap=True):
+    """Carga una tabla del almacén como DataFrame.
+
+    Las columnas numéricas son vistas de solo lectura sobre los ficheros
+    mapeados en memoria, así que no se copian al construir el DataFrame.
+    """
+    schema = read_schema(store_dir, name)
+    table_dir = os.path.join(store_dir, name)
+    rows = schema["rows"]
+    mmap_mode = "r" if mmap else None
+
+    if required:
+        validate_columns(
+            name, {c["name"]: c["kind"] for c in schema["columns"]}, required
+        )
+
+    data = {}
+    for entry in schema["columns"]:
+        values = np.load(os.path.join(table_dir, entry["file"]), mmap_mode=mmap_mode)
+
+        if entry["kind"] == GEOMETRY:
+            offsets = np.load(os.path.join(table_dir, entry["offsets"]))
+            if len(offsets) != rows + 1:
+                raise StoreSchemaError(f"{name}: {entry['name']} está incompleta")
+            buffer = values.tobytes()
+            values = shapely.from_wkb(
+                [buffer[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+            )
+        elif len(values) != rows:
+            raise StoreSchemaError(f"{name}: {entry['name']} está incompleta")
+        elif values.dtype.str != entry["dtype"]:
+            raise StoreSchemaError(f"{name}: tipo inesperado en {entry['name']}")
+        elif entry["kind"] == CATEGORY:
+            values = pd.Categorical.from_codes(
+                np.asarray(values), categories=entry["categories"]
+            )
+
+        data[entry["name"]] = values
+
+    return pd.DataFrame(data, copy=False)
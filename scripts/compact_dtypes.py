@@ -0,0 +1,108 @@
+"""Tipos compactos de las columnas de los inmuebles en memoria.
+
+Por defecto pandas carga todos los números como int64/float64 y el texto como
+objetos de Python. Aquí se declara para cada columna el tipo más pequeño que
+admite: códigos de categoría para el texto, int8/int16/int32 para los valores
+acotados y float32 donde no hace falta más precisión. Las coordenadas se
+mantienen en float64, porque con ellas se calculan las distancias y se
+asignan los barrios.
+
+Los tipos enteros solo se aplican si todos los valores caben sin pérdida; si
+la columna tiene vacíos, decimales o valores fuera de rango se deja como está.
+"""
+
+import sys
+
+import numpy as np
+import pandas as pd
+
+SALE_DTYPES = {
+    "PERIOD": "int32",
+    "PRICE": "int32",
+    "UNITPRICE": "float32",
+    "CONSTRUCTEDAREA": "int16",
+    "ROOMNUMBER": "int8",
+    "BATHNUMBER": "int8",
+    "HASTERRACE": "int8",
+    "HASLIFT": "int8",
+    "CADCONSTRUCTIONYEAR": "int16",
+    "CADASTRALQUALITYID": "int8",
+    "BUILTTYPEID_1": "int8",
+    "BUILTTYPEID_2": "int8",
+    "BUILTTYPEID_3": "int8",
+    "DISTANCE_TO_CITY_CENTER": "float32",
+    "DISTANCE_TO_METRO": "float32",
+    "DISTANCE_TO_BLASCO": "float32",
+    "NEAREST_METRO": "int16",
+    "AGE": "int16",
+    "TRIMESTER": "category",
+    "BUILDTYPE": "category",
+    "NEIGHBORHOOD": "category",
+    "CLUSTER": "int8",
+}
+
+
+def fits_integer(values, dtype):
+    """Si ``values`` se puede pasar al tipo entero ``dtype`` sin pérdida."""
+    if len(values) == 0:
+        return True
+    if values.dtype.kind == "f" and not (
+        np.isfinite(values).all() and np.array_equal(values, np.round(values))
+    ):
+        return False
+    if values.dtype.kind not in "biuf":
+        return False
+    info = np.iinfo(dtype)
+    return info.min <= values.min() and values.max() <= info.max
+
+
+def compact_frame(df, dtypes=SALE_DTYPES):
+    """``df`` con los tipos declarados en las columnas que los admiten.
+
+    Las columnas que ya tienen su tipo (por ejemplo las que vienen del
+    almacén columnar) no se tocan, así que siguen siendo vistas sin copia.
+    """
+    columns = {}
+    for column, dtype in dtypes.items():
+        if column not in df.columns:
+            continue
+        series = df[column]
+        if dtype == "category":
+            if not isinstance(series.dtype, pd.CategoricalDtype):
+                columns[column] = series.astype("category")
+            continue
+
+        dtype = np.dtype(dtype)
+        if series.dtype == dtype or isinstance(series.dtype, pd.CategoricalDtype):
+            continue
+        values = series.to_numpy()
+        if dtype.kind in "iu" and not fits_integer(values, dtype):
+            continue
+        columns[column] = values.astype(dtype)
+    return df.assign(**columns) if columns else df
+
+
+def memory_mb(df):
+    """Memoria de ``df`` en MB, contando el texto de las columnas de objetos."""
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+def default_memory_mb(df):
+    """Memoria que ocuparía ``df`` con los tipos por defecto de pandas.
+
+    Los números cuentan como int64/float64 y cada valor de una categoría como
+    un objeto de texto, igual que al leer el CSV.
+    """
+    total = df.index.memory_usage()
+    for column in df.columns:
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            codes = series.cat.codes.to_numpy()
+            sizes = [sys.getsizeof(value) for value in series.cat.categories]
+            counts = np.bincount(codes[codes >= 0], minlength=len(sizes))
+            total += 8 * len(series) + int(counts @ np.asarray(sizes, dtype=np.int64))
+        elif series.dtype.kind in "biuf":
+            total += 8 * len(series)
+        else:
+            total += series.memory_usage(deep=True, index=False)
+    return total / 2**20
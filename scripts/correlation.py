@@ -0,0 +1,133 @@
+"""Correlaciones con PRICE a partir de estadísticos suficientes combinables.
+
+Para cada partición (por ejemplo un barrio) y cada columna se guardan el
+número de filas con ambos valores, las sumas, las sumas de cuadrados y la
+suma de productos con PRICE. Las particiones se suman entre sí, así que la
+correlación de cualquier combinación de particiones se obtiene en
+O(columnas) sin volver a recorrer las filas, y los datos nuevos se añaden
+bloque a bloque. Como ``DataFrame.corr``, cada columna usa solo las filas en
+las que ella y PRICE tienen valor.
+
+Los valores se desplazan restando una referencia fija por columna (la media
+del primer bloque) antes de acumular, para que las sumas de cuadrados no
+pierdan precisión al restar.
+"""
+
+import numpy as np
+import pandas as pd
+
+TARGET = "PRICE"
+SUMS = ["COUNT", "SUM_X", "SUM_Y", "SUM_XX", "SUM_YY", "SUM_XY"]
+VARIANCE_TOLERANCE = 1e-10
+# Columnas numéricas que son posiciones en otra tabla, no medidas
+IDENTIFIER_COLUMNS = {"NEAREST_METRO"}
+
+
+def numeric_columns(frame, target=TARGET):
+    return [
+        column
+        for column in frame.select_dtypes(np.number).columns
+        if column != target and column not in IDENTIFIER_COLUMNS
+    ]
+
+
+def pearson(sums):
+    """Correlación de cada columna a partir de sus sumas (último eje = SUMS)."""
+    n, sx, sy, sxx, syy, sxy = np.moveaxis(np.asarray(sums, dtype=float), -1, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = sxy - sx * sy / n
+        variance_x = sxx - sx * sx / n
+        variance_y = syy - sy * sy / n
+        r = covariance / np.sqrt(variance_x * variance_y)
+    # Sin varianza (o con menos de dos filas) la correlación no está definida;
+    # en una columna constante la resta deja solo error de redondeo
+    defined = (
+        (n > 1)
+        & (variance_x > VARIANCE_TOLERANCE * sxx)
+        & (variance_y > VARIANCE_TOLERANCE * syy)
+    )
+    return np.where(defined, r, np.nan)
+
+
+class CorrelationStats:
+    """Sumas por partición y columna, combinables entre bloques o ejecuciones."""
+
+    def __init__(self, n_partitions, columns, target=TARGET, shift=None):
+        self.n_partitions = n_partitions
+        self.columns = list(columns)
+        self.target = target
+        # Referencia que se resta a cada columna y, en la última, a PRICE
+        self.shift = None if shift is None else np.asarray(shift, dtype=float)
+        self.sums = np.zeros((n_partitions, len(self.columns), len(SUMS)))
+
+    def update(self, codes, chunk):
+        codes = np.asarray(codes)
+        y = chunk[self.target].to_numpy(dtype=float)
+        if self.shift is None:
+            means = [
+                np.nanmean(chunk[column].to_numpy(dtype=float))
+                for column in self.columns
+            ]
+            self.shift = np.nan_to_num([*means, np.nanmean(y)])
+        y = y - self.shift[-1]
+
+        for index, column in enumerate(self.columns):
+            x = chunk[column].to_numpy(dtype=float) - self.shift[index]
+            valid = (codes >= 0) & ~np.isnan(x) & ~np.isnan(y)
+            partitions, xv, yv = codes[valid], x[valid], y[valid]
+            for position, weights in enumerate(
+                [None, xv, yv, xv * xv, yv * yv, xv * yv]
+            ):
+                self.sums[:, index, position] += np.bincount(
+                    partitions, weights=weights, minlength=self.n_partitions
+                )
+        return self
+
+    def merge(self, other):
+        if other.columns != self.columns or other.n_partitions != self.n_partitions:
+            raise ValueError("Las correlaciones no corresponden a las mismas columnas")
+        if other.shift is not None and self.shift is None:
+            self.shift = other.shift.copy()
+        elif other.shift is not None and not np.array_equal(other.shift, self.shift):
+            raise ValueError("Las sumas se han calculado con otra referencia")
+        self.sums += other.sums
+        return self
+
+    def correlations(self, partitions=None):
+        """Correlación con PRICE de la suma de ``partitions`` (todas si None)."""
+        sums = self.sums if partitions is None else self.sums[partitions]
+        return pd.Series(pearson(sums.sum(axis=0)), index=self.columns)
+
+    def to_state(self):
+        # Una fila por partición y columna, con la referencia de cada columna
+        partitions, columns = np.meshgrid(
+            np.arange(self.n_partitions), np.arange(len(self.columns)), indexing="ij"
+        )
+        state = pd.DataFrame(
+            {
+                "PARTITION": partitions.ravel(),
+                "COLUMN": np.asarray(self.columns, dtype=object)[columns.ravel()],
+            }
+        )
+        shift = (
+            self.shift if self.shift is not None else np.zeros(len(self.columns) + 1)
+        )
+        state["SHIFT_X"] = shift[:-1][columns.ravel()]
+        state["SHIFT_Y"] = shift[-1]
+        for position, name in enumerate(SUMS):
+            state[name] = self.sums[:, :, position].ravel()
+        return state
+
+    @classmethod
+    def from_state(cls, state, target=TARGET):
+        columns = list(pd.unique(state["COLUMN"]))
+        n_partitions = int(state["PARTITION"].max()) + 1
+        first = state.drop_duplicates(subset="COLUMN").set_index("COLUMN")
+        shift = [*first.loc[columns, "SHIFT_X"], first["SHIFT_Y"].iloc[0]]
+        stats = cls(n_partitions, columns, target, shift)
+        # Copias escribibles: se siguen acumulando con merge/update
+        partition = state["PARTITION"].to_numpy(dtype=np.int64)
+        column = pd.Categorical(state["COLUMN"], categories=columns).codes
+        for position, name in enumerate(SUMS):
+            stats.sums[partition, column, position] = state[name].to_numpy(dtype=float)
+        return stats
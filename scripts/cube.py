@@ -0,0 +1,111 @@
+"""Cubo preagregado de los inmuebles para los KPIs y los gráficos de barras.
+
+Los inmuebles se agrupan por barrio, trimestre, número de habitaciones, tipo
+de construcción y tramos de precio y de superficie, y en cada celda se guardan
+el número de inmuebles y, para el precio y la superficie, el número de
+valores, la suma y la suma de cuadrados. Las celdas se suman entre sí, así que
+cualquier corte del cubo se agrega sin volver a los inmuebles (unas miles de
+celdas en lugar de la tabla completa) y los datos nuevos se combinan con el
+cubo existente.
+"""
+
+import numpy as np
+import pandas as pd
+
+DIMENSIONS = [
+    "NEIGHBORHOOD",
+    "TRIMESTER",
+    "ROOMNUMBER",
+    "BUILDTYPE",
+    "PRICE_BUCKET",
+    "AREA_BUCKET",
+]
+MEASURES = ["PRICE", "CONSTRUCTEDAREA"]
+
+# Ancho de los tramos; cada tramo se identifica por su límite inferior
+PRICE_BUCKET_WIDTH = 50_000
+AREA_BUCKET_WIDTH = 25
+BUCKETS = {
+    "PRICE_BUCKET": ("PRICE", PRICE_BUCKET_WIDTH),
+    "AREA_BUCKET": ("CONSTRUCTEDAREA", AREA_BUCKET_WIDTH),
+}
+
+
+class Cube:
+    def __init__(self, table):
+        self.table = table
+
+    @classmethod
+    def build(cls, valencia_sale):
+        cells = pd.DataFrame(
+            {
+                dimension: valencia_sale[dimension].to_numpy()
+                for dimension in DIMENSIONS
+                if dimension not in BUCKETS
+            }
+        )
+        for dimension, (column, width) in BUCKETS.items():
+            cells[dimension] = (
+                np.floor(valencia_sale[column].to_numpy(dtype=float) / width) * width
+            )
+        cells["COUNT"] = 1
+        for measure in MEASURES:
+            values = valencia_sale[measure].to_numpy(dtype=float)
+            cells[f"{measure}_N"] = (~np.isnan(values)).astype(np.int64)
+            cells[f"{measure}_SUM"] = np.nan_to_num(values)
+            cells[f"{measure}_SUMSQ"] = np.nan_to_num(values) ** 2
+        return cls(cls._aggregate(cells))
+
+    @staticmethod
+    def _aggregate(cells):
+        table = cells.groupby(DIMENSIONS, dropna=False, observed=True, sort=True).sum()
+        return table.reset_index()
+
+    def merge(self, other):
+        """Cubo con las celdas de los dos; las que coinciden se suman."""
+        return Cube(self._aggregate(pd.concat([self.table, other.table])))
+
+    def slice(self, **where):
+        """Celdas que cumplen las condiciones sobre las dimensiones.
+
+        Cada condición es un valor, una lista de valores o, para los tramos,
+        un rango ``(low, high)``: entran los tramos que caen por completo
+        dentro del rango.
+        """
+        keep = np.ones(len(self.table), dtype=bool)
+        for dimension, condition in where.items():
+            values = self.table[dimension]
+            if dimension in BUCKETS and isinstance(condition, tuple):
+                width = BUCKETS[dimension][1]
+                low, high = condition
+                keep &= (values >= low) & (values + width <= high)
+            elif isinstance(condition, (list, set)):
+                keep &= values.isin(list(condition)).to_numpy()
+            else:
+                keep &= (values == condition).to_numpy()
+        return Cube(self.table[keep])
+
+    def rollup(self, by=()):
+        """Agrega las celdas por las dimensiones ``by`` (todo junto si no hay)."""
+        measures = [column for column in self.table.columns if column not in DIMENSIONS]
+        if by:
+            totals = (
+                self.table.groupby(list(by), dropna=False, observed=True)[measures]
+                .sum()
+                .reset_index()
+            )
+        else:
+            totals = self.table[measures].sum().to_frame().T
+        for measure in MEASURES:
+            n = totals[f"{measure}_N"].to_numpy(dtype=float)
+            sums = totals[f"{measure}_SUM"].to_numpy(dtype=float)
+            squares = totals[f"{measure}_SUMSQ"].to_numpy(dtype=float)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = sums / n
+                variance = np.maximum(squares / n - mean**2, 0) * n / (n - 1)
+            totals[f"{measure}_MEAN"] = np.where(n > 0, mean, np.nan)
+            totals[f"{measure}_STD"] = np.where(n > 1, np.sqrt(variance), np.nan)
+        return totals
+
+    def count(self):
+        return int(self.table["COUNT"].sum())
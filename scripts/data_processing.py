@@ -1,113 +1,513 @@
-import pandas as pd
+import argparse
+import glob
+import json
+import os
+import shutil
+
 import numpy as np
+import pandas as pd
 import geopandas as gpd
 import shapely
 
-valencia_polygons = pd.read_excel(io="./raw-data/Valencia_polygons.xlsx")
-valencia_polygons = valencia_polygons.drop(columns=["LOCATIONID", "ZONELEVELID"])
-valencia_polygons = valencia_polygons.rename(
-    columns={"LOCATIONNAME": "NEIGHBORHOOD", "geometry": "GEO_SHAPE"}
-)  # Cambiamos los nombres de las variables
-valencia_polygons["GEO_SHAPE"] = valencia_polygons["GEO_SHAPE"].apply(shapely.wkt.loads)
-valencia_polygons = gpd.GeoDataFrame(
-    valencia_polygons, geometry="GEO_SHAPE", crs="EPSG:4326"
+import clustering
+import columnar_store
+from box_stats import neighborhood_price_summary
+from compact_dtypes import compact_frame
+from correlation import CorrelationStats, numeric_columns
+from cube import Cube
+from distances import add_distance_features
+from features import prepare_sale
+from neighborhoods import (
+    CHUNK_SIZE,
+    NeighborhoodStats,
+    iter_chunks,
+    join_neighborhoods,
 )
+from pipeline import Pipeline
 
-valencia_metro = pd.read_excel(io="./raw-data/Valencia_metro.xlsx")
-valencia_metro = valencia_metro.rename(
-    columns={"Lon": "LONGITUDE", "Lat": "LATITUDE"}
-)  # Cambiamos los nombres de las variables
-valencia_metro.loc[
-    valencia_metro["LONGITUDE"] == 0.4026173, "LONGITUDE"
-] = -0.4026173  # Corregimos un error de la estación de metro de San Isidro
-
-
-def caculate_trimester(periodo):
-    month = int(str(periodo)[4:6])
-    if month == 3:
-        return "T1"
-    elif month == 6:
-        return "T2"
-    elif month == 9:
-        return "T3"
-    else:
-        return "T4"
-
-
-valencia_sale = pd.read_excel(io="./raw-data/Valencia_Sale.xlsx")
-valencia_sale["AGE"] = (
-    pd.to_datetime("today").year - valencia_sale["CADCONSTRUCTIONYEAR"]
-)  # Calculamos los años de antigüedad del inmueble
-valencia_sale["TRIMESTER"] = valencia_sale["PERIOD"].apply(
-    caculate_trimester
-)  # Calculamos el trimestre de la publicación del anuncio
-valencia_sale = valencia_sale.drop(
-    columns=["ASSETID", "CONSTRUCTIONYEAR", "geometry"]
-)  # Eliminamos las variables que no utilizaremos
-valencia_sale = gpd.GeoDataFrame(
-    valencia_sale,
-    geometry=gpd.points_from_xy(valencia_sale.LONGITUDE, valencia_sale.LATITUDE),
-    crs="EPSG:4326",
-)
+DATA_DIR = "./data"
+STORE_DIR = "./data/store"
+# Las tablas de inmuebles de las etapas se escriben bloque a bloque en este
+# almacén y las etapas siguientes las leen mapeadas en memoria; en la caché
+# de cada etapa se guarda el nombre de su tabla, no la tabla
+STAGE_STORE_DIR = "./data/cache/tables"
 
-# Creamos una variable para el tipo de construcción
-conditions = [
-    valencia_sale["BUILTTYPEID_1"] == 1,
-    valencia_sale["BUILTTYPEID_2"] == 1,
-    valencia_sale["BUILTTYPEID_3"] == 1,
-]
+POLYGONS_XLSX = "./raw-data/Valencia_polygons.xlsx"
+METRO_XLSX = "./raw-data/Valencia_metro.xlsx"
+# Se puede usar otro volcado, también en CSV (por ejemplo datos sintéticos)
+SALE_XLSX = os.environ.get("SALE_RAW_PATH", "./raw-data/Valencia_Sale.xlsx")
+# Copia de cada volcado añadido con --ingest, numerada en el orden de carga.
+# Son entradas de la etapa raw_sale: al reprocesar todo no se pierden
+INGESTED_DIR = "./raw-data/ingested"
+INGESTED_SALES = sorted(glob.glob(os.path.join(INGESTED_DIR, "*")))
 
-choices = [
-    "Nueva construcción",
-    "Segunda mano a reformar",
-    "Segunda mano en buen estado",
-]
+# Estado necesario para añadir nuevos periodos sin reprocesar todo
+NEIGHBORHOOD_STATS_PATH = "./data/neighborhood_stats.csv"
+PERIODS_PATH = "./data/ingested_periods.json"
+PRICE_CORRELATION_PATH = "./data/price_correlation_stats.csv"
+CUBE_PATH = "./data/valencia_sale_cube.csv"
 
-valencia_sale["BUILDTYPE"] = np.select(conditions, choices, default="Unknown")
 
-joined = gpd.sjoin(valencia_sale, valencia_polygons, how="left", predicate="within")
-joined = joined.reset_index(drop=True)
-valencia_sale["NEIGHBORHOOD"] = joined["NEIGHBORHOOD"]
+def read_sale(path):
+    if path.lower().endswith((".xlsx", ".xls")):
+        return pd.read_excel(io=path)
+    return pd.read_csv(path)
 
-count_inmuebles = (
-    joined.groupby("NEIGHBORHOOD").size().reset_index(name="REAL_ESTATE_TOTAL")
-)
-unitpricemean_inmuebles = (
-    joined.groupby("NEIGHBORHOOD")["UNITPRICE"]
-    .mean()
-    .round(2)
-    .reset_index(name="UNITPRICE_MEAN")
+
+def read_sale_chunks(path):
+    # Los CSV se leen por bloques; los Excel no lo permiten y se leen enteros
+    if path.lower().endswith((".xlsx", ".xls")):
+        return iter_chunks(pd.read_excel(io=path))
+    return pd.read_csv(path, chunksize=CHUNK_SIZE)
+
+
+def write_chunks(chunks, store_dir, name):
+    """Escribe los bloques ``chunks`` como la tabla ``name`` de ``store_dir``.
+
+    Solo hay un bloque en memoria a la vez. La tabla anterior se sustituye al
+    terminar, así que una escritura interrumpida no deja una tabla a medias.
+    """
+    partial_name = f"{name}.partial"
+    rows = 0
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        if rows == 0:
+            columnar_store.write_table(chunk, store_dir, partial_name)
+        else:
+            columnar_store.append_table(chunk, store_dir, partial_name, widen=True)
+        rows += len(chunk)
+    if rows == 0:
+        raise ValueError(f"{name}: no hay ningún inmueble")
+
+    table_dir = os.path.join(store_dir, name)
+    shutil.rmtree(table_dir, ignore_errors=True)
+    os.replace(os.path.join(store_dir, partial_name), table_dir)
+    return rows
+
+
+def write_stage_table(chunks, name):
+    write_chunks(chunks, STAGE_STORE_DIR, name)
+    return name
+
+
+def read_stage_table(name):
+    return columnar_store.read_table(STAGE_STORE_DIR, name)
+
+
+def stage_table_output(name):
+    return os.path.join(STAGE_STORE_DIR, name, "schema.json")
+
+
+def new_periods(new_sale, periods):
+    # Solo las filas de periodos que aún no están cargados
+    loaded = new_sale["PERIOD"].isin(periods)
+    if loaded.any():
+        print(f"Se omiten {loaded.sum()} inmuebles de periodos ya cargados")
+    return new_sale[~loaded]
+
+
+def save_ingestion_state(neighborhood_stats, periods):
+    neighborhood_stats.to_state().to_csv(NEIGHBORHOOD_STATS_PATH, index=False)
+    with open(PERIODS_PATH, "w", encoding="utf-8") as f:
+        json.dump(sorted(int(period) for period in periods), f)
+
+
+def load_ingested_periods():
+    with open(PERIODS_PATH, encoding="utf-8") as f:
+        return set(json.load(f))
+
+
+def write_polygons(valencia_polygons):
+    valencia_polygons.to_csv(
+        os.path.join(DATA_DIR, "valencia_polygons.csv"), index=False
+    )
+    columnar_store.write_table(
+        valencia_polygons, STORE_DIR, "valencia_polygons", geometry="GEO_SHAPE"
+    )
+
+
+def write_price_summary(valencia_sale, names):
+    # Cuartiles y atípicos del precio por barrio para los diagramas de caja
+    summary, outliers = neighborhood_price_summary(valencia_sale, names)
+    for name, table in [
+        ("valencia_price_summary", summary),
+        ("valencia_price_outliers", outliers),
+    ]:
+        table.to_csv(os.path.join(DATA_DIR, f"{name}.csv"), index=False)
+        columnar_store.write_table(table, STORE_DIR, name)
+    return len(summary)
+
+
+def write_cube(cube):
+    cube.table.to_csv(CUBE_PATH, index=False)
+    columnar_store.write_table(cube.table, STORE_DIR, "valencia_sale_cube")
+    return len(cube.table)
+
+
+def neighborhood_partitions(valencia_sale, names):
+    # Posición del barrio en valencia_polygons; los inmuebles sin barrio van
+    # a una partición más al final
+    codes = pd.Categorical(
+        np.asarray(valencia_sale["NEIGHBORHOOD"], dtype=object),
+        categories=np.asarray(names, dtype=object),
+    ).codes
+    return np.where(codes >= 0, codes, len(names))
+
+
+def update_price_correlation(correlation_stats, valencia_sale, names):
+    for chunk in iter_chunks(valencia_sale):
+        correlation_stats.update(neighborhood_partitions(chunk, names), chunk)
+    return correlation_stats
+
+
+# Etapas del procesado completo; cada resultado se guarda en data/cache
+pipeline = Pipeline(os.path.join(DATA_DIR, "cache"))
+
+
+@pipeline.stage("raw_polygons", files=[POLYGONS_XLSX])
+def read_polygons():
+    return pd.read_excel(io=POLYGONS_XLSX)
+
+
+@pipeline.stage("polygons", inputs=["raw_polygons"])
+def clean_polygons(valencia_polygons):
+    valencia_polygons = valencia_polygons.drop(columns=["LOCATIONID", "ZONELEVELID"])
+    valencia_polygons = valencia_polygons.rename(
+        columns={"LOCATIONNAME": "NEIGHBORHOOD", "geometry": "GEO_SHAPE"}
+    )  # Cambiamos los nombres de las variables
+    valencia_polygons["GEO_SHAPE"] = valencia_polygons["GEO_SHAPE"].apply(
+        shapely.wkt.loads
+    )
+    valencia_polygons = gpd.GeoDataFrame(
+        valencia_polygons, geometry="GEO_SHAPE", crs="EPSG:4326"
+    )
+    return valencia_polygons
+
+
+@pipeline.stage("raw_metro", files=[METRO_XLSX])
+def read_metro():
+    return pd.read_excel(io=METRO_XLSX)
+
+
+@pipeline.stage("metro", inputs=["raw_metro"])
+def clean_metro(valencia_metro):
+    valencia_metro = valencia_metro.rename(
+        columns={"Lon": "LONGITUDE", "Lat": "LATITUDE"}
+    )  # Cambiamos los nombres de las variables
+    valencia_metro.loc[valencia_metro["LONGITUDE"] == 0.4026173, "LONGITUDE"] = (
+        -0.4026173
+    )  # Corregimos un error de la estación de metro de San Isidro
+    return valencia_metro
+
+
+@pipeline.stage(
+    "raw_sale",
+    files=[SALE_XLSX, *INGESTED_SALES],
+    outputs=[stage_table_output("raw_sale")],
+    version=2,
 )
-pricemean_inmuebles = (
-    joined.groupby("NEIGHBORHOOD")["PRICE"].mean().reset_index(name="PRICE_MEAN")
+def read_raw_sale():
+    def chunks():
+        # El volcado original y, detrás, los periodos nuevos de cada volcado
+        # ingerido, igual que los añadió --ingest
+        periods = set()
+        for path in [SALE_XLSX, *INGESTED_SALES]:
+            loaded = set(periods)
+            for chunk in read_sale_chunks(path):
+                chunk = new_periods(chunk, loaded)
+                periods |= set(chunk["PERIOD"])
+                yield chunk
+
+    return write_stage_table(chunks(), "raw_sale")
+
+
+# La antigüedad depende del año actual
+@pipeline.stage(
+    "sale_features",
+    inputs=["raw_sale"],
+    outputs=[stage_table_output("sale_features")],
+    params={"year": pd.to_datetime("today").year},
+    version=2,
 )
-agemean_inmuebles = (
-    joined.groupby("NEIGHBORHOOD")["AGE"].mean().round(0).reset_index(name="AGE_MEAN")
+def sale_features(raw_sale):
+    chunks = (
+        prepare_sale(chunk.copy()) for chunk in iter_chunks(read_stage_table(raw_sale))
+    )
+    return write_stage_table(chunks, "sale_features")
+
+
+@pipeline.stage(
+    "sale_distances",
+    inputs=["sale_features", "metro"],
+    outputs=[stage_table_output("sale_distances")],
+    version=3,
 )
-quality_inmuebles = (
-    joined.groupby("NEIGHBORHOOD")["CADASTRALQUALITYID"]
-    .mean()
-    .round(2)
-    .reset_index(name="QUALITY_MEAN")
+def sale_distances(sale_features, valencia_metro):
+    # Distancias al centro, a la estación de metro más cercana y a Blasco Ibáñez
+    chunks = (
+        add_distance_features(chunk, valencia_metro)
+        for chunk in iter_chunks(read_stage_table(sale_features))
+    )
+    return write_stage_table(chunks, "sale_distances")
+
+
+@pipeline.stage(
+    "sale_neighborhoods",
+    inputs=["sale_distances", "polygons"],
+    outputs=[stage_table_output("sale_neighborhoods")],
+    version=2,
 )
+def sale_neighborhoods(sale_distances, valencia_polygons):
+    # Asignamos el barrio por bloques y calculamos a la vez los agregados por barrio
+    chunks, neighborhood_stats = join_neighborhoods(
+        iter_chunks(read_stage_table(sale_distances)), valencia_polygons
+    )
+    return write_stage_table(chunks, "sale_neighborhoods"), neighborhood_stats
+
 
-valencia_polygons = valencia_polygons.merge(
-    count_inmuebles, left_on="NEIGHBORHOOD", right_on="NEIGHBORHOOD", how="left"
+@pipeline.stage(
+    "export",
+    inputs=["metro", "polygons", "sale_neighborhoods"],
+    outputs=[
+        os.path.join(DATA_DIR, "valencia_metro.csv"),
+        os.path.join(DATA_DIR, "valencia_sale.csv"),
+        os.path.join(DATA_DIR, "valencia_polygons.csv"),
+        os.path.join(STORE_DIR, "valencia_metro", "schema.json"),
+        os.path.join(STORE_DIR, "valencia_sale", "schema.json"),
+        os.path.join(STORE_DIR, "valencia_polygons", "schema.json"),
+        NEIGHBORHOOD_STATS_PATH,
+        PERIODS_PATH,
+    ],
+    version=3,
 )
-valencia_polygons = valencia_polygons.merge(
-    unitpricemean_inmuebles, left_on="NEIGHBORHOOD", right_on="NEIGHBORHOOD", how="left"
+def export(valencia_metro, valencia_polygons, sale_neighborhoods):
+    table_name, neighborhood_stats = sale_neighborhoods
+    valencia_sale = read_stage_table(table_name)
+    valencia_polygons = valencia_polygons.merge(
+        neighborhood_stats.to_frame(), on="NEIGHBORHOOD", how="left"
+    )
+
+    valencia_metro.to_csv("./data/valencia_metro.csv", index=False)
+    for i, chunk in enumerate(iter_chunks(valencia_sale)):
+        chunk.to_csv(
+            "./data/valencia_sale.csv",
+            mode="w" if i == 0 else "a",
+            header=i == 0,
+            index=False,
+        )
+
+    # Copia en formato columnar binario para que la app no tenga que parsear los
+    # CSV, con los tipos compactos que la app usa en memoria
+    columnar_store.write_table(valencia_metro, STORE_DIR, "valencia_metro")
+    write_chunks(
+        (compact_frame(chunk) for chunk in iter_chunks(valencia_sale)),
+        STORE_DIR,
+        "valencia_sale",
+    )
+    write_polygons(valencia_polygons)
+
+    save_ingestion_state(neighborhood_stats, valencia_sale["PERIOD"].unique())
+    return len(valencia_sale)
+
+
+@pipeline.stage(
+    "price_summary",
+    inputs=["sale_neighborhoods", "polygons"],
+    outputs=[
+        os.path.join(DATA_DIR, "valencia_price_summary.csv"),
+        os.path.join(DATA_DIR, "valencia_price_outliers.csv"),
+        os.path.join(STORE_DIR, "valencia_price_summary", "schema.json"),
+        os.path.join(STORE_DIR, "valencia_price_outliers", "schema.json"),
+    ],
+    version=2,
 )
-valencia_polygons = valencia_polygons.merge(
-    pricemean_inmuebles, left_on="NEIGHBORHOOD", right_on="NEIGHBORHOOD", how="left"
+def price_summary(sale_neighborhoods, valencia_polygons):
+    table_name, _ = sale_neighborhoods
+    return write_price_summary(
+        read_stage_table(table_name), valencia_polygons["NEIGHBORHOOD"]
+    )
+
+
+# Sumas para las correlaciones con PRICE por barrio, que se amplían al ingerir
+@pipeline.stage(
+    "price_correlation",
+    inputs=["sale_neighborhoods", "polygons"],
+    outputs=[PRICE_CORRELATION_PATH],
+    version=3,
 )
-valencia_polygons = valencia_polygons.merge(
-    agemean_inmuebles, left_on="NEIGHBORHOOD", right_on="NEIGHBORHOOD", how="left"
+def price_correlation(sale_neighborhoods, valencia_polygons):
+    table_name, _ = sale_neighborhoods
+    valencia_sale = read_stage_table(table_name)
+    names = valencia_polygons["NEIGHBORHOOD"]
+    correlation_stats = update_price_correlation(
+        CorrelationStats(len(names) + 1, numeric_columns(valencia_sale)),
+        valencia_sale,
+        names,
+    )
+    correlation_stats.to_state().to_csv(PRICE_CORRELATION_PATH, index=False)
+    return correlation_stats.correlations()
+
+
+# Cubo de cuentas y sumas para los KPIs y los gráficos de barras
+@pipeline.stage(
+    "cube",
+    inputs=["sale_neighborhoods"],
+    outputs=[
+        CUBE_PATH,
+        os.path.join(STORE_DIR, "valencia_sale_cube", "schema.json"),
+    ],
+    version=2,
 )
-valencia_polygons = valencia_polygons.merge(
-    quality_inmuebles, left_on="NEIGHBORHOOD", right_on="NEIGHBORHOOD", how="left"
+def cube(sale_neighborhoods):
+    # Un cubo por bloque; las celdas que coinciden se suman
+    table_name, _ = sale_neighborhoods
+    sale_cube = None
+    for chunk in iter_chunks(read_stage_table(table_name)):
+        chunk_cube = Cube.build(chunk)
+        sale_cube = chunk_cube if sale_cube is None else sale_cube.merge(chunk_cube)
+    return write_cube(sale_cube)
+
+
+# Parte de los centroides guardados en la ejecución anterior, si los hay
+@pipeline.stage(
+    "clusters",
+    inputs=["sale_neighborhoods"],
+    outputs=[
+        os.path.join(DATA_DIR, "valencia_sale_clustered.csv"),
+        os.path.join(STORE_DIR, "valencia_sale_clustered", "schema.json"),
+        clustering.MODEL_PATH,
+    ],
+    version=2,
 )
+def clusters(sale_neighborhoods):
+    table_name, _ = sale_neighborhoods
+    return clustering.recluster(read_stage_table(table_name))
+
+
+def ingest(sale_path):
+    """Añade a los datos procesados solo los periodos nuevos de ``sale_path``."""
+    periods = load_ingested_periods()
+    new_sale = new_periods(read_sale(sale_path), periods)
+    if new_sale.empty:
+        print("No hay periodos nuevos que cargar")
+        return
+
+    # Se guarda antes de tocar nada: cambia la clave de raw_sale, así que las
+    # etapas ya no están al día y un reprocesado completo incluye este volcado
+    # (también si la ingesta se interrumpe a medias)
+    os.makedirs(INGESTED_DIR, exist_ok=True)
+    shutil.copy(
+        sale_path,
+        os.path.join(
+            INGESTED_DIR,
+            f"{len(os.listdir(INGESTED_DIR)) + 1:04d}-{os.path.basename(sale_path)}",
+        ),
+    )
+    new_sale = prepare_sale(new_sale)
+    new_sale = add_distance_features(
+        new_sale, pd.read_csv(os.path.join(DATA_DIR, "valencia_metro.csv"))
+    )
+
+    # Solo necesitamos la geometría de los barrios; los agregados se recalculan
+    valencia_polygons = pd.read_csv(
+        os.path.join(DATA_DIR, "valencia_polygons.csv"),
+        usecols=["NEIGHBORHOOD", "GEO_SHAPE"],
+    )
+    valencia_polygons["GEO_SHAPE"] = shapely.from_wkt(valencia_polygons["GEO_SHAPE"])
+    valencia_polygons = gpd.GeoDataFrame(
+        valencia_polygons, geometry="GEO_SHAPE", crs="EPSG:4326"
+    )
+
+    chunks, new_stats = join_neighborhoods(iter_chunks(new_sale), valencia_polygons)
+    new_sale = pd.concat(chunks, ignore_index=True)
+
+    # Las sumas y cuentas acumuladas se combinan con las de los datos nuevos
+    neighborhood_stats = NeighborhoodStats.from_state(
+        pd.read_csv(NEIGHBORHOOD_STATS_PATH)
+    ).merge(new_stats)
+    valencia_polygons = valencia_polygons.merge(
+        neighborhood_stats.to_frame(), on="NEIGHBORHOOD", how="left"
+    )
+
+    # Añadimos las filas nuevas al final del CSV y del almacén columnar
+    sale_path = os.path.join(DATA_DIR, "valencia_sale.csv")
+    new_sale = new_sale.reindex(columns=pd.read_csv(sale_path, nrows=0).columns)
+    new_sale.to_csv(sale_path, mode="a", header=False, index=False)
+    try:
+        columnar_store.append_table(compact_frame(new_sale), STORE_DIR, "valencia_sale")
+    except (OSError, columnar_store.StoreSchemaError) as error:
+        print(f"Se reescribe el almacén de valencia_sale ({error})")
+        columnar_store.write_table(
+            compact_frame(pd.read_csv(sale_path)), STORE_DIR, "valencia_sale"
+        )
+
+    write_polygons(valencia_polygons)
+    save_ingestion_state(neighborhood_stats, periods | set(new_sale["PERIOD"]))
+
+    # Las sumas de las correlaciones se amplían solo con las filas nuevas
+    if os.path.exists(PRICE_CORRELATION_PATH):
+        correlation_stats = update_price_correlation(
+            CorrelationStats.from_state(pd.read_csv(PRICE_CORRELATION_PATH)),
+            new_sale,
+            valencia_polygons["NEIGHBORHOOD"],
+        )
+        correlation_stats.to_state().to_csv(PRICE_CORRELATION_PATH, index=False)
+    # Las celdas del cubo también se suman con las de los datos nuevos
+    if os.path.exists(CUBE_PATH):
+        write_cube(Cube(pd.read_csv(CUBE_PATH)).merge(Cube.build(new_sale)))
+    print(f"Se han añadido {len(new_sale)} inmuebles")
+
+    # Los cuartiles no se pueden combinar como las medias; se recalculan sobre
+    # la tabla completa, que solo requiere ordenar el precio
+    valencia_sale = clustering.read_sale()
+    write_price_summary(valencia_sale, valencia_polygons["NEIGHBORHOOD"])
+    model = clustering.recluster(valencia_sale)
+    print(f"Clústeres actualizados en {model['iterations']} iteraciones")
+
+
+def print_status():
+    for row in pipeline.status():
+        if row["key"] is None:
+            state = "faltan ficheros de entrada"
+        else:
+            state = "en caché" if row["cached"] else "pendiente"
+        inputs = ", ".join(row["inputs"]) or "-"
+        print(f"{row['stage']:<20} {state:<28} entradas: {inputs}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Procesado de los datos de Valencia")
+    parser.add_argument(
+        "--ingest",
+        metavar="FICHERO",
+        help="añadir solo los periodos nuevos de FICHERO (Excel o CSV)",
+    )
+    parser.add_argument(
+        "--stage",
+        action="append",
+        choices=list(pipeline.stages),
+        help="ejecutar solo esta etapa y sus dependencias (se puede repetir)",
+    )
+    parser.add_argument(
+        "--force",
+        action="append",
+        default=[],
+        choices=list(pipeline.stages),
+        help="recalcular esta etapa y las que dependen de ella (se puede repetir)",
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="mostrar el estado de la caché"
+    )
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+    elif args.ingest:
+        ingest(args.ingest)
+    else:
+        pipeline.run(args.stage, force=args.force)
 
 
-valencia_metro.to_csv("./data/valencia_metro.csv", index=False)
-valencia_polygons.to_csv("./data/valencia_polygons.csv", index=False)
-valencia_sale.to_csv("./data/valencia_sale.csv", index=False)
+if __name__ == "__main__":
+    main()
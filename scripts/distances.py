@@ -0,0 +1,163 @@
+"""Distancias de cada inmueble al centro, al metro y a Blasco Ibáñez.
+
+Las estaciones de metro se indexan en un STRtree sobre una proyección
+equirectangular local y se busca la más cercana a cada inmueble por bloques;
+la distancia final se calcula con la fórmula del haversine, en kilómetros.
+La avenida de Blasco Ibáñez se trata como una línea en lugar de un punto.
+
+Las distancias que ya trae el volcado de Idealista se conservan: las
+calculadas aquí usan un centro y un trazado de Blasco Ibáñez aproximados, así
+que solo se rellenan los valores que faltan (por ejemplo en los anuncios que
+llegan por la API, que no traen distancias).
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+EARTH_RADIUS_KM = 6371.0088
+BATCH_SIZE = 250_000
+PROJECTION_TOLERANCE = 1e-6
+
+# Plaza del Ayuntamiento
+CITY_CENTER = (-0.3763, 39.4699)
+
+# Trazado aproximado de la avenida de Blasco Ibáñez, de oeste a este
+BLASCO_IBANEZ = [
+    (-0.3636, 39.4757),
+    (-0.3553, 39.4748),
+    (-0.3470, 39.4737),
+    (-0.3388, 39.4726),
+    (-0.3316, 39.4714),
+]
+
+
+def haversine_km(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = map(np.radians, (lon1, lat1, lon2, lat2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class NearestPointIndex:
+    """Punto de referencia más cercano a cada inmueble."""
+
+    def __init__(self, lon, lat):
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.scale = np.cos(np.radians(np.nanmean(self.lat)))
+        self.tree = shapely.STRtree(shapely.points(self.lon * self.scale, self.lat))
+
+    def nearest(self, lon, lat, batch_size=BATCH_SIZE):
+        """Posición del punto más cercano (-1 si no hay coordenadas) y distancia."""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        ids = np.full(len(lon), -1, dtype=np.int32)
+        distances = np.full(len(lon), np.nan)
+
+        for start in range(0, len(lon), batch_size):
+            batch_lon = lon[start : start + batch_size]
+            batch_lat = lat[start : start + batch_size]
+            points = shapely.points(batch_lon * self.scale, batch_lat)
+            # Los puntos sin coordenadas quedan vacíos y no devuelven vecino
+            (found, _), projected = self.tree.query_nearest(
+                points, all_matches=False, return_distance=True
+            )
+            if len(found) == 0:
+                continue
+            # La escala de la proyección solo es exacta en una latitud; el
+            # cociente de cosenos entre los extremos acota cuánto puede
+            # deformar las distancias, así que el más cercano por haversine
+            # está entre estos candidatos
+            lat_range = np.radians(
+                [
+                    min(np.nanmin(batch_lat), self.lat.min()),
+                    max(np.nanmax(batch_lat), self.lat.max()),
+                ]
+            )
+            margin = np.cos(lat_range).max() / np.cos(lat_range).min()
+            candidate_idx, ref_idx = self.tree.query(
+                points[found],
+                predicate="dwithin",
+                distance=projected * (margin + PROJECTION_TOLERANCE),
+            )
+            point_idx = found[candidate_idx]
+            candidate_km = haversine_km(
+                batch_lon[point_idx],
+                batch_lat[point_idx],
+                self.lon[ref_idx],
+                self.lat[ref_idx],
+            )
+            order = np.lexsort((candidate_km, point_idx))
+            point_idx, ref_idx = point_idx[order], ref_idx[order]
+            first = np.r_[True, point_idx[1:] != point_idx[:-1]]
+            ids[start + point_idx[first]] = ref_idx[first]
+            distances[start + point_idx[first]] = candidate_km[order][first]
+        return ids, distances
+
+
+def distance_to_line_km(lon, lat, coords, batch_size=BATCH_SIZE):
+    """Distancia de cada inmueble a la línea con vértices ``coords``.
+
+    El punto más cercano de la línea se busca en la proyección local; cerca
+    del mínimo la distancia apenas varía a lo largo de la línea, así que el
+    error de usar ese punto para el haversine es despreciable.
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    coords = np.asarray(coords, dtype=float)
+    scale = np.cos(np.radians(coords[:, 1].mean()))
+    line = shapely.LineString(coords * [scale, 1])
+    distances = np.full(len(lon), np.nan)
+
+    for start in range(0, len(lon), batch_size):
+        batch_lon = lon[start : start + batch_size]
+        batch_lat = lat[start : start + batch_size]
+        valid = ~(np.isnan(batch_lon) | np.isnan(batch_lat))
+        points = shapely.points(batch_lon[valid] * scale, batch_lat[valid])
+        nearest = shapely.get_coordinates(
+            shapely.line_interpolate_point(
+                line, shapely.line_locate_point(line, points)
+            )
+        )
+        distances[start + np.flatnonzero(valid)] = haversine_km(
+            batch_lon[valid], batch_lat[valid], nearest[:, 0] / scale, nearest[:, 1]
+        )
+    return distances
+
+
+def fill_distance(valencia_sale, column, distances):
+    """Rellena ``column`` con ``distances`` solo donde no tiene valor."""
+    if column in valencia_sale:
+        distances = valencia_sale[column].fillna(
+            pd.Series(distances, index=valencia_sale.index)
+        )
+    valencia_sale[column] = distances
+
+
+def add_distance_features(valencia_sale, valencia_metro):
+    """Añade NEAREST_METRO (posición de la estación en ``valencia_metro``) y
+    rellena los valores que falten de DISTANCE_TO_CITY_CENTER,
+    DISTANCE_TO_METRO y DISTANCE_TO_BLASCO."""
+    lon = valencia_sale["LONGITUDE"].to_numpy(dtype=float)
+    lat = valencia_sale["LATITUDE"].to_numpy(dtype=float)
+
+    metro_index = NearestPointIndex(
+        valencia_metro["LONGITUDE"], valencia_metro["LATITUDE"]
+    )
+    station, metro_km = metro_index.nearest(lon, lat)
+
+    valencia_sale = valencia_sale.copy()
+    fill_distance(
+        valencia_sale, "DISTANCE_TO_CITY_CENTER", haversine_km(lon, lat, *CITY_CENTER)
+    )
+    fill_distance(valencia_sale, "DISTANCE_TO_METRO", metro_km)
+    fill_distance(
+        valencia_sale,
+        "DISTANCE_TO_BLASCO",
+        distance_to_line_km(lon, lat, BLASCO_IBANEZ),
+    )
+    valencia_sale["NEAREST_METRO"] = station
+    return valencia_sale
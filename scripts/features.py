@@ -0,0 +1,64 @@
+"""Variables derivadas de cada inmueble.
+
+Las usan tanto el procesado de los datos como la API que clasifica inmuebles
+nuevos en la app, para que ambos calculen exactamente lo mismo.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Columnas de los volcados originales necesarias para calcular las variables
+RAW_COLUMNS = [
+    "PERIOD",
+    "PRICE",
+    "CONSTRUCTEDAREA",
+    "ROOMNUMBER",
+    "BATHNUMBER",
+    "CADCONSTRUCTIONYEAR",
+    "CADASTRALQUALITYID",
+    "BUILTTYPEID_1",
+    "BUILTTYPEID_2",
+    "BUILTTYPEID_3",
+    "LONGITUDE",
+    "LATITUDE",
+]
+
+
+def caculate_trimester(periodo):
+    month = int(str(periodo)[4:6])
+    if month == 3:
+        return "T1"
+    elif month == 6:
+        return "T2"
+    elif month == 9:
+        return "T3"
+    else:
+        return "T4"
+
+
+def prepare_sale(valencia_sale):
+    valencia_sale["AGE"] = (
+        pd.to_datetime("today").year - valencia_sale["CADCONSTRUCTIONYEAR"]
+    )  # Calculamos los años de antigüedad del inmueble
+    valencia_sale["TRIMESTER"] = valencia_sale["PERIOD"].apply(
+        caculate_trimester
+    )  # Calculamos el trimestre de la publicación del anuncio
+    valencia_sale = valencia_sale.drop(
+        columns=["ASSETID", "CONSTRUCTIONYEAR", "geometry"], errors="ignore"
+    )  # Eliminamos las variables que no utilizaremos
+
+    # Creamos una variable para el tipo de construcción
+    conditions = [
+        valencia_sale["BUILTTYPEID_1"] == 1,
+        valencia_sale["BUILTTYPEID_2"] == 1,
+        valencia_sale["BUILTTYPEID_3"] == 1,
+    ]
+
+    choices = [
+        "Nueva construcción",
+        "Segunda mano a reformar",
+        "Segunda mano en buen estado",
+    ]
+
+    valencia_sale["BUILDTYPE"] = np.select(conditions, choices, default="Unknown")
+    return valencia_sale
@@ -0,0 +1,96 @@
+"""Instantáneas precalculadas de las figuras y KPIs del dashboard.
+
+Las genera ``scripts/bake_figures.py`` y se guardan en un JSON cuyo nombre
+incluye la huella de los datos con los que se calcularon. Además guardan la
+huella del código que construye las figuras y los KPIs. La app solo las usa si
+las dos coinciden con las suyas, así que un cambio en cualquier figura invalida
+la instantánea aunque los datos sean los mismos.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+import plotly.io as pio
+
+import columnar_store
+
+SNAPSHOT_VERSION = 2
+
+
+def dataset_hash(sources):
+    """Huella conjunta de las tablas cargadas.
+
+    ``sources`` es ``{tabla: (origen, valor)}``: para las tablas del almacén
+    columnar el valor es su ``content_hash`` y para los CSV la ruta al fichero.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(sources):
+        kind, value = sources[name]
+        digest.update(f"{name}:{kind}:".encode("utf-8"))
+        if kind == "csv":
+            columnar_store.file_digest(value, digest)
+        else:
+            digest.update(value.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def code_hash(paths):
+    """Huella del código fuente de los ficheros ``paths``."""
+    digest = hashlib.blake2b(digest_size=16)
+    # Ordenados por nombre para que no dependa de la ruta de instalación
+    for path in sorted(paths, key=os.path.basename):
+        digest.update(f"{os.path.basename(path)}:".encode("utf-8"))
+        columnar_store.file_digest(path, digest)
+    return digest.hexdigest()
+
+
+def snapshot_path(snapshot_dir, data_hash):
+    return os.path.join(snapshot_dir, f"dashboard-{data_hash}.json")
+
+
+def load_snapshot(snapshot_dir, data_hash, builders_hash):
+    """La instantánea de ``data_hash``, o ``None`` si no existe o se calculó
+    con otro código (``builders_hash``).
+    """
+    try:
+        with open(snapshot_path(snapshot_dir, data_hash), encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        snapshot.get("version") != SNAPSHOT_VERSION
+        or snapshot.get("data_hash") != data_hash
+        or snapshot.get("code_hash") != builders_hash
+    ):
+        return None
+    return snapshot
+
+
+def write_snapshot(snapshot_dir, data_hash, builders_hash, kpis, figures):
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "data_hash": data_hash,
+        "code_hash": builders_hash,
+        "kpis": kpis,
+        "figures": {
+            name: json.loads(pio.to_json(figure, validate=False))
+            for name, figure in figures.items()
+        },
+    }
+
+    path = snapshot_path(snapshot_dir, data_hash)
+    fd, tmp_path = tempfile.mkstemp(dir=snapshot_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+    # Las instantáneas de versiones anteriores de los datos ya no sirven
+    for old_path in glob.glob(os.path.join(snapshot_dir, "dashboard-*.json")):
+        if old_path != path:
+            os.remove(old_path)
+    return path
@@ -0,0 +1,389 @@
+"""Prueba de carga de los callbacks del dashboard.
+
+Simula usuarios que mueven los sliders de superficie y precio y cambian el
+número de habitaciones. Cada usuario hace un recorrido aleatorio sobre los
+estados de los filtros y, como el navegador, envía a
+``/_dash-update-component`` una petición por cada callback que depende del
+control que ha cambiado (el mapa y los gráficos filtrados), devolviendo en
+el ``State`` lo que recibió en la respuesta anterior (por ejemplo la firma
+del mapa). Los límites de los sliders y los callbacks se leen de
+``/_dash-layout`` y ``/_dash-dependencies``, así que no hace falta conocer
+los datos.
+
+Para cada nivel de concurrencia (número de usuarios simultáneos, cada uno en
+su hilo y sin pausas entre peticiones) se miden las peticiones por segundo,
+la latencia p50/p95/p99 y los bytes de las respuestas. Por defecto se importa
+la app y se usa el cliente de pruebas de Flask, sin red: todos los usuarios
+comparten un único proceso, como un worker de gunicorn con ``--threads``.
+Para medir varios workers se arranca gunicorn en local y se pasa ``--url``.
+Desde la raíz del repositorio:
+
+    python scripts/load_test.py --concurrency 1 2 4 8 --duration 20
+    gunicorn --workers 4 --chdir app app:server &
+    python scripts/load_test.py --url http://127.0.0.1:8000 --concurrency 4 16
+"""
+
+import argparse
+import gzip
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+import urllib.parse
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from benchmark import APP_DIR, latency_summary
+
+AREA_SLIDER = "constructed-area-range-slider"
+PRICE_SLIDER = "price-range-slider"
+ROOM_DROPDOWN = "room-number-dropdown"
+UPDATE_PATH = "/_dash-update-component"
+
+DEFAULT_CONCURRENCY = [1, 2, 4, 8]
+DEFAULT_DURATION = 10
+# Cabecera de un navegador: las respuestas se miden comprimidas
+DEFAULT_ACCEPT_ENCODING = "gzip, deflate, br"
+
+# Probabilidad de mover cada control en un paso del recorrido
+MOVE_WEIGHTS = {AREA_SLIDER: 0.4, PRICE_SLIDER: 0.4, ROOM_DROPDOWN: 0.2}
+# Un arrastre mueve un extremo del slider hasta este número de pasos
+MAX_SLIDER_STEPS = 10
+
+
+def local_client_factory():
+    """Clientes de pruebas de Flask sobre la app importada en este proceso."""
+    sys.path.insert(0, APP_DIR)
+    from app import server
+
+    def client():
+        test_client = server.test_client()
+
+        def request(method, path, body=None, headers=None):
+            response = test_client.open(
+                path, method=method, data=body, headers=headers or {}
+            )
+            return (
+                response.status_code,
+                response.headers.get("Content-Encoding"),
+                response.get_data(),
+            )
+
+        return request
+
+    return client
+
+
+def http_client_factory(url):
+    """Clientes HTTP con conexión persistente contra un servidor local."""
+    parsed = urllib.parse.urlsplit(url)
+    prefix = parsed.path.rstrip("/")
+
+    def client():
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80)
+
+        def request(method, path, body=None, headers=None):
+            connection.request(method, prefix + path, body=body, headers=headers or {})
+            response = connection.getresponse()
+            return (
+                response.status,
+                response.getheader("Content-Encoding"),
+                response.read(),
+            )
+
+        return request
+
+    return client
+
+
+def decode_body(encoding, content):
+    # Como el navegador, descomprimimos para leer la respuesta
+    if encoding == "gzip":
+        return gzip.decompress(content)
+    if encoding == "br" and brotli is not None:
+        return brotli.decompress(content)
+    return content
+
+
+def find_component(node, component_id):
+    """Propiedades del componente ``component_id`` en el JSON del layout."""
+    if isinstance(node, list):
+        for child in node:
+            found = find_component(child, component_id)
+            if found is not None:
+                return found
+    elif isinstance(node, dict):
+        props = node.get("props", {})
+        if props.get("id") == component_id:
+            return props
+        return find_component(props.get("children"), component_id)
+    return None
+
+
+def read_controls(layout):
+    """Rejilla de cada slider y valores del desplegable de habitaciones."""
+    controls = {}
+    for slider in [AREA_SLIDER, PRICE_SLIDER]:
+        props = find_component(layout, slider)
+        # El último punto es el máximo aunque no caiga en la rejilla
+        controls[slider] = [
+            *np.arange(props["min"], props["max"], props["step"]).tolist(),
+            props["max"],
+        ]
+    props = find_component(layout, ROOM_DROPDOWN)
+    controls[ROOM_DROPDOWN] = [option["value"] for option in props["options"]]
+    return controls
+
+
+def split_output(output):
+    # "..a.figure...b.data.." en los callbacks con varias salidas
+    if output.startswith(".."):
+        return [
+            dict(zip(["id", "property"], part.rsplit(".", 1)))
+            for part in output[2:-2].split("...")
+        ]
+    return dict(zip(["id", "property"], output.rsplit(".", 1)))
+
+
+def triggered_callbacks(dependencies):
+    """Callbacks que se ejecutan al mover cada control de los filtros."""
+    callbacks = {control: [] for control in MOVE_WEIGHTS}
+    for dependency in dependencies:
+        if dependency.get("clientside_function"):
+            continue
+        for item in dependency["inputs"]:
+            if item["id"] in callbacks and item["property"] == "value":
+                callbacks[item["id"]].append(dependency)
+    return callbacks
+
+
+class VirtualUser:
+    """Un usuario que recorre los filtros al azar, como en el navegador."""
+
+    def __init__(self, request, controls, callbacks, seed, accept_encoding):
+        self.request = request
+        self.controls = controls
+        self.callbacks = callbacks
+        self.rng = np.random.default_rng(seed)
+        self.headers = {"Content-Type": "application/json"}
+        if accept_encoding:
+            self.headers["Accept-Encoding"] = accept_encoding
+        # Posición de cada control en su rejilla, al principio sin filtros
+        self.position = {
+            AREA_SLIDER: [0, len(controls[AREA_SLIDER]) - 1],
+            PRICE_SLIDER: [0, len(controls[PRICE_SLIDER]) - 1],
+            ROOM_DROPDOWN: 0,
+        }
+        # Valores que el navegador guarda de respuestas anteriores
+        self.values = {}
+
+    def value(self, component_id, prop):
+        if component_id in self.position:
+            position = self.position[component_id]
+            grid = self.controls[component_id]
+            if component_id == ROOM_DROPDOWN:
+                return grid[position]
+            return [float(grid[position[0]]), float(grid[position[1]])]
+        if component_id.endswith("-visible") and prop == "data":
+            # El usuario ya ha visto todas las secciones de la página
+            return True
+        return self.values.get((component_id, prop))
+
+    def move(self):
+        """Cambia un control al azar y devuelve su id.
+
+        El navegador no dispara los callbacks si el valor no cambia, así que
+        se repite hasta obtener un estado distinto.
+        """
+        controls = list(MOVE_WEIGHTS)
+        while True:
+            control = controls[
+                self.rng.choice(len(controls), p=list(MOVE_WEIGHTS.values()))
+            ]
+            if control == ROOM_DROPDOWN:
+                position = int(self.rng.integers(len(self.controls[control])))
+            else:
+                # Se arrastra uno de los dos extremos sin cruzar el otro
+                low, high = self.position[control]
+                shift = int(self.rng.integers(1, MAX_SLIDER_STEPS + 1))
+                shift *= int(self.rng.choice([-1, 1]))
+                if self.rng.integers(2) == 0:
+                    low = int(np.clip(low + shift, 0, high))
+                else:
+                    last = len(self.controls[control]) - 1
+                    high = int(np.clip(high + shift, low, last))
+                position = [low, high]
+            if position != self.position[control]:
+                self.position[control] = position
+                return control
+
+    def payload(self, dependency, changed):
+        return {
+            "output": dependency["output"],
+            "outputs": split_output(dependency["output"]),
+            "inputs": [
+                {**item, "value": self.value(item["id"], item["property"])}
+                for item in dependency["inputs"]
+            ],
+            "changedPropIds": [f"{changed}.value"],
+            "state": [
+                {**item, "value": self.value(item["id"], item["property"])}
+                for item in dependency["state"]
+            ],
+        }
+
+    def step(self, record):
+        """Mueve un control y envía los callbacks que dispara."""
+        changed = self.move()
+        for dependency in self.callbacks[changed]:
+            body = json.dumps(self.payload(dependency, changed)).encode("utf-8")
+            start = time.perf_counter()
+            status, encoding, content = self.request(
+                "POST", UPDATE_PATH, body=body, headers=self.headers
+            )
+            record(dependency["output"], time.perf_counter() - start, status, content)
+            if status == 200 and dependency["state"]:
+                self.remember(decode_body(encoding, content))
+
+    def remember(self, content):
+        try:
+            response = json.loads(content)["response"]
+        except (ValueError, KeyError):
+            return
+        for component_id, props in response.items():
+            for prop, value in props.items():
+                self.values[(component_id, prop)] = value
+
+
+def run_level(client_factory, controls, callbacks, users, duration, args):
+    """Lanza ``users`` usuarios durante ``duration`` segundos."""
+    lock = threading.Lock()
+    samples = []
+    stop_at = time.perf_counter() + duration
+
+    def record(output, seconds, status, content):
+        with lock:
+            samples.append((output, seconds, status, len(content)))
+
+    def walk(seed):
+        user = VirtualUser(
+            client_factory(), controls, callbacks, seed, args.accept_encoding
+        )
+        while time.perf_counter() < stop_at:
+            user.step(record)
+
+    # Las mismas semillas en cada nivel para comparar entre versiones
+    threads = [
+        threading.Thread(target=walk, args=(args.seed + i,)) for i in range(users)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return summarize(samples, elapsed, users)
+
+
+def summarize(samples, elapsed, users):
+    outputs = [sample[0] for sample in samples]
+    seconds = np.array([sample[1] for sample in samples])
+    status = np.array([sample[2] for sample in samples])
+    sizes = np.array([sample[3] for sample in samples])
+    errors = int((status >= 400).sum())
+    result = {
+        "users": users,
+        "elapsed_s": elapsed,
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": len(samples) / elapsed,
+        "mean_bytes": float(sizes.mean()) if len(sizes) else 0.0,
+        "total_bytes": int(sizes.sum()),
+        "latency": latency_summary(seconds) if len(seconds) else {},
+        "callbacks": {},
+    }
+    for output in sorted(set(outputs)):
+        selected = np.array([name == output for name in outputs])
+        result["callbacks"][output] = {
+            **latency_summary(seconds[selected]),
+            "mean_bytes": float(sizes[selected].mean()),
+        }
+    return result
+
+
+def print_level(result):
+    latency = result["latency"]
+    print(
+        f"{result['users']:>5} {result['requests']:>9} {result['errors']:>7} "
+        f"{result['throughput_rps']:>9.1f} {latency.get('p50_ms', 0):>9.1f} "
+        f"{latency.get('p95_ms', 0):>9.1f} {latency.get('p99_ms', 0):>9.1f} "
+        f"{result['mean_bytes']:>11.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--url", help="servidor ya arrancado (por defecto, la app en este proceso)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=DEFAULT_CONCURRENCY,
+        help="usuarios simultáneos de cada nivel",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help="segundos de cada nivel",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--accept-encoding",
+        default=DEFAULT_ACCEPT_ENCODING,
+        help="cabecera Accept-Encoding ('' para respuestas sin comprimir)",
+    )
+    parser.add_argument("--output", help="fichero JSON con los resultados")
+    args = parser.parse_args()
+
+    if args.url:
+        client_factory = http_client_factory(args.url)
+    else:
+        client_factory = local_client_factory()
+    request = client_factory()
+    _, encoding, layout = request("GET", "/_dash-layout")
+    controls = read_controls(json.loads(decode_body(encoding, layout)))
+    _, encoding, dependencies = request("GET", "/_dash-dependencies")
+    callbacks = triggered_callbacks(json.loads(decode_body(encoding, dependencies)))
+
+    print(
+        f"{'users':>5} {'requests':>9} {'errors':>7} {'req/s':>9} "
+        f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'bytes':>11}"
+    )
+    results = []
+    for users in args.concurrency:
+        result = run_level(
+            client_factory, controls, callbacks, users, args.duration, args
+        )
+        print_level(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(
+                {"url": args.url, "seed": args.seed, "levels": results}, f, indent=1
+            )
+
+
+if __name__ == "__main__":
+    main()
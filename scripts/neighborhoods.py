@@ -0,0 +1,144 @@
+"""Asignación del barrio de cada inmueble y agregados por barrio.
+
+Los inmuebles se procesan en bloques de tamaño fijo contra un STRtree de los
+polígonos de los barrios ya preparados, así que la memoria no depende del
+número total de filas. En el mismo recorrido se acumulan las sumas y cuentas
+con las que se calculan todos los agregados por barrio.
+"""
+
+import numpy as np
+import pandas as pd
+import shapely
+
+CHUNK_SIZE = 250_000
+
+# Columna agregada: (columna de origen, decimales del redondeo)
+NEIGHBORHOOD_MEANS = {
+    "UNITPRICE_MEAN": ("UNITPRICE", 2),
+    "PRICE_MEAN": ("PRICE", None),
+    "AGE_MEAN": ("AGE", 0),
+    "QUALITY_MEAN": ("CADASTRALQUALITYID", 2),
+}
+
+
+class NeighborhoodIndex:
+    def __init__(self, geometries):
+        self.geometries = np.asarray(geometries, dtype=object)
+        shapely.prepare(self.geometries)
+        self.tree = shapely.STRtree(self.geometries)
+
+    def assign(self, lon, lat):
+        """Posición del barrio que contiene cada punto (-1 si ninguno)."""
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        codes = np.full(len(lon), -1, dtype=np.int32)
+
+        # Candidatos por caja envolvente y comprobación exacta con los
+        # polígonos preparados, sin crear geometrías intermedias
+        point_idx, polygon_idx = self.tree.query(shapely.points(lon, lat))
+        inside = shapely.contains_xy(
+            self.geometries[polygon_idx], lon[point_idx], lat[point_idx]
+        )
+        point_idx, polygon_idx = point_idx[inside], polygon_idx[inside]
+
+        # Si un punto cae en varios barrios nos quedamos con el primero: con
+        # los pares ordenados por punto y barrio, la primera aparición de cada
+        # punto es la de su primer barrio
+        order = np.lexsort((polygon_idx, point_idx))
+        point_idx, polygon_idx = point_idx[order], polygon_idx[order]
+        points, first = np.unique(point_idx, return_index=True)
+        codes[points] = polygon_idx[first]
+        return codes
+
+
+class NeighborhoodStats:
+    """Sumas y cuentas por barrio, combinables entre bloques o ejecuciones."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        n = len(self.names)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.sums = {}
+        self.counts = {}
+        for source, _ in NEIGHBORHOOD_MEANS.values():
+            self.sums[source] = np.zeros(n)
+            self.counts[source] = np.zeros(n, dtype=np.int64)
+
+    def update(self, codes, chunk):
+        n = len(self.names)
+        valid = codes >= 0
+        codes = codes[valid]
+        self.count += np.bincount(codes, minlength=n)
+        for source in self.sums:
+            values = chunk[source].to_numpy(dtype=float)[valid]
+            present = ~np.isnan(values)
+            self.sums[source] += np.bincount(
+                codes[present], weights=values[present], minlength=n
+            )
+            self.counts[source] += np.bincount(codes[present], minlength=n)
+
+    def merge(self, other):
+        if other.names != self.names:
+            raise ValueError("Los agregados no corresponden a los mismos barrios")
+        self.count += other.count
+        for source in self.sums:
+            self.sums[source] += other.sums[source]
+            self.counts[source] += other.counts[source]
+        return self
+
+    def to_state(self):
+        # Sumas y cuentas tal cual, para seguir acumulando en otra ejecución
+        state = pd.DataFrame({"NEIGHBORHOOD": self.names, "COUNT": self.count})
+        for source in self.sums:
+            state[f"{source}_SUM"] = self.sums[source]
+            state[f"{source}_COUNT"] = self.counts[source]
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls(state["NEIGHBORHOOD"])
+        # Copias escribibles: se siguen acumulando con merge/update
+        stats.count = np.array(state["COUNT"], dtype=np.int64)
+        for source in stats.sums:
+            stats.sums[source] = np.array(state[f"{source}_SUM"], dtype=float)
+            stats.counts[source] = np.array(state[f"{source}_COUNT"], dtype=np.int64)
+        return stats
+
+    def to_frame(self):
+        frame = pd.DataFrame({"NEIGHBORHOOD": self.names})
+        total = pd.array(self.count, dtype="Int64")
+        total[self.count == 0] = pd.NA
+        frame["REAL_ESTATE_TOTAL"] = total
+        for column, (source, decimals) in NEIGHBORHOOD_MEANS.items():
+            with np.errstate(invalid="ignore", divide="ignore"):
+                mean = self.sums[source] / self.counts[source]
+            mean = np.where(self.counts[source] > 0, mean, np.nan)
+            frame[column] = mean if decimals is None else np.round(mean, decimals)
+        return frame
+
+
+def join_neighborhoods(chunks, polygons, name_column="NEIGHBORHOOD"):
+    """Añade la columna del barrio a cada bloque de inmuebles.
+
+    ``chunks`` es cualquier iterable de DataFrames con LONGITUDE y LATITUDE
+    (por ejemplo ``pd.read_csv(..., chunksize=...)``). Devuelve un generador de
+    bloques y los agregados, que quedan completos al agotar el generador.
+    """
+    index = NeighborhoodIndex(polygons.geometry)
+    names = polygons[name_column].to_numpy()
+    stats = NeighborhoodStats(names)
+
+    def generate():
+        for chunk in chunks:
+            codes = index.assign(chunk["LONGITUDE"], chunk["LATITUDE"])
+            stats.update(codes, chunk)
+            chunk = chunk.copy()
+            chunk[name_column] = np.where(codes >= 0, names[codes], None)
+            yield chunk
+
+    return generate(), stats
+
+
+def iter_chunks(df, chunk_size=CHUNK_SIZE):
+    for start in range(0, len(df), chunk_size):
+        yield df.iloc[start : start + chunk_size]
@@ -0,0 +1,219 @@
+"""Etapas del procesado de datos con caché en disco.
+
+Cada etapa declara sus ficheros de entrada, las etapas de las que depende y
+los ficheros que escribe. Su resultado se guarda con ``pickle`` bajo una clave
+que combina el nombre y la versión de la etapa, la huella del contenido de sus
+ficheros de entrada y las claves de sus dependencias, así que solo se vuelven a
+ejecutar las etapas cuyas entradas han cambiado. La versión hay que subirla a
+mano cuando cambia el código de la etapa.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+import columnar_store
+
+CACHE_VERSION = 1
+# Última duración de cada etapa calculada, para las métricas del dashboard
+TIMINGS_FILE = "timings.json"
+
+
+class Stage:
+    def __init__(
+        self, name, func, inputs=(), files=(), outputs=(), version=1, params=None
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.files = tuple(files)
+        self.outputs = tuple(outputs)
+        self.version = version
+        self.params = params or {}
+
+
+class Pipeline:
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.stages = {}
+        # Segundos de cada etapa calculada en la última ejecución
+        self.timings = {}
+
+    def stage(self, name, inputs=(), files=(), outputs=(), version=1, params=None):
+        """Decorador que registra una función como etapa.
+
+        La función recibe como argumentos los resultados de ``inputs``, en el
+        mismo orden. ``params`` son valores que no están en ningún fichero pero
+        de los que depende el resultado (forman parte de la clave).
+        """
+
+        def register(func):
+            missing = [
+                dependency for dependency in inputs if dependency not in self.stages
+            ]
+            if missing:
+                raise ValueError(f"{name}: etapas desconocidas {missing}")
+            self.stages[name] = Stage(
+                name, func, inputs, files, outputs, version, params
+            )
+            return func
+
+        return register
+
+    def key(self, name, _keys=None):
+        keys = {} if _keys is None else _keys
+        if name not in keys:
+            stage = self.stages[name]
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(f"{CACHE_VERSION}:{name}:{stage.version}".encode("utf-8"))
+            for param in sorted(stage.params):
+                digest.update(f"param:{param}={stage.params[param]!r}".encode("utf-8"))
+            for path in stage.files:
+                digest.update(f"file:{path}:".encode("utf-8"))
+                columnar_store.file_digest(path, digest)
+            for dependency in stage.inputs:
+                digest.update(f"input:{self.key(dependency, keys)}".encode("utf-8"))
+            keys[name] = digest.hexdigest()
+        return keys[name]
+
+    def _cache_path(self, name, key):
+        return os.path.join(self.cache_dir, f"{name}-{key}.pkl")
+
+    def _is_cached(self, name, key):
+        stage = self.stages[name]
+        return os.path.exists(self._cache_path(name, key)) and all(
+            os.path.exists(path) for path in stage.outputs
+        )
+
+    def _store(self, name, key, result):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._cache_path(name, key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Solo conservamos el resultado más reciente de cada etapa
+        self._discard(name, keep=self._cache_path(name, key))
+
+    def _discard(self, name, keep=None):
+        for path in glob.glob(os.path.join(self.cache_dir, f"{name}-*.pkl")):
+            if path != keep:
+                os.remove(path)
+
+    def _upstream(self, targets):
+        order = []
+
+        def visit(name):
+            if name not in self.stages:
+                raise KeyError(f"Etapa desconocida: {name}")
+            if name in order:
+                return
+            for dependency in self.stages[name].inputs:
+                visit(dependency)
+            order.append(name)
+
+        for name in targets:
+            visit(name)
+        return order
+
+    def run(self, targets=None, force=()):
+        """Ejecuta ``targets`` (las etapas finales por defecto) y sus dependencias.
+
+        Las etapas de ``force`` y todas las que dependen de ellas se vuelven a
+        calcular aunque estén en caché. Devuelve los resultados de ``targets``.
+        """
+        if targets is None:
+            # Las etapas finales; el resto solo se cargan si hacen falta
+            used = {dependency for s in self.stages.values() for dependency in s.inputs}
+            targets = [name for name in self.stages if name not in used]
+        targets = list(targets)
+        order = self._upstream(targets)
+        unknown = sorted(set(force) - set(self.stages))
+        if unknown:
+            raise KeyError(f"Etapas desconocidas: {unknown}")
+
+        forced = set()
+        for name in order:
+            stage = self.stages[name]
+            if name in force or forced.intersection(stage.inputs):
+                forced.add(name)
+
+        keys = {}
+        results = {}
+        self.timings = {}
+
+        def result(name):
+            if name in results:
+                return results[name]
+            key = self.key(name, keys)
+            if name not in forced and self._is_cached(name, key):
+                with open(self._cache_path(name, key), "rb") as f:
+                    results[name] = pickle.load(f)
+                print(f"{name}: en caché")
+            else:
+                stage = self.stages[name]
+                args = [result(dependency) for dependency in stage.inputs]
+                # La etapa va a reescribir sus ficheros, así que sus resultados
+                # anteriores dejan de valer aunque se interrumpa a medias
+                self._discard(name)
+                start = time.perf_counter()
+                results[name] = stage.func(*args)
+                self.timings[name] = time.perf_counter() - start
+                self._store(name, key, results[name])
+                print(f"{name}: calculada en {self.timings[name]:.1f} s")
+            return results[name]
+
+        try:
+            return {name: result(name) for name in targets}
+        finally:
+            self._save_timings()
+
+    def _save_timings(self):
+        # Se conserva la última duración de las etapas que ahora estaban en caché
+        timings = read_timings(self.cache_dir)
+        finished = time.time()
+        for name, seconds in self.timings.items():
+            timings[name] = {"seconds": seconds, "finished": finished}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, TIMINGS_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(timings, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+    def status(self):
+        """Clave y estado de la caché de cada etapa."""
+        keys = {}
+        rows = []
+        for name, stage in self.stages.items():
+            try:
+                key = self.key(name, keys)
+            except OSError:
+                # Falta algún fichero de entrada
+                key = None
+            rows.append(
+                {
+                    "stage": name,
+                    "key": key,
+                    "cached": key is not None and self._is_cached(name, key),
+                    "inputs": list(stage.inputs),
+                }
+            )
+        return rows
+
+
+def read_timings(cache_dir):
+    """Duración y fecha de la última vez que se calculó cada etapa."""
+    try:
+        with open(os.path.join(cache_dir, TIMINGS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
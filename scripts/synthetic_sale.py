@@ -0,0 +1,188 @@
+"""Inmuebles sintéticos de Valencia para pruebas de rendimiento.
+
+Genera inmuebles con las columnas de los volcados originales dentro de los
+barrios de ``valencia_polygons.csv``. Cada barrio recibe un número de
+inmuebles proporcional a su superficie y un nivel de precios propio, y las
+coordenadas se sortean dentro de su polígono. Las distancias al centro, al
+metro (las estaciones de ``valencia_metro.csv``) y a Blasco Ibáñez se
+calculan como en ``distances.py``, igual que las trae el volcado real. Con la misma semilla se
+obtienen siempre los mismos datos, y se escriben por bloques, así que sirve
+hasta decenas de millones de filas. Desde la raíz del repositorio:
+
+    python scripts/synthetic_sale.py 1000000 raw-data/synthetic_sale.csv
+
+El CSV se procesa como el volcado real con
+``SALE_RAW_PATH=raw-data/synthetic_sale.csv python scripts/data_processing.py``.
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from distances import (
+    BLASCO_IBANEZ,
+    CITY_CENTER,
+    NearestPointIndex,
+    distance_to_line_km,
+    haversine_km,
+)
+
+POLYGONS_CSV = "./data/valencia_polygons.csv"
+METRO_CSV = "./data/valencia_metro.csv"
+CHUNK_SIZE = 1_000_000
+PERIODS = [201803, 201806, 201809, 201812]
+
+# Probabilidad de cada tipo de construcción (BUILTTYPEID_1, _2 y _3)
+BUILT_TYPE_WEIGHTS = [0.1, 0.3, 0.6]
+
+
+def read_polygons(path=POLYGONS_CSV):
+    polygons = pd.read_csv(path, usecols=["NEIGHBORHOOD", "GEO_SHAPE"])
+    return polygons["NEIGHBORHOOD"].to_numpy(), shapely.from_wkt(polygons["GEO_SHAPE"])
+
+
+def points_in_polygon(shape, n, rng):
+    """``n`` puntos uniformes dentro de ``shape`` (muestreo por rechazo)."""
+    shapely.prepare(shape)
+    min_lon, min_lat, max_lon, max_lat = shape.bounds
+    fill = shape.area / ((max_lon - min_lon) * (max_lat - min_lat))
+    lon, lat, found = [], [], 0
+    while found < n:
+        size = int((n - found) / fill * 1.2) + 16
+        x = rng.uniform(min_lon, max_lon, size)
+        y = rng.uniform(min_lat, max_lat, size)
+        inside = shapely.contains_xy(shape, x, y)
+        lon.append(x[inside])
+        lat.append(y[inside])
+        found += int(inside.sum())
+    return np.concatenate(lon)[:n], np.concatenate(lat)[:n]
+
+
+def read_metro_index(path=METRO_CSV):
+    metro = pd.read_csv(path, usecols=["LONGITUDE", "LATITUDE"])
+    return NearestPointIndex(metro["LONGITUDE"], metro["LATITUDE"])
+
+
+def synthetic_chunk(n_rows, shapes, price_levels, metro_index, rng, first_id=0):
+    """``n_rows`` inmuebles con el esquema de los volcados originales."""
+    areas = shapely.area(shapes)
+    counts = rng.multinomial(n_rows, areas / areas.sum())
+    neighborhood = np.repeat(np.arange(len(shapes)), counts)
+    lon, lat = np.empty(n_rows), np.empty(n_rows)
+    start = 0
+    for index in np.flatnonzero(counts):
+        stop = start + counts[index]
+        lon[start:stop], lat[start:stop] = points_in_polygon(
+            shapes[index], counts[index], rng
+        )
+        start = stop
+
+    area = np.clip(np.round(rng.lognormal(np.log(90), 0.4, n_rows)), 25, 600)
+    rooms = np.clip(np.round(area / 30 + rng.normal(0, 0.8, n_rows)), 0, 9)
+    baths = np.clip(np.round(1 + rooms / 3 + rng.normal(0, 0.4, n_rows)), 1, 6)
+    built_type = rng.choice(3, size=n_rows, p=BUILT_TYPE_WEIGHTS)
+    year = np.where(
+        built_type == 0,
+        rng.integers(2010, 2019, n_rows),
+        rng.integers(1900, 2010, n_rows),
+    )
+    quality = rng.integers(0, 10, n_rows)
+
+    # Precio por metro cuadrado según el barrio, la calidad y el estado
+    unit_price = (
+        price_levels[neighborhood]
+        * (1 + 0.04 * (5 - quality))
+        * np.array([1.25, 0.85, 1.0])[built_type]
+        * rng.lognormal(0, 0.15, n_rows)
+    )
+    price = np.maximum(np.round(unit_price * area, -3), 1000)
+    lon, lat = np.round(lon, 7), np.round(lat, 7)
+
+    sale = pd.DataFrame(
+        {
+            "ASSETID": [f"A{first_id + i:09d}" for i in range(n_rows)],
+            "PERIOD": rng.choice(PERIODS, n_rows),
+            "PRICE": price,
+            "UNITPRICE": np.round(price / area, 2),
+            "CONSTRUCTEDAREA": area.astype(np.int64),
+            "ROOMNUMBER": rooms.astype(np.int64),
+            "BATHNUMBER": baths.astype(np.int64),
+            "HASTERRACE": (rng.random(n_rows) < 0.3).astype(np.int64),
+            "HASLIFT": (rng.random(n_rows) < 0.7).astype(np.int64),
+            "CONSTRUCTIONYEAR": year,
+            "CADCONSTRUCTIONYEAR": year,
+            "CADASTRALQUALITYID": quality,
+            "BUILTTYPEID_1": (built_type == 0).astype(np.int64),
+            "BUILTTYPEID_2": (built_type == 1).astype(np.int64),
+            "BUILTTYPEID_3": (built_type == 2).astype(np.int64),
+            "DISTANCE_TO_CITY_CENTER": haversine_km(lon, lat, *CITY_CENTER),
+            "DISTANCE_TO_METRO": metro_index.nearest(lon, lat)[1],
+            "DISTANCE_TO_BLASCO": distance_to_line_km(lon, lat, BLASCO_IBANEZ),
+            "LONGITUDE": lon,
+            "LATITUDE": lat,
+        }
+    )
+    # Mezclamos las filas para que no queden ordenadas por barrio
+    return sale.iloc[rng.permutation(n_rows)].reset_index(drop=True)
+
+
+def iter_synthetic_sale(
+    n_rows,
+    polygons_path=POLYGONS_CSV,
+    seed=0,
+    chunk_size=CHUNK_SIZE,
+    metro_path=METRO_CSV,
+):
+    """Bloques de inmuebles sintéticos, ``n_rows`` en total."""
+    _, shapes = read_polygons(polygons_path)
+    metro_index = read_metro_index(metro_path)
+    rng = np.random.default_rng(seed)
+    price_levels = rng.uniform(1200, 4500, len(shapes))
+    for first_id in range(0, n_rows, chunk_size):
+        yield synthetic_chunk(
+            min(chunk_size, n_rows - first_id),
+            shapes,
+            price_levels,
+            metro_index,
+            rng,
+            first_id,
+        )
+
+
+def write_synthetic_sale(
+    n_rows,
+    path,
+    polygons_path=POLYGONS_CSV,
+    seed=0,
+    chunk_size=CHUNK_SIZE,
+    metro_path=METRO_CSV,
+):
+    for i, chunk in enumerate(
+        iter_synthetic_sale(n_rows, polygons_path, seed, chunk_size, metro_path)
+    ):
+        chunk.to_csv(path, mode="w" if i == 0 else "a", header=i == 0, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("rows", type=int, help="número de inmuebles")
+    parser.add_argument("output", help="CSV de salida")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--polygons", default=POLYGONS_CSV, help="CSV con los barrios (GEO_SHAPE)"
+    )
+    parser.add_argument(
+        "--metro", default=METRO_CSV, help="CSV con las estaciones de metro"
+    )
+    args = parser.parse_args()
+    write_synthetic_sale(
+        args.rows, args.output, args.polygons, args.seed, metro_path=args.metro
+    )
+    print(f"{args.rows} inmuebles guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()